@@ -0,0 +1 @@
+# 性能测试脚本，在 异步爬虫实现 目录下用 python -m benchmarks.模块名 运行
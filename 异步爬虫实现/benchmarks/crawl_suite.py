@@ -0,0 +1,216 @@
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import shutil
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+
+from crawl_engine.backends import get_backend
+
+
+# 爬虫各后端的性能测试套件
+# 原来只能对着公网 CDN 比较各个爬虫，结果受网络波动影响，离线时也没法测
+# 这里先在子进程里启动 benchmarks.image_server ，再让每个后端分别爬取 10 、1000 、
+# 10000 个 URL ，每次爬取都是一个单独的子进程，记录吞吐量、p99 延迟、峰值 RSS 和 CPU 时间，
+# 结果保存为 JSON 文件。指定基准文件时与之比较，变差超过容许比例的指标报告为回归，
+# 这时退出码为 1 ，可以放在持续集成里运行
+# 用法：python -m benchmarks.crawl_suite [--baseline 基准文件] [其它参数]
+# 基准文件就是之前某次运行保存的结果文件
+
+BACKENDS = ('blocking', 'threads', 'selectors', 'generator', 'greenlet',
+            'pyuv')
+SIZES = (10, 1000, 10000)
+
+# 比较的指标，第二项为 True 表示数值越大越差
+METRICS = (('throughput', False), ('p99', True), ('rss', True),
+           ('cpu', True))
+
+SUMMARY = re.compile(r'成功 (\d+) 个，失败 (\d+) 个')
+
+
+# 缺少第三方库的后端跳过
+def available(backend):
+    try:
+        get_backend(backend)
+    except ImportError:
+        return False
+    return True
+
+
+# 启动图片服务器，返回子进程和端口号
+def start_server(server_args):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.image_server'] + server_args,
+        stdout=subprocess.PIPE)
+    line = process.stdout.readline().decode()
+    if not line.startswith('port '):
+        process.kill()
+        raise RuntimeError('图片服务器启动失败')
+    return process, int(line.split()[1])
+
+
+def write_urls(directory, port, n):
+    path = os.path.join(directory, 'urls_{}.txt'.format(n))
+    with open(path, 'w') as f:
+        for i in range(n):
+            f.write('http://127.0.0.1:{}/img/{}.png\n'.format(port, i))
+    return path
+
+
+# 在子进程里爬取一次，返回各项指标
+# 子进程结束后用 os.wait4 回收，得到它自己的 CPU 时间和峰值 RSS
+def run_once(backend, urls_file, n, extra, timeout):
+    out_dir = tempfile.mkdtemp(prefix='crawl_bench_')
+    report = os.path.join(out_dir, 'timing.json')
+    command = [sys.executable, '-m', 'crawl_engine', '-b', backend,
+               '-o', out_dir, '--timing-report', report] + extra + [urls_file]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    timer = threading.Timer(timeout, process.kill)
+    timer.start()
+    try:
+        output = process.stdout.read().decode()
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        process.stdout.close()
+        with open(report) as f:
+            timings = json.load(f)
+    except OSError:
+        raise RuntimeError('{} 爬取 {} 个 URL 时没有正常结束：\n{}'.format(
+            backend, n, output[-2000:]))
+    finally:
+        timer.cancel()
+        shutil.rmtree(out_dir, ignore_errors=True)
+    match = SUMMARY.findall(output)
+    succeeded, failed = map(int, match[-1]) if match else (0, n)
+    return {
+        'seconds': seconds,
+        'succeeded': succeeded,
+        'failed': failed,
+        'throughput': succeeded / seconds,
+        'p99': timings['total']['p99'] * 1000,
+        'rss': usage.ru_maxrss / 1024,
+        'cpu': usage.ru_utime + usage.ru_stime,
+    }
+
+
+# 重复运行 repeat 次，每项指标取中位数
+def run(backend, urls_file, n, extra, timeout, repeat):
+    runs = [run_once(backend, urls_file, n, extra, timeout)
+            for _ in range(repeat)]
+    result = {'backend': backend, 'urls': n}
+    for key in runs[0]:
+        result[key] = statistics.median(run[key] for run in runs)
+    return result
+
+
+# 与基准比较，返回回归的描述列表
+def compare(results, baseline, tolerance):
+    base = {(item['backend'], item['urls']): item
+            for item in baseline['results']}
+    regressions = []
+    for item in results:
+        old = base.get((item['backend'], item['urls']))
+        if old is None:
+            continue
+        for metric, higher_is_worse in METRICS:
+            new_value, old_value = item[metric], old[metric]
+            if higher_is_worse:
+                worse = new_value > old_value * (1 + tolerance)
+            else:
+                worse = new_value < old_value * (1 - tolerance)
+            if worse:
+                regressions.append('{} {} 个 URL 的 {} 从 {:.2f} 变为 {:.2f}'
+                                   .format(item['backend'], item['urls'],
+                                           metric, old_value, new_value))
+    return regressions
+
+
+def print_row(item):
+    print('{:>10} {:>7} {:>10.1f} {:>10.1f} {:>10.1f} {:>8.2f} {:>6}'.format(
+        item['backend'], item['urls'], item['throughput'], item['p99'],
+        item['rss'], item['cpu'], item['failed']))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='crawl_suite')
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help='逗号分隔的后端名称，默认为全部后端')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='逗号分隔的 URL 数量，默认为 10,1000,10000')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='每种组合运行的次数，各项指标取中位数')
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='每次爬取的超时秒数，默认为 600')
+    parser.add_argument('--crawler-args', default='',
+                        help='传给 crawl_engine 的其它参数，'
+                             '比如 "--concurrency 500"')
+    parser.add_argument('--server-args', default='',
+                        help='传给 benchmarks.image_server 的参数，'
+                             '比如 "--latency 5 --error-rate 0.01"')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='结果文件，默认为 benchmark_results.json')
+    parser.add_argument('--baseline', help='作为基准的结果文件')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='与基准比较时容许变差的比例，默认为 0.2')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server_args = shlex.split(args.server_args)
+    extra = shlex.split(args.crawler_args)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    backends = []
+    for backend in args.backends.split(','):
+        if available(backend):
+            backends.append(backend)
+        else:
+            print('跳过 {} 后端：缺少依赖的第三方库'.format(backend))
+    server, port = start_server(server_args)
+    directory = tempfile.mkdtemp(prefix='crawl_bench_urls_')
+    results = []
+    try:
+        # 汉字占两列宽，表头的宽度按显示宽度减去汉字个数
+        print('{:>8} {:>6} {:>10} {:>10} {:>10} {:>8} {:>4}'.format(
+            '后端', 'URL 数', 'URL/s', 'p99 ms', 'RSS MB', 'CPU s', '失败'))
+        for n in sizes:
+            urls_file = write_urls(directory, port, n)
+            for backend in backends:
+                item = run(backend, urls_file, n, extra, args.timeout,
+                           args.repeat)
+                print_row(item)
+                results.append(item)
+    finally:
+        server.kill()
+        server.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+    with open(args.output, 'w') as f:
+        json.dump({'server_args': server_args, 'crawler_args': extra,
+                   'results': results}, f, indent=2)
+    print('结果已保存到 {}'.format(args.output))
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('server_args') != server_args or \
+            baseline.get('crawler_args') != extra:
+        print('注意：基准使用的服务器或爬虫参数与本次不同')
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print('回归：' + line)
+    if not regressions:
+        print('与基准相比没有发现回归')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import os
+import time
+from urllib.parse import urlparse
+
+from crawl_engine.common import Config, Download
+from crawl_engine.loop import EventLoop
+from crawl_engine.writer import DiskWriter
+
+
+# 写文件对事件循环延迟的影响
+# 用每次 write 都睡眠 delay 秒的文件对象模拟慢速磁盘，事件循环里每隔 1 毫秒
+# 向 Download 传入一个 64KB 的数据片段，同时每隔 10 毫秒检查一次定时器晚到了多久
+# 对比在事件循环里直接写文件和交给写线程两种方式的延迟
+# 用法：python -m benchmarks.disk_writer
+
+CHUNK = b'\0' * 65536
+FILES = 20
+CHUNKS_PER_FILE = 20
+
+
+# 慢速磁盘上的文件，实际写入 /dev/null
+class SlowFile:
+    def __init__(self, delay):
+        self.delay = delay
+        self.file = open(os.devnull, 'wb')
+
+    def write(self, data):
+        time.sleep(self.delay)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    # 作为 InlineWriter 打开的文件时，参数与 writer.AsyncFile.close 相同
+    def close(self, done=True):
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+# 和 DiskWriter 的接口相同，但在事件循环里直接写文件，相当于原来的做法
+class InlineWriter:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def open(self, path, url=None):
+        return SlowFile(self.delay)
+
+    def close(self):
+        pass
+
+
+class Bench:
+    def __init__(self, writer):
+        self.loop = EventLoop()
+        self.writer = writer
+        self.config = Config(out_dir=os.devnull)
+        self.lags = []
+        self.remaining = FILES * CHUNKS_PER_FILE
+
+    # 记录定时器实际运行的时间比预定的晚了多久
+    def probe(self, expected):
+        self.lags.append(time.monotonic() - expected)
+        if self.remaining:
+            self.loop.call_later(0.01, self.probe, time.monotonic() + 0.01)
+
+    def produce(self, download, n):
+        download.feed(CHUNK)
+        self.remaining -= 1
+        if n + 1 < CHUNKS_PER_FILE:
+            self.loop.call_later(0.001, self.produce, download, n + 1)
+        else:
+            self.start_file()
+
+    def start_file(self):
+        if not self.remaining:
+            return
+        download = Download(self.config, urlparse('http://bench/x'),
+                            self.writer)
+        download.feed('HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n'.format(
+            len(CHUNK) * CHUNKS_PER_FILE).encode())
+        self.loop.call_later(0.001, self.produce, download, 0)
+
+    # 返回延迟的中位数、99 分位数和最大值，单位为毫秒
+    def run(self):
+        self.loop.call_later(0.01, self.probe, time.monotonic() + 0.01)
+        self.start_file()
+        self.loop.run()
+        self.writer.close()
+        lags = sorted(self.lags)
+        return (lags[len(lags) // 2] * 1000, lags[int(len(lags) * 0.99)] * 1000,
+                lags[-1] * 1000)
+
+
+def main():
+    print('{:>8} {:>8} {:>10} {:>10} {:>10}'.format(
+        '每次写入', '方式', 'p50 ms', 'p99 ms', '最大 ms'))
+    for delay in (0, 0.005, 0.02):
+        writers = (
+            ('直接写入', InlineWriter(delay)),
+            ('写线程', DiskWriter(opener=lambda path, mode: SlowFile(delay))),
+        )
+        for name, writer in writers:
+            print('{:>6}ms {:>8} {:10.2f} {:10.2f} {:10.2f}'.format(
+                int(delay * 1000), name, *Bench(writer).run()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import sys
+import time
+import socket
+from selectors import EVENT_READ
+
+from greenlet import greenlet
+
+from crawl_engine.backends.hub import Hub, Loop, Watcher
+
+
+# greenlet 后端事件分发的性能测试
+# 创建 n 个等待可读事件的协程，每轮唤醒其中 batch 个，统计每个事件的平均分发时间
+# 用字典按 (文件描述符, 事件) 查找 Watcher 时，平均时间不随 n 增长
+# 加上 --legacy 参数时同时测试原来用列表存储 Watcher 的版本作为对比
+# 用法：python -m benchmarks.hub_dispatch [--legacy]
+
+
+# 原来的列表版本，每个就绪事件都复制并遍历整个列表，每次等待都注册和注销一次
+class LegacyLoop(Loop):
+    def __init__(self):
+        super().__init__()
+        self.watchers = []
+
+    def _run_watchers(self):
+        ready_events = self.selector.select(self.timers.timeout())
+        for event_key, _ in ready_events:
+            if event_key.data is not None:
+                event_key.data()
+                continue
+            for watcher in self.watchers[:]:
+                if watcher.fd == event_key.fd and \
+                        watcher.event_constant == event_key.events:
+                    self.watchers.remove(watcher)
+                    self.selector.unregister(watcher.fd)
+                    watcher.run()
+
+    def io(self, fd, event_constant):
+        self.selector.register(fd, event_constant)
+        watcher = Watcher(fd, event_constant)
+        watcher.callback = greenlet.getcurrent().switch
+        self.watchers.append(watcher)
+        return watcher
+
+    def cancel_io(self, watcher):
+        self.watchers.remove(watcher)
+        self.selector.unregister(watcher.fd)
+
+
+class Bench:
+    def __init__(self, n, batch=100, rounds=50, legacy=False):
+        self.n = n
+        self.batch = batch
+        self.rounds = rounds
+        self.hub = Hub()
+        if legacy:
+            self.hub.loop = LegacyLoop()
+        self.socks = []
+        # 每个 socketpair 的两端各由一个协程等待，向一端写入数据唤醒另一端的协程
+        # 这样 n 个协程只占用 n 个文件描述符
+        for _ in range(n // 2):
+            a, b = socket.socketpair()
+            a.setblocking(False)
+            b.setblocking(False)
+            self.socks.append((a, b))
+            self.socks.append((b, a))
+        self.stopping = False
+        self.events = 0
+        self.elapsed = 0
+
+    # 等待协程，被唤醒后读掉数据接着等待
+    def waiter(self, sock):
+        while True:
+            self.hub.wait(sock.fileno(), EVENT_READ)
+            sock.recv(16)
+            if self.stopping:
+                self.hub.loop.forget(sock.fileno())
+                return
+            self.events += 1
+
+    # 驱动协程，每轮唤醒 batch 个等待协程，然后让出一次 hub
+    def driver(self):
+        start = time.perf_counter()
+        for r in range(self.rounds):
+            first = r * self.batch % len(self.socks)
+            for i in range(first, first + self.batch):
+                _, peer = self.socks[i % len(self.socks)]
+                peer.send(b'x')
+            self.hub.sleep(0)
+        self.elapsed = time.perf_counter() - start
+        # 唤醒全部等待协程，让它们结束
+        self.stopping = True
+        for _, peer in self.socks:
+            peer.send(b'x')
+
+    def run(self):
+        for sock, _ in self.socks:
+            self.hub.spawn(self.waiter, sock)
+        self.hub.spawn(self.driver)
+        self.hub.switch()
+        for a, b in self.socks[::2]:
+            a.close()
+            b.close()
+        self.hub.resolver.close()
+        return self.elapsed / self.events * 1e6
+
+
+def main():
+    legacy = '--legacy' in sys.argv[1:]
+    sizes = (100, 1000, 10000)
+    print('{:>8} {:>14} {:>14}'.format('协程数', '字典 us/事件',
+                                        '列表 us/事件' if legacy else ''))
+    for n in sizes:
+        new = Bench(n).run()
+        old = '{:14.2f}'.format(Bench(n, legacy=True).run()) if legacy else ''
+        print('{:>8} {:14.2f} {}'.format(n, new, old))
+
+
+if __name__ == '__main__':
+    main()
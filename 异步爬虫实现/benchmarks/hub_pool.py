@@ -0,0 +1,75 @@
+import sys
+import time
+import resource
+
+from crawl_engine.backends.hub import Hub, Pool
+
+
+# greenlet 后端协程池的内存占用
+# 每个任务切换到 hub 一次再返回，相当于等待一次网络事件
+# 通过 Pool.imap_unordered 提交 n 个任务，同时运行的协程不超过 size 个，
+# 打印用时、新建的协程数和进程的峰值 RSS ，峰值 RSS 不随 n 增长
+# 加上 --unbounded 参数时再测试原来为每个任务调用一次 Hub.spawn 的做法作为对比，
+# 它的峰值 RSS 在前一个测试之后打印，随 n 线性增长
+# 用法：python -m benchmarks.hub_pool [任务数] [--unbounded]
+
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_pool(n, size=1000):
+    hub = Hub()
+    pool = Pool(hub, size)
+    results = []
+
+    def work(i):
+        hub.sleep(0)
+        return i
+
+    def feed():
+        total = 0
+        for _ in pool.imap_unordered(work, range(n)):
+            total += 1
+        results.append(total)
+
+    start = time.perf_counter()
+    hub.spawn(feed)
+    hub.switch()
+    hub.resolver.close()
+    return time.perf_counter() - start, results[0], pool.created
+
+
+def bench_unbounded(n):
+    hub = Hub()
+    results = []
+
+    def work(i):
+        hub.sleep(0)
+        results.append(i)
+
+    start = time.perf_counter()
+    for i in range(n):
+        hub.spawn(work, i)
+    hub.switch()
+    hub.resolver.close()
+    return time.perf_counter() - start, len(results), n
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    n = int(args[0]) if args else 1000000
+    # 汉字占两列宽，表头的宽度按显示宽度减去汉字个数
+    print('{:>10} {:>8} {:>8} {:>10} {:>10}'.format(
+        '方式', '任务数', '用时 s', '新建协程', 'RSS MB'))
+    elapsed, done, created = bench_pool(n)
+    print('{:>12} {:>11} {:>10.2f} {:>14} {:>10.1f}'.format(
+        'Pool', done, elapsed, created, peak_rss()))
+    if '--unbounded' in sys.argv[1:]:
+        elapsed, done, created = bench_unbounded(n)
+        print('{:>12} {:>11} {:>10.2f} {:>14} {:>10.1f}'.format(
+            'Hub.spawn', done, elapsed, created, peak_rss()))
+
+
+if __name__ == '__main__':
+    main()
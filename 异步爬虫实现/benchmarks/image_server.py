@@ -0,0 +1,161 @@
+import sys
+import math
+import zlib
+import random
+import asyncio
+import argparse
+
+
+# 本地的合成图片服务器，代替公网的 CDN 给爬虫做性能测试
+# 原来只能对着公网图片测试，结果受网络波动影响，离线时也无法运行
+# 路径为 /img/编号.png ，图片大小由编号和随机种子决定，同样的参数每次得到同样的文件
+# 可以设置大小的分布、每个请求的延迟、每个连接的带宽上限和出错的比例
+# 支持 keep-alive 和管线化，用 asyncio 实现，一个进程可以应付上万个连接
+# 用法：python -m benchmarks.image_server [--port 端口] [其它参数]
+# 启动后打印一行 "port 端口号" ，端口为 0 时由系统分配
+
+BLOCK = random.Random(0).randbytes(1 << 20)  # 响应体从这块数据里截取
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+
+class ImageServer:
+    # size 为图片大小的中位数字节数，sigma 为对数正态分布的形状参数，0 表示固定大小
+    # latency 为每个请求的平均延迟秒数，jitter 为延迟上下浮动的比例
+    # bandwidth 为每个连接每秒最多发送的字节数，0 表示不限制
+    # error_rate 为请求失败的比例，失败的请求一半返回 503 ，一半在发送中途断开连接
+    def __init__(self, size=16384, sigma=0.8, max_size=1 << 20, latency=0.002,
+                 jitter=0.5, bandwidth=0, error_rate=0, seed=0):
+        self.size = size
+        self.sigma = sigma
+        self.max_size = min(max_size, len(BLOCK))
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.requests = 0
+
+    # 图片编号对应的大小，只由编号和种子决定
+    def size_of(self, number):
+        if not self.sigma:
+            return self.size
+        rng = random.Random(zlib.crc32(b'%d:%d' % (self.seed, number)))
+        size = int(rng.lognormvariate(math.log(self.size), self.sigma))
+        return max(len(PNG_HEADER), min(size, self.max_size))
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                if not await self.respond(head, writer):
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    # 返回 False 表示关闭连接
+    async def respond(self, head, writer):
+        self.requests += 1
+        lines = head.decode('latin-1').split('\r\n')
+        path = lines[0].split(' ')[1] if ' ' in lines[0] else '/'
+        close = any(line.lower().startswith('connection:') and
+                    'close' in line.lower() for line in lines[1:])
+        if self.latency:
+            await asyncio.sleep(self.latency * (
+                1 + self.jitter * (2 * self.random.random() - 1)))
+        number = self.number_of(path)
+        if number is None:
+            return await self.send(writer, '404 Not Found', b'', close)
+        if self.error_rate and self.random.random() < self.error_rate:
+            if self.random.random() < 0.5:
+                return await self.send(writer, '503 Service Unavailable', b'',
+                                       close)
+            # 发送一半就断开，模拟网络中断
+            body = self.body(number)
+            await self.send(writer, '200 OK', body[:len(body) // 2], True,
+                            len(body))
+            return False
+        return await self.send(writer, '200 OK', self.body(number), close)
+
+    def number_of(self, path):
+        name = path.split('?', 1)[0]
+        if not (name.startswith('/img/') and name.endswith('.png')):
+            return None
+        number = name[5:-4]
+        return int(number) if number.isdigit() else None
+
+    def body(self, number):
+        size = self.size_of(number)
+        start = number * 4099 % (len(BLOCK) - size + 1)
+        return PNG_HEADER + BLOCK[start:start + size - len(PNG_HEADER)]
+
+    # 发送响应，有带宽限制时分块发送，每块之后按带宽等待
+    async def send(self, writer, status, body, close, length=None):
+        head = 'HTTP/1.1 {}\r\nContent-Type: image/png\r\n' \
+               'Content-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+                   status, len(body) if length is None else length,
+                   'close' if close else 'keep-alive')
+        writer.write(head.encode())
+        if not self.bandwidth:
+            writer.write(body)
+            await writer.drain()
+            return not close
+        chunk = max(1024, self.bandwidth // 50)
+        for i in range(0, len(body), chunk):
+            writer.write(body[i:i + chunk])
+            await writer.drain()
+            await asyncio.sleep(len(body[i:i + chunk]) / self.bandwidth)
+        return not close
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='image_server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--size', type=int, default=16384,
+                        help='图片大小的中位数，单位为字节，默认为 16384')
+    parser.add_argument('--sigma', type=float, default=0.8,
+                        help='对数正态分布的形状参数，0 表示所有图片一样大')
+    parser.add_argument('--max-size', type=int, default=1 << 20,
+                        help='图片大小的上限，默认为 1 MB')
+    parser.add_argument('--latency', type=float, default=2,
+                        help='每个请求的平均延迟毫秒数，默认为 2')
+    parser.add_argument('--jitter', type=float, default=0.5,
+                        help='延迟上下浮动的比例，默认为 0.5')
+    parser.add_argument('--bandwidth', type=float, default=0,
+                        help='每个连接的带宽上限，单位为 MB/s ，0 表示不限制')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='请求失败的比例，默认为 0')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def server_from_args(args):
+    return ImageServer(args.size, args.sigma, args.max_size,
+                       args.latency / 1000, args.jitter,
+                       int(args.bandwidth * 2 ** 20), args.error_rate,
+                       args.seed)
+
+
+async def serve(args):
+    server = server_from_args(args)
+    # backlog 要足够大，否则上万个连接同时到达时会被拒绝
+    tcp = await asyncio.start_server(server.handle, args.host, args.port,
+                                     backlog=4096)
+    print('port', tcp.sockets[0].getsockname()[1], flush=True)
+    async with tcp:
+        await tcp.serve_forever()
+
+
+def main(argv=None):
+    try:
+        asyncio.run(serve(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import time
+import socket
+from selectors import EVENT_READ
+
+from crawl_engine.loop import EventLoop, EpollLoop
+
+
+# DefaultSelector 和直接使用 epoll 的事件循环每秒能分发多少个事件
+# 注册 n 个套接字的可读事件，每轮向其中 batch 个写入一个字节，运行事件循环直到
+# 这些回调函数都被调用，只统计事件循环本身的时间，得出每秒分发的事件数
+# 回调函数每次读到 EAGAIN 为止，水平触发和边缘触发都能正确处理
+# 用法：python -m benchmarks.loop_events
+
+
+class Bench:
+    def __init__(self, loop, n, batch=256, events=200000):
+        self.loop = loop
+        self.batch = batch
+        self.rounds = events // batch
+        self.socks = []
+        # 每个 socketpair 的两端都注册，向一端写入数据唤醒另一端
+        for _ in range(n // 2):
+            a, b = socket.socketpair()
+            a.setblocking(False)
+            b.setblocking(False)
+            self.socks.append((a, b))
+            self.socks.append((b, a))
+        self.events = 0
+
+    def readable(self, sock):
+        def callback():
+            try:
+                while True:
+                    sock.recv(16)
+            except BlockingIOError:
+                pass
+            self.events += 1
+        return callback
+
+    def run(self):
+        for sock, _ in self.socks:
+            self.loop.register(sock.fileno(), EVENT_READ, self.readable(sock))
+        elapsed = 0
+        for r in range(self.rounds):
+            first = r * self.batch % len(self.socks)
+            for i in range(first, first + self.batch):
+                self.socks[i % len(self.socks)][1].send(b'x')
+            target = self.events + min(self.batch, len(self.socks))
+            start = time.perf_counter()
+            while self.events < target:
+                self.loop._run_once()
+            elapsed += time.perf_counter() - start
+        for sock, _ in self.socks:
+            self.loop.unregister(sock.fileno())
+            sock.close()
+        self.loop.close()
+        return self.events / elapsed
+
+
+def main():
+    # 汉字占两列宽，表头的宽度按显示宽度减去汉字个数
+    print('{:>4} {:>14} {:>14}'.format('套接字数', 'selectors 事件/s',
+                                        'epoll 事件/s'))
+    for n in (100, 1000, 10000):
+        old = Bench(EventLoop(), n).run()
+        new = Bench(EpollLoop(), n).run()
+        print('{:>8} {:16.0f} {:16.0f}'.format(n, old, new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import socket
+import resource
+import threading
+import subprocess
+
+from crawl_engine.buffer import ReadBuffer
+from crawl_engine.http_parser import ResponseParser
+
+
+# 接收路径的性能测试，对比 recv 和 recv_into 两种方式
+# 写线程通过 socketpair 发送一个 size MB 的 HTTP 响应，读的一方交给解析器并写入 /dev/null
+# 每种方式在单独的子进程里运行，这样峰值 RSS 互不影响
+# 用法：python -m benchmarks.recv_path [MB 数]
+
+CHUNK = b'\0' * 65536
+
+
+def writer(sock, size):
+    sock.sendall('HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n'.format(
+        size).encode())
+    for _ in range(size // len(CHUNK)):
+        sock.sendall(CHUNK)
+    sock.close()
+
+
+# 在子进程里运行，返回 (秒数, 读取次数, 为收到的数据分配的字节数, 峰值 RSS)
+def measure(mode, size):
+    rsock, wsock = socket.socketpair()
+    out = open(os.devnull, 'wb')
+    parser = ResponseParser(on_body=out.write)
+    thread = threading.Thread(target=writer, args=(wsock, size))
+    start = time.perf_counter()
+    thread.start()
+    reads = allocated = 0
+    buffer = ReadBuffer()
+    while not parser.done:
+        if mode == 'recv':
+            # 原来的方式，每次 recv 新建一个 bytes 对象
+            data = rsock.recv(4096)
+            reads += 1
+            allocated += len(data)
+        else:
+            data = buffer.recv_into(rsock)
+        parser.feed(data)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    rsock.close()
+    if mode != 'recv':
+        reads, allocated = buffer.reads, buffer.allocated
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, reads, allocated, maxrss
+
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        mode, mb = sys.argv[2], int(sys.argv[3])
+        print(*measure(mode, mb * 2 ** 20))
+        return
+    mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    print('下载 {} MB'.format(mb))
+    print('{:>10} {:>10} {:>10} {:>14} {:>12}'.format(
+        '方式', 'MB/s', '读取次数', '分配 KB', '峰值 RSS KB'))
+    for mode in ('recv', 'recv_into'):
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.recv_path', '--child', mode,
+             str(mb)])
+        elapsed, reads, allocated, maxrss = output.decode().split()
+        print('{:>10} {:10.1f} {:>10} {:14.0f} {:>12}'.format(
+            mode, mb / float(elapsed), reads, int(allocated) / 1024, maxrss))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import sys
+import time
+
+from crawl_engine.coroutine import Future, Task
+from crawl_engine.loop import EventLoop
+
+
+# 生成器协程框架的任务切换开销
+# 每个任务反复等待一个由事件循环回调设置结果的 Future ，和爬虫等待套接字事件的路径相同，
+# 统计每次切换的平均时间，对比原来在 set_value 里直接调用 step 的 Task 、
+# 经过就绪队列的 Task 运行 yield from 协程和 async def 协程三种情况
+# 另外创建一条等待链，每个任务等待前一个任务，原来的 Task 在链的起点结束时
+# 依次在同一个调用栈里运行后面的全部任务，链长超过递归深度上限时出错
+# 用法：python -m benchmarks.task_switch
+
+
+# 原来的 Task ，Future 有结果时在 set_value 的调用栈里直接运行协程的下一步
+class LegacyTask(Future):
+    def __init__(self, coro, loop=None):
+        super().__init__()
+        self.coro = coro
+        self.step(Future())
+
+    def step(self, future):
+        try:
+            new_future = self.coro.send(None)
+        except StopIteration as e:
+            self.set_value(e.value)
+            return
+        except Exception as e:
+            self.set_exception(e)
+            return
+        new_future.add_step_func(self.step)
+
+
+def switcher(loop, n):
+    for _ in range(n):
+        f = Future()
+        loop.call_soon(f.set_value, None)
+        yield from f
+
+
+async def async_switcher(loop, n):
+    for _ in range(n):
+        f = Future()
+        loop.call_soon(f.set_value, None)
+        await f
+
+
+# 返回每次切换的平均微秒数
+def switch_cost(task_class, coro_func, tasks=100, switches=1000):
+    loop = EventLoop()
+    for _ in range(tasks):
+        task_class(coro_func(loop, switches), loop)
+    start = time.perf_counter()
+    loop.run()
+    return (time.perf_counter() - start) / (tasks * switches) * 1e6
+
+
+def link(previous):
+    return (yield from previous)
+
+
+# 长度为 n 的等待链，全部结束时返回 True ，出错时返回异常的类名
+def chain(task_class, n):
+    loop = EventLoop()
+    first = Future()
+    task = first
+    for _ in range(n):
+        task = task_class(link(task), loop)
+    loop.call_soon(first.set_value, None)
+    # 原来的 Task 超过递归深度时，异常从 set_value 一直传到事件循环
+    try:
+        loop.run()
+    except RecursionError as e:
+        return type(e).__name__
+    if task.exception is not None:
+        return type(task.exception).__name__
+    return task.done
+
+
+def main():
+    print('每次切换的平均时间（微秒）')
+    print('  原来的 Task ，yield from 协程：{:.2f}'.format(
+        switch_cost(LegacyTask, switcher)))
+    print('  就绪队列 Task ，yield from 协程：{:.2f}'.format(
+        switch_cost(Task, switcher)))
+    print('  就绪队列 Task ，async def 协程：{:.2f}'.format(
+        switch_cost(Task, async_switcher)))
+    n = sys.getrecursionlimit() * 2
+    print('长度为 {} 的等待链'.format(n))
+    print('  原来的 Task：{}'.format(chain(LegacyTask, n)))
+    print('  就绪队列 Task：{}'.format(chain(Task, n)))
+
+
+if __name__ == '__main__':
+    main()
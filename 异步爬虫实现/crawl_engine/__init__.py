@@ -0,0 +1,4 @@
+# crawl_engine 包把本目录下十个 spider_*.py 的图片爬取逻辑合并成一个引擎
+# 各种实现方式（阻塞、多线程、selectors 回调、生成器 Task、greenlet hub、pyuv）
+# 都作为后端放在 backends 子包里，运行时通过命令行参数选择
+# 用法：python -m crawl_engine -b selectors urls.txt
@@ -0,0 +1,18 @@
+import importlib
+
+# 后端名称与模块名的对应关系，命令行参数 -b 的可选值就是这里的键
+# 模块在使用时才导入，这样没有安装 greenlet 或 pyuv 也能使用其它后端
+BACKENDS = {
+    'blocking': 'blocking',     # 对应 spider_sync.py
+    'threads': 'threads',       # 对应 spider_thread.py
+    'selectors': 'callback',    # 对应 spider_selectors.py
+    'generator': 'generator',   # 对应 spider_yield.py 和 spider_yield_from.py
+    'greenlet': 'hub',          # 对应 spider_greenlet.py 和 spider_realize_gevent.py
+    'pyuv': 'uv',               # 对应 spider_pyuv*.py 和 spider_gevent_pyuv.py
+}
+
+
+# 根据后端名称导入对应的模块，每个后端模块都提供 run(urls, config, results) 函数
+# results 为 common.Results 实例，后端通过它报告每个 URL 的最终结果
+def get_backend(name):
+    return importlib.import_module('.' + BACKENDS[name], __name__)
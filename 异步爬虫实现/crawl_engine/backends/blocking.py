@@ -0,0 +1,113 @@
+import time
+import socket
+from urllib.parse import urlparse
+
+from ..buffer import ReadBuffer
+from ..cache import open_cache
+from ..common import Download, address
+from ..decoding import TransferStats
+from ..http_parser import HTTPError
+from ..resolver import BlockingResolver
+from ..retry import Backoff, retryable
+from ..store import open_store
+from ..tls import TLSContext
+
+
+# 阻塞版爬虫，逐个 URL 连接、发送、接收
+class Crawler:
+    # store 为 store.BlobStore 实例时文件写入内容寻址存储，为 None 时直接写文件
+    def __init__(self, url, resolver, tls, backoff, store, cache, stats,
+                 timings, config):
+        self._url = url
+        self.url = urlparse(url)
+        self.resolver = resolver
+        self.tls = tls
+        self.backoff = backoff
+        self.store = store
+        self.cache = cache
+        self.stats = stats
+        self.timings = timings
+        self.config = config
+
+    # 下载失败时按指数退避重试，重试次数用完后抛出最后一次的异常
+    def fetch(self):
+        attempt = 0
+        while True:
+            download = Download(self.config, self.url, self.store,
+                                self.cache, self.stats, self.timings)
+            try:
+                self.download(download)
+                return
+            except (OSError, HTTPError) as e:
+                if not retryable(e, download) or \
+                        attempt >= self.backoff.retries:
+                    raise
+                delay = self.backoff.delay(attempt)
+                attempt += 1
+                print('URL: {} 下载失败: {}，{:.2f} 秒后第 {} 次重试'.format(
+                    self._url, e, delay, attempt))
+                time.sleep(delay)
+
+    def download(self, download):
+        # 先从解析器获取 IP 地址，然后阻塞运行，直到成功连接服务器
+        # 连接和每次接收数据都有超时时间，超时抛出 TimeoutError 异常
+        # https 的 URL 在连接之后进行 TLS 握手，阻塞的套接字调用一次就会完成
+        host, port = address(self.url)
+        start = time.monotonic()
+        ip_address = self.resolver.resolve(host, port)
+        resolved = time.monotonic()
+        sock = socket.create_connection(ip_address,
+                                        self.config.connect_timeout)
+        buffer = ReadBuffer()
+        try:
+            if self.url.scheme == 'https':
+                sock = self.tls.wrap(sock, host, port)
+                self.tls.handshake(sock)
+            self.timings.add('dns', resolved - start)
+            self.timings.add('connect', time.monotonic() - resolved)
+            sock.settimeout(self.config.read_timeout)
+            sock.sendall(download.request())
+            # 接收服务器返回的数据，阻塞运行，直到响应解析完毕
+            while True:
+                d = buffer.recv_into(sock)
+                if not d:
+                    download.feed_eof()
+                    break
+                if download.feed(d):
+                    break
+            self.tls.save(sock, host, port)
+        except BaseException:
+            download.abort()
+            raise
+        finally:
+            sock.close()
+
+
+def run(urls, config, results):
+    resolver = BlockingResolver(config.dns_ttl)
+    tls = TLSContext(config.cafile, config.tls_verify)
+    backoff = Backoff(config.retries, config.backoff)
+    store = open_store(config)
+    cache = open_cache(config)
+    stats = TransferStats()
+    timings = results.timings
+    # 逐个下载时，每个 URL 排队的时间就是前面的 URL 用掉的时间
+    start = time.monotonic()
+    for url in urls:
+        timings.add('queue', time.monotonic() - start)
+        try:
+            Crawler(url, resolver, tls, backoff, store, cache, stats,
+                    timings, config).fetch()
+        except (OSError, HTTPError) as e:
+            results.failure(url, e)
+        else:
+            results.success(url)
+    if tls.handshakes:
+        print(tls.status())
+    if stats.responses:
+        print(stats.status())
+    if cache is not None:
+        print(cache.status())
+        cache.close()
+    if store is not None:
+        print(store.status())
@@ -0,0 +1,396 @@
+import ssl
+import time
+import socket
+from collections import deque, OrderedDict
+from urllib.parse import urlparse
+from selectors import EVENT_READ, EVENT_WRITE
+
+from ..buffer import ReadBuffer
+from ..cache import open_cache
+from ..common import Download, address, origin
+from ..decoding import TransferStats
+from ..http_parser import HTTPError
+from ..loop import new_event_loop
+from ..monitor import open_monitor
+from ..resolver import ThreadedResolver
+from ..retry import Backoff, retryable
+from ..store import open_new, open_store
+from ..timers import IdleTimeout
+from ..tls import TLSContext
+from ..writer import DiskWriter
+
+
+# selectors 回调版爬虫，套接字事件就绪后由事件循环调用回调函数
+class Crawler:
+    def __init__(self, url, loop, resolver, tls, backoff, writer, cache,
+                 stats, results, config):
+        self._url = url
+        self.url = urlparse(url)
+        self.loop = loop
+        self.resolver = resolver
+        self.tls = tls
+        self.backoff = backoff
+        self.writer = writer
+        self.cache = cache
+        self.stats = stats
+        self.results = results
+        self.config = config
+        self.attempt = 0        # 已经重试的次数
+        self.sock = None
+        self.deadline = None    # 连接和读取的超时定时器
+        self.started = None     # 开始解析域名的时间
+        self.resolved = None    # 域名解析完成的时间
+        self.out = b''          # 还没有发送出去的请求数据
+
+    # 域名解析在线程池里进行，解析完成后调用 connect 方法
+    def fetch(self):
+        self.download = Download(self.config, self.url, self.writer,
+                                 self.cache, self.stats,
+                                 self.results.timings)
+        host, port = address(self.url)
+        self.started = time.monotonic()
+        self.resolver.resolve(host, port, self.connect)
+
+    def connect(self, ip_address, error):
+        if error is not None:
+            return self.fail(error)
+        self.resolved = time.monotonic()
+        self.results.timings.add('dns', self.resolved - self.started)
+        self.sock = socket.socket()
+        self.sock.setblocking(False)
+        self.buffer = ReadBuffer()
+        try:
+            # 连接需要时间，非阻塞模式下这里会报出 BlockingIOError 异常
+            self.sock.connect(ip_address)
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            return self.fail(e)
+        # 连接服务器成功后，可写事件会就绪，然后自动执行回调函数
+        self.loop.register(self.sock.fileno(), EVENT_WRITE, self.connected)
+        self.deadline = IdleTimeout(self.loop, self.config.connect_timeout,
+                                    self.timeout)
+
+    # 连接成功，https 的 URL 先进行 TLS 握手再发送请求
+    def connected(self):
+        if self.url.scheme != 'https':
+            return self.established()
+        self.sock = self.tls.wrap(self.sock, *address(self.url))
+        self.handshake()
+
+    # 握手需要等待服务器的数据或者等待可写时，监听对应的事件，就绪后再次调用此方法
+    # 握手的时间算在连接超时里
+    def handshake(self):
+        try:
+            events = self.tls.handshake(self.sock)
+        except OSError as e:
+            return self.fail(e)
+        if events is None:
+            return self.established()
+        self.loop.modify(self.sock.fileno(), events, self.handshake)
+
+    # 连接或握手完成，writable 方法可能调用多次，所以在这里记录连接的耗时并生成请求
+    def established(self):
+        self.results.timings.add('connect', time.monotonic() - self.resolved)
+        self.out = memoryview(self.download.request())
+        self.writable()
+
+    # 一次可能发送不完，剩下的等下次可写时再发送
+    # TLS 连接的发送缓冲区满时抛出 SSLWantWriteError ，同样等下次可写
+    def writable(self):
+        try:
+            sent = self.sock.send(self.out)
+        except ssl.SSLWantWriteError:
+            sent = 0
+        except OSError as e:
+            return self.fail(e)
+        self.out = self.out[sent:]
+        if not self.out:
+            # 可写事件不再需要监听，转而监听可读事件
+            self.loop.modify(self.sock.fileno(), EVENT_READ, self.readable)
+            self.deadline.reset(self.config.read_timeout)
+        else:
+            self.loop.modify(self.sock.fileno(), EVENT_WRITE, self.writable)
+            self.deadline.touch()
+
+    # 套接字可读事件就绪后，自动运行此回调函数
+    # 可读事件就绪，并不代表内核空间已经接收完全部数据
+    # 收到的数据片段交给解析器，响应体直接写入文件
+    # 每次唤醒后一直读到 EAGAIN 为止，减少 select 的次数
+    def readable(self):
+        self.deadline.touch()
+        try:
+            while True:
+                d = self.buffer.recv_into(self.sock)
+                if not d:
+                    self.download.feed_eof()
+                    break
+                if self.download.feed(d):
+                    break
+        except BlockingIOError:
+            return
+        except (OSError, HTTPError) as e:
+            return self.fail(e)
+        self.tls.save(self.sock, *address(self.url))
+        self.close()
+        self.results.success(self._url)
+
+    # 连接或读取超时，定时器到期时调用
+    def timeout(self):
+        self.fail(TimeoutError('连接或读取超时'))
+
+    # 管线化连接上收到部分响应后失败的 URL ，由 PipelineCrawler 交过来重试
+    # download 为已经失败的下载，是否重试按它收到的状态码判断
+    def retry(self, download, error):
+        self.download = download
+        self.fail(error)
+
+    # 下载失败时按指数退避安排重试
+    def fail(self, error):
+        self.close()
+        self.download.abort()
+        if retryable(error, self.download) and \
+                self.attempt < self.backoff.retries:
+            delay = self.backoff.delay(self.attempt)
+            self.attempt += 1
+            print('URL: {} 下载失败: {}，{:.2f} 秒后第 {} 次重试'.format(
+                self._url, error, delay, self.attempt))
+            self.loop.call_later(delay, self.fetch)
+        else:
+            self.results.failure(self._url, error)
+
+    def close(self):
+        if self.deadline is not None:
+            self.deadline.cancel()
+            self.deadline = None
+        if self.sock is not None:
+            # 连接失败时套接字可能还没有注册
+            if self.loop.registered(self.sock.fileno()):
+                self.loop.unregister(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+
+# HTTP/1.1 管线化爬虫，同一主机的一批 URL 共用一个连接
+# 连接成功后一次性发送全部请求，再从数据流中按顺序解析各个响应
+# 服务器提前关闭连接或者不支持保持连接时，剩下的 URL 改为每个连接一个请求
+class PipelineCrawler:
+    def __init__(self, urls, loop, resolver, tls, backoff, writer, cache,
+                 stats, results, config):
+        self.urls = [urlparse(url) for url in urls]
+        self.loop = loop
+        self.resolver = resolver
+        self.tls = tls
+        self.backoff = backoff
+        self.writer = writer
+        self.cache = cache
+        self.stats = stats
+        self.results = results
+        self.config = config
+        # 尚未接收完的响应，与请求的顺序相同
+        self.pending = deque(zip(urls, (Download(config, url, writer, cache,
+                                                 stats, results.timings)
+                                        for url in self.urls)))
+        self.sock = None
+        self.out = b''      # 还没有发送出去的请求数据
+        self.deadline = None
+        self.started = None
+        self.resolved = None
+
+    def fetch(self):
+        host, port = address(self.urls[0])
+        self.started = time.monotonic()
+        self.resolver.resolve(host, port, self.connect)
+
+    def connect(self, ip_address, error):
+        if error is not None:
+            return self.fallback(error)
+        self.resolved = time.monotonic()
+        self.results.timings.add('dns', self.resolved - self.started)
+        self.sock = socket.socket()
+        self.sock.setblocking(False)
+        self.buffer = ReadBuffer()
+        try:
+            self.sock.connect(ip_address)
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            self.sock.close()
+            self.sock = None
+            return self.fallback(e)
+        self.out = memoryview(b''.join(
+            download.request(keep_alive=True) for _, download in self.pending))
+        self.loop.register(self.sock.fileno(), EVENT_WRITE, self.connected)
+        self.deadline = IdleTimeout(self.loop, self.config.connect_timeout,
+                                    self.timeout)
+
+    # 与 Crawler 相同，https 的连接先进行 TLS 握手
+    def connected(self):
+        if self.urls[0].scheme != 'https':
+            return self.established()
+        self.sock = self.tls.wrap(self.sock, *address(self.urls[0]))
+        self.handshake()
+
+    def handshake(self):
+        try:
+            events = self.tls.handshake(self.sock)
+        except OSError as e:
+            return self.fallback(e)
+        if events is None:
+            return self.established()
+        self.loop.modify(self.sock.fileno(), events, self.handshake)
+
+    # 连接或握手完成，writable 方法可能调用多次，所以在这里记录连接的耗时
+    def established(self):
+        self.results.timings.add('connect', time.monotonic() - self.resolved)
+        self.writable()
+
+    # 请求数据较多时一次可能发送不完，剩下的等下次可写时再发送
+    # TLS 连接的发送缓冲区满时抛出 SSLWantWriteError ，同样等下次可写
+    def writable(self):
+        try:
+            sent = self.sock.send(self.out)
+        except ssl.SSLWantWriteError:
+            sent = 0
+        except OSError as e:
+            return self.fallback(e)
+        self.out = self.out[sent:]
+        if not self.out:
+            self.loop.modify(self.sock.fileno(), EVENT_READ, self.readable)
+            self.deadline.reset(self.config.read_timeout)
+        else:
+            self.loop.modify(self.sock.fileno(), EVENT_WRITE, self.writable)
+            self.deadline.touch()
+
+    # 每次唤醒后一直读到 EAGAIN 为止，全部响应结束或者回退时套接字已关闭
+    def readable(self):
+        self.deadline.touch()
+        while self.sock is not None:
+            try:
+                d = self.buffer.recv_into(self.sock)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                return self.fallback(e)
+            if not d:
+                return self.eof()
+            self.consume(d)
+
+    # 按顺序把收到的数据交给各个响应的解析器
+    def consume(self, view):
+        pos = 0
+        while pos < len(view) and self.pending:
+            url, download = self.pending[0]
+            try:
+                pos += download.parser.feed(view[pos:])
+                if download.parser.done:
+                    download.close()
+            except HTTPError as e:
+                # 响应出错后无法确定下一个响应的起点，剩下的 URL 全部回退
+                self.pending.popleft()
+                self.crawler(url).retry(download, e)
+                return self.fallback(e)
+            if not download.parser.done:
+                break
+            self.pending.popleft()
+            self.results.success(url)
+            # 服务器不保持连接，后面的请求不会有响应了
+            if not download.parser.keep_alive:
+                return self.fallback(None)
+        if not self.pending:
+            self.close()
+
+    # 服务器关闭连接，只有读到连接关闭为止的响应可以正常结束
+    def eof(self):
+        url, download = self.pending[0]
+        try:
+            download.parser.feed_eof()
+            download.close()
+        except HTTPError as e:
+            return self.fallback(e)
+        self.pending.popleft()
+        self.results.success(url)
+        self.fallback(None)
+
+    def timeout(self):
+        self.fallback(TimeoutError('连接或读取超时'))
+
+    # 关闭连接，剩下的 URL 交给普通的爬虫，每个连接一个请求
+    # 已经收到部分响应的 URL 算作失败一次，按 --retries 和 --backoff 重试
+    def fallback(self, error):
+        self.close()
+        while self.pending:
+            url, download = self.pending.popleft()
+            if download.parser.status is not None:
+                self.crawler(url).retry(download, error)
+            else:
+                self.crawler(url).fetch()
+
+    def crawler(self, url):
+        return Crawler(url, self.loop, self.resolver, self.tls, self.backoff,
+                       self.writer, self.cache, self.stats, self.results,
+                       self.config)
+
+    def close(self):
+        if self.deadline is not None:
+            self.deadline.cancel()
+            self.deadline = None
+        if self.sock is not None:
+            self.tls.save(self.sock, *address(self.urls[0]))
+            self.loop.unregister(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+
+# 按 (协议, 主机, 端口) 把 URL 分组，每组再按 size 个一批切开
+def pipeline_batches(urls, size):
+    groups = OrderedDict()
+    for url in urls:
+        groups.setdefault(origin(urlparse(url)), []).append(url)
+    for group in groups.values():
+        for i in range(0, len(group), size):
+            yield group[i:i + size]
+
+
+def run(urls, config, results):
+    loop = new_event_loop(config)
+    monitor = open_monitor(config)
+    if monitor is not None:
+        loop.instrument(monitor)
+    resolver = ThreadedResolver(loop, config.dns_ttl)
+    tls = TLSContext(config.cafile, config.tls_verify)
+    backoff = Backoff(config.retries, config.backoff)
+    store = open_store(config)
+    writer = DiskWriter(config.writers, config.write_queue, config.fsync,
+                        open_new if store is None else store.open)
+    cache = open_cache(config)
+    stats = TransferStats()
+    if config.pipeline > 1:
+        for batch in pipeline_batches(urls, config.pipeline):
+            if len(batch) > 1:
+                PipelineCrawler(batch, loop, resolver, tls, backoff, writer,
+                                cache, stats, results, config).fetch()
+            else:
+                Crawler(batch[0], loop, resolver, tls, backoff, writer, cache,
+                        stats, results, config).fetch()
+    else:
+        for url in urls:
+            crawler = Crawler(url, loop, resolver, tls, backoff, writer,
+                              cache, stats, results, config)
+            crawler.fetch()
+    loop.run()
+    resolver.close()
+    writer.close()
+    writer.report(results, cache)
+    print('域名解析 {} 次'.format(resolver.lookups))
+    if monitor is not None:
+        print(monitor.status())
+    if tls.handshakes:
+        print(tls.status())
+    if stats.responses:
+        print(stats.status())
+    if cache is not None:
+        print(cache.status())
+        cache.close()
+    if store is not None:
+        print(store.status())
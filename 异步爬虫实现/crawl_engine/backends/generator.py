@@ -0,0 +1,204 @@
+import time
+from urllib.parse import urlparse
+
+from ..cache import open_cache
+from ..common import file_path, origin
+from ..coroutine import Task
+from ..decoding import TransferStats
+from ..http_parser import HTTPError, RangeError
+from ..loop import new_event_loop
+from ..monitor import open_monitor
+from ..pool import ConnectionPool
+from ..ranges import RangeDownload
+from ..resolver import ThreadedResolver
+from ..retry import Backoff, retryable
+from ..scheduler import Scheduler
+from ..store import open_new, open_store
+from ..tls import TLSContext
+from ..writer import DiskWriter
+
+
+class Crawler:
+    def __init__(self, url, pool, writer, cache, stats, timings, config):
+        self._url = url
+        self.url = urlparse(url)
+        self.host = origin(self.url)
+        self.pool = pool
+        self.writer = writer
+        self.cache = cache
+        self.stats = stats
+        self.timings = timings
+        self.config = config
+        self.attempt = 0    # 已经重试的次数
+        self.queued = time.monotonic()  # 加入调度器的时间，重试时为退避结束的时间
+        self.parts = []     # 需要下载的范围，失败后剩下的部分下次重试时续传
+        self.tasks = []     # 正在下载其它各段的 Task 实例
+        self.validator = None   # 文件的 ETag 或 Last-Modified ，续传时确认文件没有变化
+        self.kept = False   # 是否为续传保留了不完整的文件
+
+    # 下载成功返回 None ，失败时返回异常对象和 Download 实例，由调用方决定是否重试
+    # 上次失败时留下了没下载完的范围的话，只请求这些范围
+    def fetch(self):
+        if self.parts:
+            self.tasks = [Task(self.fetch_part(part), self.pool.loop)
+                          for part in self.parts]
+            return (yield from self.join(None))
+        while True:
+            download = RangeDownload(self.config, self.url, self.writer,
+                                     self.cache, self.stats, self.timings)
+            result = yield from self.download(download)
+            if result is not False:
+                break
+        if download.part is not None:
+            self.validator = download.validator
+            self.parts.insert(0, download.part)
+        return (yield from self.join(result))
+
+    # 下载文件的一个范围，返回值与 fetch 方法相同
+    def fetch_part(self, part):
+        while True:
+            download = RangeDownload(self.config, self.url, self.writer,
+                                     stats=self.stats, timings=self.timings,
+                                     part=part, validator=self.validator)
+            result = yield from self.download(download)
+            if result is not False:
+                return result
+
+    # 用连接池里的连接下载，返回值与 fetch 方法相同
+    # 复用的连接可能刚好被服务器关闭，没收到任何数据时返回 False ，由调用方换一个连接重试
+    def download(self, download):
+        try:
+            sock = yield from self.pool.acquire(self.host)
+        except OSError as e:
+            return e, download
+        try:
+            keep_alive = yield from self.request(sock, download)
+        except (OSError, HTTPError) as e:
+            self.pool.discard(self.host, sock)
+            # 支持续传时保留已写入的部分，否则删除不完整的文件
+            if download.part is not None:
+                download.close()
+                self.kept = True
+            else:
+                download.abort()
+            if sock.reused and download.parser.status is None:
+                return False
+            return e, download
+        if keep_alive:
+            self.pool.release(self.host, sock)
+        else:
+            self.pool.discard(self.host, sock)
+        return None
+
+    # 在已连接的套接字上发送请求并接收响应，返回值表示连接能否继续使用
+    # 每次等待数据最多 read_timeout 秒
+    def request(self, sock, download):
+        sock.send(download.request(keep_alive=True))
+        # 不断循环以读取服务器返回的数据片段，直到响应解析完毕
+        while True:
+            value = yield from sock.read(self.config.read_timeout)
+            if not value:
+                download.feed_eof()
+                return False
+            done = download.feed(value)
+            # 大文件在报头解析完毕后分段，其它各段立即开始下载
+            if download.rest:
+                self.validator = download.validator
+                self.parts.extend(download.rest)
+                self.tasks = [Task(self.fetch_part(part), self.pool.loop)
+                              for part in download.rest]
+                download.rest = None
+            if done:
+                return download.keep_alive
+
+    # 等待其它各段结束，返回第一个错误，没有错误时返回 None
+    # 还没下载完的范围留在 parts 里，下次重试时续传
+    def join(self, result):
+        for task in self.tasks:
+            error = yield from task
+            if result is None:
+                result = error
+        self.tasks = []
+        self.parts = [part for part in self.parts if part[0] <= part[1]]
+        # 文件已经变化，下次重试时重新下载整个文件
+        if result is not None and isinstance(result[0], RangeError):
+            self.parts = []
+        return result
+
+    # 不再重试时调用，删除为续传保留的不完整文件
+    # 这个 URL 报告为失败，之前完成的范围写入失败时也不再报告
+    def discard(self):
+        path = file_path(self.config, self.url)
+        if self.kept:
+            self.writer.remove(path)
+            self.kept = False
+        self.writer.forget(path, self._url)
+
+
+def run(urls, config, results):
+    loop = new_event_loop(config)
+    monitor = open_monitor(config)
+    if monitor is not None:
+        loop.instrument(monitor)
+    resolver = ThreadedResolver(loop, config.dns_ttl)
+    tls = TLSContext(config.cafile, config.tls_verify)
+    timings = results.timings
+    pool = ConnectionPool(loop, resolver, config.pool_size,
+                          config.idle_timeout, config.connect_timeout, tls,
+                          timings)
+    backoff = Backoff(config.retries, config.backoff)
+    store = open_store(config)
+    writer = DiskWriter(config.writers, config.write_queue, config.fsync,
+                        open_new if store is None else store.open)
+    cache = open_cache(config)
+    stats = TransferStats()
+
+    # 下载失败时按指数退避重新放回调度器的队列
+    # 等待重试期间不占用调度器的名额，慢的或出错的主机不会一直占着位置
+    def fetch(crawler):
+        timings.add('queue', time.monotonic() - crawler.queued)
+        result = yield from crawler.fetch()
+        if result is None:
+            results.success(crawler._url)
+            return
+        error, download = result
+        if retryable(error, download) and crawler.attempt < backoff.retries:
+            delay = backoff.delay(crawler.attempt)
+            crawler.attempt += 1
+            print('URL: {} 下载失败: {}，{:.2f} 秒后第 {} 次重试'.format(
+                crawler._url, error, delay, crawler.attempt))
+            crawler.queued = time.monotonic() + delay
+            scheduler.add_later(delay, crawler)
+        else:
+            crawler.discard()
+            results.failure(crawler._url, error)
+
+    scheduler = Scheduler(loop, fetch, lambda crawler: crawler.host,
+                          config.concurrency, config.per_host,
+                          config.report_every)
+    for url in urls:
+        scheduler.add(Crawler(url, pool, writer, cache, stats, timings,
+                              config))
+    # 全部任务结束后返回，协程里意外抛出的异常作为下载失败报告
+    errors = loop.run_until_complete(scheduler.join())
+    for crawler, error in errors:
+        crawler.discard()
+        results.failure(crawler._url, error)
+    pool.close()
+    loop.close()
+    resolver.close()
+    writer.close()
+    writer.report(results, cache)
+    print('新建连接 {} 个，复用连接 {} 次，域名解析 {} 次'.format(
+        pool.created, pool.reused, resolver.lookups))
+    if monitor is not None:
+        print(monitor.status())
+    if tls.handshakes:
+        print(tls.status())
+    if stats.responses:
+        print(stats.status())
+    if cache is not None:
+        print(cache.status())
+        cache.close()
+    if store is not None:
+        print(store.status())
@@ -0,0 +1,536 @@
+import os
+import time
+import socket
+from collections import deque
+from urllib.parse import urlparse
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+
+from greenlet import greenlet
+
+from ..buffer import ReadBuffer
+from ..cache import open_cache
+from ..common import Download, address
+from ..decoding import TransferStats
+from ..http_parser import HTTPError
+from ..monitor import open_monitor
+from ..resolver import ThreadedResolver
+from ..retry import Backoff, retryable
+from ..store import open_new, open_store
+from ..timers import TimerHeap
+from ..tls import TLSContext
+from ..writer import DiskWriter
+
+
+# 事件监听类，表示一个协程在等待套接字的某个事件
+# 原来实例化时注册监听，事件就绪后注销，每次 recv 都多两次 epoll_ctl 系统调用
+# 现在由 Loop.io 方法管理注册，套接字的整个生命周期只注册一次
+class Watcher:
+    def __init__(self, fd, event_constant):
+        self.fd = fd
+        self.event_constant = event_constant
+
+    # 套接字的相关事件就绪后，执行此方法运行回调函数
+    # callback 的值实际上是爬虫协程的 switch 方法，参数 True 表示事件已就绪
+    def run(self):
+        self.callback(True)
+
+
+# 事件循环类，每个 Hub 实例拥有一个该类的实例
+class Loop:
+    def __init__(self):
+        self.selector = DefaultSelector()
+        # 队列用于存储爬虫协程的 switch 方法及其参数的元组，用于预激协程
+        self.fetch_funcs_and_args_list = deque()
+        # 字典用于存储 Watcher 类的实例，键为 (文件描述符, 事件)
+        # 原来用列表存储，每个就绪事件都要复制并遍历整个列表，
+        # 并发的协程数多时 hub 的大部分时间花在这里，改为字典后每个事件直接查找
+        self.watchers = {}
+        self.timers = TimerHeap()
+        self.monitor = None
+
+    # 开启运行状况监控，monitor 为 monitor.LoopMonitor 实例
+    # 用带计时的方法替换 _run_once ，不开启时没有任何额外的判断
+    # 爬虫协程切换出去之后一直运行到下次等待才切换回来，所以回调用时就是协程这一段运行的时间
+    def instrument(self, monitor):
+        self.monitor = monitor
+        self._run_once = self._run_once_monitored
+
+    # 首次调用爬虫协程的 switch 方法启动协程
+    def _run_fetch_switch_first(self):
+        while self.fetch_funcs_and_args_list:
+            fetch_switch, args, kw = self.fetch_funcs_and_args_list.popleft()
+            fetch_switch(*args, **kw)
+
+    # 等待事件就绪，就绪后调用对应 Watcher 实例的 run 方法
+    # 通过 register 方法注册的文件描述符直接调用其回调函数
+    # 等待时间不超过最近的定时器到期的时间
+    def _run_watchers(self):
+        ready_events = self.selector.select(self.timers.timeout())
+        for event_key, _ in ready_events:
+            if event_key.data is not None:
+                event_key.data()
+                continue
+            watcher = self.watchers.pop((event_key.fd, event_key.events), None)
+            if watcher is not None:
+                watcher.run()
+            else:
+                # 没有协程等待时注销监听，否则水平触发的事件会让事件循环空转
+                self.selector.unregister(event_key.fd)
+
+    # 运行一轮：等待事件并运行就绪的回调函数，然后运行到期的定时器
+    def _run_once(self):
+        self._run_watchers()
+        self.timers.run_due()
+
+    # 开启监控时使用的 _run_once ，和 _run_watchers 的逻辑相同
+    def _run_once_monitored(self):
+        monitor = self.monitor
+        events = monitor.select_events(self.selector, self.timers.timeout())
+        for event_key, _ in events:
+            if event_key.data is not None:
+                monitor.call(event_key.data)
+                continue
+            watcher = self.watchers.pop((event_key.fd, event_key.events), None)
+            if watcher is not None:
+                monitor.call(watcher.callback, True)
+            else:
+                self.selector.unregister(event_key.fd)
+        monitor.run_timers(self.timers)
+
+    def add_fetch_func(self, fun, *args, **kw):
+        self.fetch_funcs_and_args_list.append((fun, args, kw))
+
+    # 注册一直有效的事件监听，事件就绪时在 hub 协程里调用回调函数
+    # 与 EventLoop 的接口相同，供域名解析器使用
+    def register(self, fd, events, callback):
+        self.selector.register(fd, events, callback)
+
+    def unregister(self, fd):
+        self.selector.unregister(fd)
+
+    # 监听套接字的某个事件，事件就绪后切换回当前协程
+    # 套接字没有注册时注册，监听的事件变化时调用 modify ，否则不需要系统调用
+    def io(self, fd, event_constant):
+        key = self.selector.get_map().get(fd)
+        if key is None:
+            self.selector.register(fd, event_constant)
+        elif key.events != event_constant:
+            self.selector.modify(fd, event_constant)
+        watcher = Watcher(fd, event_constant)
+        watcher.callback = greenlet.getcurrent().switch
+        self.watchers[(fd, event_constant)] = watcher
+        return watcher
+
+    # 取消尚未就绪的事件等待，等待超时的时候使用，注册保留到套接字关闭
+    def cancel_io(self, watcher):
+        del self.watchers[(watcher.fd, watcher.event_constant)]
+
+    # 套接字关闭前调用，注销它的事件监听
+    def forget(self, fd):
+        if fd in self.selector.get_map():
+            self.selector.unregister(fd)
+
+    # delay 秒之后调用 callback(*args) ，返回值可以调用 cancel 方法取消
+    def call_later(self, delay, callback, *args):
+        return self.timers.call_later(delay, callback, *args)
+
+    # 事件循环的主方法，done 是一个函数，返回 True 时说明全部爬虫协程已结束
+    # 空闲的域名解析器可能一直注册着，不能再以没有被监听的事件作为结束的标志
+    # 运行期间新创建的爬虫协程在下一轮循环开始前启动
+    def run(self, done):
+        while True:
+            self._run_fetch_switch_first()
+            if done():
+                break
+            # 还有协程没结束却没有可等待的事件，说明有协程丢失了唤醒它的回调
+            if not (self.selector.get_map() or self.timers):
+                raise RuntimeError('没有可等待的事件，协程永远不会结束')
+            self._run_once()
+        self.selector.close()
+
+
+# 继承 greenlet 协程类，该类的实例是全部爬虫协程的父协程
+class Hub(greenlet):
+    def __init__(self, dns_ttl=300):
+        self.loop = Loop()
+        self.resolver = ThreadedResolver(self.loop, dns_ttl)
+        self.running = 0        # 尚未结束的爬虫协程数
+        self.errors = []        # 爬虫协程抛出的异常，元素为 (协程, 异常对象)
+        super().__init__()
+
+    # 该类的实例调用 switch 方法启动协程之后将执行 run 方法
+    # 全部爬虫协程结束后返回，回到调用 switch 方法的地方
+    def run(self):
+        self.loop.run(lambda: not self.running)
+
+    # 爬虫协程调用此方法等待套接字的某个事件就绪
+    # 超过 timeout 秒仍未就绪时取消监听并抛出 TimeoutError 异常
+    def wait(self, fd, event_constant, timeout=None):
+        watcher = self.loop.io(fd, event_constant)
+        if timeout is None:
+            self.switch()
+            return
+        timer = self.loop.call_later(timeout, self._expire, watcher)
+        ready = self.switch()
+        timer.cancel()
+        if not ready:
+            raise TimeoutError('等待超过 {} 秒'.format(timeout))
+
+    # 定时器到期时在 hub 协程里运行，取消监听并切换回等待的协程
+    def _expire(self, watcher):
+        self.loop.cancel_io(watcher)
+        watcher.callback(False)
+
+    # 注销套接字的事件监听并关闭套接字
+    def close(self, sock):
+        self.loop.forget(sock.fileno())
+        sock.close()
+
+    # 暂停当前协程，切换到 hub 协程，由其它回调函数切换回来
+    # 在主协程里调用会启动 hub 并一直运行到全部协程结束，所以直接报错
+    def block(self):
+        self.current()
+        return self.switch()
+
+    # 返回接下来要调用 block 暂停的当前协程，在主协程里调用时报错
+    # 调用方在登记唤醒它的回调之前调用，出错时不会留下一个会切换到主协程的登记
+    def current(self):
+        current = greenlet.getcurrent()
+        if current.parent is not self:
+            raise RuntimeError('只能在 hub 的协程里等待')
+        return current
+
+    # 爬虫协程调用此方法暂停 seconds 秒，期间切换到 hub 协程
+    def sleep(self, seconds):
+        self.loop.call_later(seconds, greenlet.getcurrent().switch)
+        self.switch()
+
+    # 爬虫协程调用此方法解析域名，解析期间切换到 hub 协程
+    def resolve(self, host, port):
+        address = self.resolver.cached(host, port)
+        if address is not None:
+            return address
+        current = greenlet.getcurrent()
+        self.resolver.resolve(host, port, current.switch)
+        address, error = self.switch()
+        if error is not None:
+            raise error
+        return address
+
+    # 创建爬虫协程，父协程为 hub ，协程运行结束后自动返回到 hub 中继续执行
+    # hub 运行期间也可以调用，返回值为协程实例
+    def spawn(self, fun, *args, **kw):
+        g = greenlet(self._guard, self)
+        # 事件循环监控据此找到慢回调对应的 URL
+        g.fun = fun
+        self.running += 1
+        self.loop.add_fetch_func(g.switch, fun, args, kw)
+        return g
+
+    # 运行爬虫协程的函数，记录结束的协程数
+    # 异常记录下来，不让它传到 hub 协程里让整个爬虫停下来
+    def _guard(self, fun, args, kw):
+        try:
+            fun(*args, **kw)
+        except Exception as e:
+            self.errors.append((greenlet.getcurrent(), e))
+        finally:
+            self.running -= 1
+
+
+# Pool.spawn 返回的任务，记录函数的返回值或者抛出的异常
+class Job:
+    def __init__(self, hub, fun, args, kw):
+        self.hub = hub
+        self.fun = fun
+        self.args = args
+        self.kw = kw
+        self.done = False
+        self.value = None
+        self.exception = None
+        self._links = []
+
+    # 在工作协程里运行，异常保存下来，由 get 方法在等待的协程里抛出
+    def run(self):
+        try:
+            self.value = self.fun(*self.args, **self.kw)
+        except Exception as e:
+            self.exception = e
+        self.done = True
+        # 释放参数，结果被长时间保留时不会连带着占用内存
+        self.fun = self.args = self.kw = None
+        for callback in self._links:
+            self.hub.loop.add_fetch_func(callback, self)
+        self._links = []
+
+    # 结束后在 hub 协程里调用 callback(job) ，已经结束时在下一轮调用
+    def link(self, callback):
+        if self.done:
+            self.hub.loop.add_fetch_func(callback, self)
+        else:
+            self._links.append(callback)
+
+    # 暂停当前协程，直到任务结束
+    def wait(self):
+        if not self.done:
+            current = self.hub.current()
+            self.link(lambda job: current.switch())
+            self.hub.block()
+
+    # 等待任务结束，返回函数的返回值，函数抛出异常时在这里抛出
+    def get(self):
+        self.wait()
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+
+# 限制同时运行的协程数的协程池
+# 原来每个 URL 都调用一次 Hub.spawn ，一百万个 URL 就是一百万个协程同时排在 hub 里，
+# 并且没有办法等待它们的结果。这里最多运行 size 个工作协程，池满时 spawn 暂停调用它的协程，
+# 直到有任务结束；工作协程结束一个任务后直接接过下一个等待中的任务，
+# 没有等待的任务时先留到 hub 这一轮结束，期间提交的任务交给它，仍然没有才退出，
+# 不会为每个任务新建协程。imap_unordered 按需从可迭代对象里取出参数，
+# 内存占用只和 size 有关，和任务总数无关
+# 会暂停的方法（池满时的 spawn 、joinall 、imap_unordered 和 Job.get）只能在 hub 的协程里调用
+class Pool:
+    def __init__(self, hub, size=100):
+        self.hub = hub
+        self.size = size
+        self.active = 0         # 正在运行任务的工作协程数
+        self.pending = deque()  # 池满时等待的 (任务, 调用 spawn 的协程)
+        self.idle = []          # 暂时没有任务的工作协程
+        self.created = 0        # 新建工作协程的次数
+        self.finished = 0       # 已结束的任务数
+        self._joiners = []      # 等待全部任务结束的协程
+        self._retiring = False  # 是否已经安排了让空闲协程退出的回调
+
+    # 创建任务并返回 Job 实例，池满时暂停当前协程，直到有工作协程接过这个任务
+    def spawn(self, fun, *args, **kw):
+        job = Job(self.hub, fun, args, kw)
+        if self.active < self.size:
+            self.active += 1
+            if self.idle:
+                self.hub.loop.add_fetch_func(self.idle.pop().switch, job)
+            else:
+                self.created += 1
+                self.hub.spawn(self._worker, job)
+        else:
+            self.pending.append((job, self.hub.current()))
+            self.hub.block()
+        return job
+
+    # 工作协程，运行完一个任务后接着运行等待中的任务，并唤醒提交它的协程
+    # 没有等待的任务时暂停，切换回来时得到新的任务，得到 None 时退出
+    def _worker(self, job):
+        while job is not None:
+            job.run()
+            self.finished += 1
+            if self.pending:
+                job, spawner = self.pending.popleft()
+                self.hub.loop.add_fetch_func(spawner.switch)
+                continue
+            self.active -= 1
+            if not self.active:
+                joiners, self._joiners = self._joiners, []
+                for joiner in joiners:
+                    self.hub.loop.add_fetch_func(joiner.switch)
+            self.idle.append(greenlet.getcurrent())
+            # 排在已经唤醒的协程后面，它们这一轮提交的任务可以用上空闲的协程
+            if not self._retiring:
+                self._retiring = True
+                self.hub.loop.add_fetch_func(self._retire)
+            job = self.hub.block()
+
+    def _retire(self):
+        self._retiring = False
+        while self.idle:
+            self.idle.pop().switch(None)
+
+    # 等待 jobs 里的任务全部结束并返回它们的列表
+    # jobs 为 None 时等待池里的全部任务结束，这时返回空列表
+    def joinall(self, jobs=None):
+        if jobs is None:
+            if self.active:
+                self._joiners.append(self.hub.current())
+                self.hub.block()
+            return []
+        jobs = list(jobs)
+        for job in jobs:
+            job.wait()
+        return jobs
+
+    # 对 iterable 的每个元素调用 fun ，按结束的顺序逐个生成返回值，
+    # 函数抛出的异常在取到它的结果时抛出
+    # 参数按需取出，池满时等到有任务结束再取下一个
+    def imap_unordered(self, fun, iterable):
+        finished = deque()
+        waiting = []        # 正在等待结果的协程
+
+        def on_finish(job):
+            finished.append(job)
+            if waiting:
+                waiting.pop().switch()
+
+        running = 0
+        for item in iterable:
+            self.spawn(fun, item).link(on_finish)
+            running += 1
+            while finished:
+                running -= 1
+                yield finished.popleft().get()
+        while running:
+            if not finished:
+                waiting.append(self.hub.current())
+                self.hub.block()
+            running -= 1
+            yield finished.popleft().get()
+
+
+class Crawler:
+    def __init__(self, url, hub, tls, backoff, writer, cache, stats,
+                 results, config):
+        self._url = url
+        self.url = urlparse(url)
+        self.hub = hub
+        self.tls = tls
+        self.backoff = backoff
+        self.writer = writer
+        self.cache = cache
+        self.stats = stats
+        self.results = results
+        self.config = config
+        self.queued = time.monotonic()  # 交给后端的时间
+
+    # 下载失败时按指数退避重试，等待期间切换到 hub 协程
+    def fetch(self):
+        self.results.timings.add('queue', time.monotonic() - self.queued)
+        attempt = 0
+        while True:
+            download = Download(self.config, self.url, self.writer,
+                                self.cache, self.stats,
+                                self.results.timings)
+            try:
+                self.download(download)
+            except (OSError, HTTPError) as e:
+                download.abort()
+                if not retryable(e, download) or \
+                        attempt >= self.backoff.retries:
+                    self.results.failure(self._url, e)
+                    return
+                delay = self.backoff.delay(attempt)
+                attempt += 1
+                print('URL: {} 下载失败: {}，{:.2f} 秒后第 {} 次重试'.format(
+                    self._url, e, delay, attempt))
+                self.hub.sleep(delay)
+                continue
+            self.results.success(self._url)
+            return
+
+    def download(self, download):
+        buffer = ReadBuffer()
+        host, port = address(self.url)
+        timings = self.results.timings
+        sock = socket.socket()
+        sock.setblocking(False)
+        try:
+            start = time.monotonic()
+            ip_address = self.hub.resolve(host, port)
+            resolved = time.monotonic()
+            try:
+                sock.connect(ip_address)
+            except BlockingIOError:
+                pass
+            # 等待连接建立，切换到 hub 协程
+            self.hub.wait(sock.fileno(), EVENT_WRITE,
+                          self.config.connect_timeout)
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                raise OSError(error, os.strerror(error))
+            if self.url.scheme == 'https':
+                # 包装后的套接字立即替换 sock ，握手失败时关闭的是包装后的套接字
+                sock = self.tls.wrap(sock, host, port)
+                self.handshake(sock)
+            timings.add('dns', resolved - start)
+            timings.add('connect', time.monotonic() - resolved)
+            sock.sendall(download.request())
+            while True:
+                # 一直读到 EAGAIN 为止，内核里没有数据时才等待服务器返回数据
+                try:
+                    chunk = buffer.recv_into(sock)
+                except BlockingIOError:
+                    # 切换到 hub 协程
+                    self.hub.wait(sock.fileno(), EVENT_READ,
+                                  self.config.read_timeout)
+                    continue
+                if not chunk:
+                    download.feed_eof()
+                    break
+                if download.feed(chunk):
+                    break
+            self.tls.save(sock, host, port)
+        finally:
+            self.hub.close(sock)
+
+    # TLS 握手，需要等待服务器的数据或者等待可写时切换到 hub 协程
+    def handshake(self, sock):
+        while True:
+            events = self.tls.handshake(sock)
+            if events is None:
+                return
+            self.hub.wait(sock.fileno(), events, self.config.connect_timeout)
+
+
+def run(urls, config, results):
+    hub = Hub(config.dns_ttl)
+    monitor = open_monitor(config)
+    if monitor is not None:
+        hub.loop.instrument(monitor)
+    tls = TLSContext(config.cafile, config.tls_verify)
+    backoff = Backoff(config.retries, config.backoff)
+    store = open_store(config)
+    writer = DiskWriter(config.writers, config.write_queue, config.fsync,
+                        open_new if store is None else store.open)
+    cache = open_cache(config)
+    stats = TransferStats()
+    pool = Pool(hub, config.concurrency)
+    started = time.monotonic()
+
+    # 爬虫实例在协程开始运行时才创建，queue 阶段从爬取开始算起
+    # 协程里意外抛出的异常作为下载失败报告
+    def fetch(url):
+        crawler = Crawler(url, hub, tls, backoff, writer, cache, stats,
+                          results, config)
+        crawler.queued = started
+        try:
+            crawler.fetch()
+        except Exception as e:
+            results.failure(url, e)
+
+    # 通过协程池逐个提交 URL ，同时运行的爬虫协程不超过 concurrency 个
+    def feed():
+        for _ in pool.imap_unordered(fetch, urls):
+            pass
+
+    hub.spawn(feed)
+    # 启动 hub 协程，全部爬虫协程结束后回到这里
+    hub.switch()
+    hub.resolver.close()
+    writer.close()
+    writer.report(results, cache)
+    # 提交 URL 的协程出错时剩下的 URL 没有结果，不能当作正常结束
+    if hub.errors:
+        raise hub.errors[0][1]
+    print('域名解析 {} 次，创建爬虫协程 {} 个'.format(hub.resolver.lookups,
+                                              pool.created))
+    if monitor is not None:
+        print(monitor.status())
+    if tls.handshakes:
+        print(tls.status())
+    if stats.responses:
+        print(stats.status())
+    if cache is not None:
+        print(cache.status())
+        cache.close()
+    if store is not None:
+        print(store.status())
@@ -0,0 +1,81 @@
+import time
+import queue
+import threading
+
+from .blocking import Crawler
+from ..cache import open_cache
+from ..decoding import TransferStats
+from ..http_parser import HTTPError
+from ..resolver import BlockingResolver
+from ..retry import Backoff
+from ..store import open_store
+from ..tls import TLSContext
+
+
+# 多线程版爬虫，每个线程不断从队列里取 URL 并用阻塞版爬虫下载
+# 原来的 spider_thread.py 为每个 URL 创建一个线程
+# URL 数量多时线程太多，这里改为固定数量的线程
+class Worker(threading.Thread):
+    def __init__(self, url_queue, resolver, tls, backoff, store, cache,
+                 stats, results, config):
+        super().__init__(daemon=True)
+        self.url_queue = url_queue
+        self.resolver = resolver
+        self.tls = tls
+        self.backoff = backoff
+        self.store = store
+        self.cache = cache
+        self.stats = stats
+        self.results = results
+        self.config = config
+
+    def run(self):
+        while True:
+            item = self.url_queue.get()
+            # None 是结束信号
+            if item is None:
+                break
+            url, queued = item
+            self.results.timings.add('queue', time.monotonic() - queued)
+            try:
+                Crawler(url, self.resolver, self.tls, self.backoff,
+                        self.store, self.cache, self.stats,
+                        self.results.timings, self.config).fetch()
+            except (OSError, HTTPError) as e:
+                self.results.failure(url, e)
+            else:
+                self.results.success(url)
+
+
+def run(urls, config, results):
+    url_queue = queue.Queue()
+    # 全部线程共用一个解析器，同一域名只解析一次
+    resolver = BlockingResolver(config.dns_ttl)
+    # 全部线程共用 TLS 会话
+    tls = TLSContext(config.cafile, config.tls_verify)
+    backoff = Backoff(config.retries, config.backoff)
+    store = open_store(config)
+    cache = open_cache(config)
+    stats = TransferStats()
+    workers = [Worker(url_queue, resolver, tls, backoff, store, cache,
+                      stats, results, config)
+               for _ in range(config.threads)]
+    for worker in workers:
+        worker.start()
+    # 连同放入队列的时间一起放入，用来计算排队的时间
+    for url in urls:
+        url_queue.put((url, time.monotonic()))
+    # 每个线程收到一个结束信号
+    for _ in workers:
+        url_queue.put(None)
+    for worker in workers:
+        worker.join()
+    if tls.handshakes:
+        print(tls.status())
+    if stats.responses:
+        print(stats.status())
+    if cache is not None:
+        print(cache.status())
+        cache.close()
+    if store is not None:
+        print(store.status())
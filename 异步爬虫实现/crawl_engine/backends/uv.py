@@ -0,0 +1,125 @@
+import time
+import socket
+from urllib.parse import urlparse
+
+import pyuv
+
+from ..cache import open_cache
+from ..common import Download, address
+from ..decoding import TransferStats
+from ..http_parser import HTTPError
+from ..resolver import Resolver
+from ..store import open_new, open_store
+from ..writer import DiskWriter
+
+
+# 使用 libuv 的线程池解析域名，回调函数由 pyuv 在事件循环里调用
+# 原来的 spider_pyuv*.py 每次爬取都同步调用一次 pyuv.dns.getaddrinfo
+class UVResolver(Resolver):
+    def __init__(self, loop, ttl=300):
+        super().__init__(ttl)
+        self.loop = loop
+
+    def _lookup(self, key):
+        host, port = key
+
+        def callback(result, error):
+            if error:
+                self._finish(key, None, OSError(pyuv.errno.strerror(error)))
+            else:
+                self._finish(key, result[0].sockaddr, None)
+        # 无效的主机名在发起查询时就会出错，同样通过 _finish 报告
+        try:
+            pyuv.dns.getaddrinfo(self.loop, host, port, socket.AF_INET,
+                                 socket.SOCK_STREAM, callback=callback)
+        except Exception as e:
+            self._finish(key, None, OSError(str(e)))
+
+
+# pyuv 回调版爬虫，pyuv 自动选择平台上最优的 I/O 模型
+class Crawler:
+    def __init__(self, url, loop, resolver, writer, cache, stats, results,
+                 config):
+        self._url = url
+        self.url = urlparse(url)
+        self.loop = loop
+        self.resolver = resolver
+        self.results = results
+        self.config = config
+        self.download = Download(config, self.url, writer, cache, stats,
+                                 results.timings)
+        self.started = None     # 开始解析域名的时间
+        self.resolved = None    # 域名解析完成的时间
+
+    # 域名解析完成后调用 connect 方法
+    # pyuv 的 TCP 句柄不能直接进行 TLS 握手，https 的 URL 直接报告失败
+    def fetch(self):
+        if self.url.scheme == 'https':
+            self.results.failure(self._url, 'pyuv 后端不支持 https')
+            return
+        self.started = time.monotonic()
+        self.resolver.resolve(*address(self.url), self.connect)
+
+    def connect(self, ip_address, error):
+        if error is not None:
+            self.results.failure(self._url, error)
+            return
+        self.resolved = time.monotonic()
+        self.results.timings.add('dns', self.resolved - self.started)
+        self.client = pyuv.TCP(self.loop)
+        # 向服务器发送连接请求，self.writable 方法作为回调函数
+        self.client.connect(ip_address, self.writable)
+
+    # 连接服务器成功后自动被调用
+    def writable(self, handle, error):
+        if error:
+            return self.fail(handle, pyuv.errno.strerror(error))
+        self.results.timings.add('connect', time.monotonic() - self.resolved)
+        handle.write(self.download.request())
+        handle.start_read(self.readable)
+
+    # 服务器传回数据时自动被调用，data 为服务器返回的数据片段
+    def readable(self, handle, data, error):
+        try:
+            if data:
+                done = self.download.feed(data)
+            elif error == pyuv.errno.UV_EOF:
+                self.download.feed_eof()
+                done = True
+            else:
+                return self.fail(handle, pyuv.errno.strerror(error))
+        except HTTPError as e:
+            return self.fail(handle, e)
+        if done:
+            handle.close()
+            self.results.success(self._url)
+
+    def fail(self, handle, error):
+        handle.close()
+        self.download.abort()
+        self.results.failure(self._url, error)
+
+
+def run(urls, config, results):
+    loop = pyuv.Loop.default_loop()
+    resolver = UVResolver(loop, config.dns_ttl)
+    store = open_store(config)
+    writer = DiskWriter(config.writers, config.write_queue, config.fsync,
+                        open_new if store is None else store.open)
+    cache = open_cache(config)
+    stats = TransferStats()
+    for url in urls:
+        crawler = Crawler(url, loop, resolver, writer, cache, stats, results,
+                          config)
+        crawler.fetch()
+    loop.run()
+    writer.close()
+    writer.report(results, cache)
+    print('域名解析 {} 次'.format(resolver.lookups))
+    if stats.responses:
+        print(stats.status())
+    if cache is not None:
+        print(cache.status())
+        cache.close()
+    if store is not None:
+        print(store.status())
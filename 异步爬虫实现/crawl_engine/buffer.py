@@ -0,0 +1,49 @@
+import ssl
+
+
+# 零复制的接收缓冲区，所有后端共用
+# 原来每次 recv 都新建一个 bytes 对象，下载 1MB 的图片要创建几百个临时对象
+# 这里每个连接预先分配一个 bytearray ，用 recv_into 把数据直接收进去，
+# 返回指向缓冲区的 memoryview 切片，交给解析器和写文件的函数，中间不复制
+
+MIN_READ_SIZE = 4096        # 每次读取的最小字节数
+MAX_READ_SIZE = 262144      # 每次读取的最大字节数
+
+
+# 每次读取的字节数根据实际收到的数据量自动调整
+# 缓冲区被读满说明内核里还有数据，下次读取的字节数翻倍
+# 收到的数据不到四分之一时减半，缓冲区只在读满时变大，慢速连接的缓冲区保持较小
+class ReadBuffer:
+    def __init__(self, size=16384):
+        self.size = size
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self.reads = 0          # recv_into 的调用次数
+        self.allocated = size   # 为缓冲区分配的字节数
+
+    # 调用套接字的 recv_into 方法，返回收到的数据，服务器关闭连接时返回空的 memoryview
+    # 返回的 memoryview 在下次调用此方法时会被覆盖，需要保留数据的话须自行复制
+    # 非阻塞套接字没有数据时抛出 BlockingIOError 异常
+    # TLS 套接字没有数据时抛出的 SSLWantReadError 也转换成 BlockingIOError ，
+    # 后端用同样的方式等待可读事件。TLS 层可能缓存着已解密的数据，这时不会有可读事件，
+    # 所以每次唤醒后要一直读到抛出异常为止
+    def recv_into(self, sock):
+        try:
+            n = sock.recv_into(self._view[:self.size])
+        except ssl.SSLWantReadError:
+            raise BlockingIOError('TLS 连接暂时没有数据') from None
+        self.reads += 1
+        data = self._view[:n]
+        self._adapt(n)
+        return data
+
+    def _adapt(self, n):
+        if n == self.size and self.size < MAX_READ_SIZE:
+            self.size *= 2
+        elif n < self.size // 4 and self.size > MIN_READ_SIZE:
+            self.size //= 2
+        # 缓冲区只增不减，变大时重新分配，之前返回的 memoryview 仍然指向旧的缓冲区
+        if self.size > len(self._buffer):
+            self._buffer = bytearray(self.size)
+            self._view = memoryview(self._buffer)
+            self.allocated += self.size
@@ -0,0 +1,101 @@
+import sqlite3
+import threading
+
+
+# 重新爬取时使用的条件请求缓存
+# 原来每次运行都把全部图片重新下载一遍，大部分图片其实没有变化
+# 这里按 URL 记录上次下载时服务器返回的 ETag 、Last-Modified ，以及文件大小、
+# 内容的 SHA-256 和下载用的秒数。再次爬取时带上 If-None-Match 和 If-Modified-Since ，
+# 服务器返回 304 时不再接收响应体，本地的文件保持不变
+
+COMMIT_EVERY = 1000     # 每记录多少个 URL 提交一次事务
+
+
+# 一个 URL 的缓存记录
+class Entry:
+    def __init__(self, etag, last_modified, size, digest, seconds):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = size            # 响应体的字节数
+        self.digest = digest        # 响应体的 SHA-256 ，十六进制字符串
+        self.seconds = seconds      # 上次完整下载用的秒数
+
+    # 条件请求的报头，服务器没有返回验证信息时为空字典
+    def headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class MetaCache:
+    def __init__(self, path):
+        # threads 后端在多个线程里读写，用锁保护连接
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        # 多进程爬取时每个子进程打开同一个文件，写入冲突时等待而不是报错
+        self.db.execute('PRAGMA busy_timeout = 30000')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                        'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                        'size INTEGER NOT NULL, digest TEXT NOT NULL, '
+                        'seconds REAL NOT NULL)')
+        self.db.commit()
+        self._uncommitted = 0
+        self.stored = 0         # 完整下载并记录的 URL 数
+        self.hits = 0           # 服务器返回 304 的 URL 数
+        self.bytes_saved = 0    # 因 304 没有下载的字节数
+        self.seconds_saved = 0  # 按上次下载用的时间估计节省的秒数
+
+    # 返回 URL 的缓存记录，没有时返回 None
+    def get(self, url):
+        with self._lock:
+            row = self.db.execute(
+                'SELECT etag, last_modified, size, digest, seconds FROM meta '
+                'WHERE url = ?', (url,)).fetchone()
+        return None if row is None else Entry(*row)
+
+    # 完整下载一个 URL 之后记录它的验证信息
+    def store(self, url, etag, last_modified, size, digest, seconds):
+        with self._lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?, ?, ?)',
+                (url, etag, last_modified, size, digest, seconds))
+            self.stored += 1
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_EVERY:
+                self.db.commit()
+                self._uncommitted = 0
+
+    # 删除 URL 的缓存记录，文件写入失败时调用，下次爬取时完整下载
+    def forget(self, url):
+        with self._lock:
+            self.db.execute('DELETE FROM meta WHERE url = ?', (url,))
+            self.db.commit()
+
+    # 服务器返回 304 时调用，seconds 为这次条件请求用的秒数
+    def hit(self, entry, seconds):
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += entry.size
+            self.seconds_saved += max(0, entry.seconds - seconds)
+
+    def status(self):
+        return '缓存命中 {} 个，节省 {:.1f} MB 、约 {:.1f} 秒，新记录 {} 个'.format(
+            self.hits, self.bytes_saved / 1048576, self.seconds_saved,
+            self.stored)
+
+    def close(self):
+        with self._lock:
+            self.db.commit()
+            self.db.close()
+
+
+# 根据配置打开缓存，没有指定缓存文件时返回 None
+def open_cache(config):
+    if config.cache is None:
+        return None
+    return MetaCache(config.cache)
@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import argparse
+
+from . import shard
+from .backends import BACKENDS, get_backend
+from .common import Config, Results
+from .frontier import Frontier
+
+
+# 从文件或标准输入中逐行读取 URL ，忽略空行和 # 开头的注释行
+def read_urls(source):
+    for line in source:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='crawl_engine', description='图片爬虫引擎，可选择不同的实现方式')
+    parser.add_argument('file', nargs='?',
+                        help='URL 列表文件，每行一个 URL ，- 表示标准输入；'
+                             '默认从标准输入读取，使用 --frontier 时默认不读取')
+    parser.add_argument('-b', '--backend', choices=sorted(BACKENDS),
+                        default='selectors', help='爬虫后端，默认为 selectors')
+    parser.add_argument('-o', '--out-dir', default='pic',
+                        help='图片保存目录，默认为 pic')
+    parser.add_argument('--threads', type=int, default=10,
+                        help='threads 后端的线程数，默认为 10')
+    parser.add_argument('--pool-size', type=int, default=20,
+                        help='连接池中每个主机最多打开的连接数，默认为 20')
+    parser.add_argument('--idle-timeout', type=float, default=30,
+                        help='空闲连接的最长保留秒数，默认为 30')
+    parser.add_argument('--dns-ttl', type=float, default=300,
+                        help='域名解析结果的缓存秒数，默认为 300')
+    parser.add_argument('--pipeline', type=int, default=0,
+                        help='selectors 后端每个连接管线化发送的请求数，'
+                             '默认不使用管线化')
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='generator 和 greenlet 后端同时运行的协程数，'
+                             '默认为 100')
+    parser.add_argument('--per-host', type=int, default=20,
+                        help='generator 后端每个主机同时运行的协程数，默认为 20')
+    parser.add_argument('--report-every', type=int, default=100,
+                        help='每结束多少个 URL 报告一次进度，0 表示不报告')
+    parser.add_argument('--connect-timeout', type=float, default=10,
+                        help='连接的超时秒数，默认为 10')
+    parser.add_argument('--read-timeout', type=float, default=30,
+                        help='每次等待服务器数据的超时秒数，默认为 30')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='下载失败后最多重试的次数，默认为 2')
+    parser.add_argument('--backoff', type=float, default=0.5,
+                        help='第一次重试前最多等待的秒数，之后每次翻倍，默认为 0.5')
+    parser.add_argument('--writers', type=int, default=2,
+                        help='非阻塞后端写文件的线程数，默认为 2')
+    parser.add_argument('--write-queue', type=int, default=256,
+                        help='每个写线程最多排队的数据片段数，默认为 256')
+    parser.add_argument('--fsync', type=int, default=0,
+                        help='每写完多少个文件调用一次 fsync ，默认不调用')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='按主机分片并行爬取的进程数，默认为 1')
+    parser.add_argument('--frontier',
+                        help='保存 URL 状态的 SQLite 文件，URL 自动去重，'
+                             '中断后用同一个文件重新运行即可继续')
+    parser.add_argument('--batch', type=int, default=10000,
+                        help='使用 --frontier 时每批交给后端的 URL 数，默认为 10000')
+    parser.add_argument('--cafile',
+                        help='验证 https 服务器证书用的 CA 证书文件，'
+                             '比如本地测试服务器的自签名证书')
+    parser.add_argument('--insecure', dest='tls_verify', action='store_false',
+                        help='不验证 https 服务器的证书')
+    parser.add_argument('--cache',
+                        help='条件请求缓存的 SQLite 文件，再次爬取时没有变化的图片不再下载')
+    parser.add_argument('--store', action='store_true',
+                        help='相同内容的图片只保存一份，文件名是指向它的硬链接')
+    parser.add_argument('--range-parts', type=int, default=4,
+                        help='generator 后端把大文件分成几段并行下载，默认为 4')
+    parser.add_argument('--range-threshold', type=float, default=8,
+                        help='超过多少 MB 的文件分段下载，默认为 8')
+    parser.add_argument('--no-compress', dest='compress',
+                        action='store_false',
+                        help='不请求服务器压缩响应体')
+    parser.add_argument('--timing-report', metavar='FILE',
+                        help='把各阶段耗时的直方图保存为 JSON 文件，并打印分位数')
+    parser.add_argument('--slow-callback', type=float, metavar='MS',
+                        help='监控事件循环，打印运行超过 MS 毫秒的回调函数，'
+                             '只对 selectors 、generator 和 greenlet 后端有效')
+    parser.add_argument('--loop', choices=('selectors', 'epoll'),
+                        default='selectors',
+                        help='selectors 和 generator 后端的事件循环，'
+                             'epoll 直接使用边缘触发的 epoll ，只能在 Linux 上使用')
+    return parser.parse_args(argv)
+
+
+# 把 URL 列表交给后端，多进程时交给 shard 模块分片
+def crawl(backend_name, urls, config, results):
+    if config.processes > 1:
+        shard.run(backend_name, urls, config, results)
+    else:
+        get_backend(backend_name).run(urls, config, results)
+
+
+# 从 frontier 里逐批取出 URL 爬取，结果写回 frontier
+def crawl_frontier(backend_name, frontier, config, results):
+    while True:
+        urls = frontier.claim(config.batch)
+        if not urls:
+            break
+        crawl(backend_name, urls, config, results)
+        frontier.commit()
+        print('本次运行{}'.format(results.summary()))
+    # 统计各状态的数量需要扫描整个表，只在最后打印一次
+    print(frontier.status())
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.file is None and args.frontier is None:
+        args.file = '-'
+    if args.file is None:
+        source = None
+    elif args.file == '-':
+        source = sys.stdin
+    else:
+        source = open(args.file)
+    # 提前导入后端模块，缺少第三方库时在开始爬取前报错
+    get_backend(args.backend)
+    # 除了 URL 文件和后端名称，其余命令行参数都是 Config 的同名参数
+    options = dict(vars(args))
+    del options['file'], options['backend']
+    config = Config(**options)
+    os.makedirs(config.out_dir, exist_ok=True)
+    start = time.time()
+    if config.frontier is None:
+        with source:
+            urls = list(read_urls(source))
+        results = Results()
+        crawl(args.backend, urls, config, results)
+    else:
+        frontier = Frontier(config.frontier)
+        if source is not None:
+            with source:
+                added = frontier.add(read_urls(source))
+            print('新增 URL {} 个'.format(added))
+        results = Results(frontier.finish)
+        try:
+            crawl_frontier(args.backend, frontier, config, results)
+        finally:
+            frontier.close()
+    print(results.summary())
+    print('总耗时：{:.3f}s'.format(time.time() - start))
+    if config.timing_report is not None:
+        print(results.timings.status())
+        results.timings.save(config.timing_report)
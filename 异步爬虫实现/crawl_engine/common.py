@@ -0,0 +1,326 @@
+import os
+import time
+import hashlib
+import threading
+
+from .decoding import ACCEPT_ENCODING, make_decoder
+from .http_parser import HTTPError, ParseError, ResponseParser
+from .store import open_new
+from .timing import Timings
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+# 爬取任务的配置，由命令行参数生成，所有后端共用同一个实例
+class Config:
+    def __init__(self, out_dir='pic', threads=10, pool_size=20,
+                 idle_timeout=30, dns_ttl=300, pipeline=0, concurrency=100,
+                 per_host=20, report_every=100, connect_timeout=10,
+                 read_timeout=30, retries=2, backoff=0.5, writers=2,
+                 write_queue=256, fsync=0, processes=1, frontier=None,
+                 batch=10000, cafile=None, tls_verify=True, cache=None,
+                 store=False, range_parts=4, range_threshold=8,
+                 compress=True, timing_report=None, slow_callback=None,
+                 loop='selectors'):
+        self.out_dir = out_dir      # 图片保存目录
+        self.threads = threads      # threads 后端的线程数
+        self.pool_size = pool_size  # 连接池中每个主机最多打开的连接数
+        self.idle_timeout = idle_timeout    # 空闲连接的最长保留秒数
+        self.dns_ttl = dns_ttl      # 域名解析结果的缓存秒数
+        self.pipeline = pipeline    # selectors 后端每个连接管线化发送的请求数
+        # generator 和 greenlet 后端同时运行的协程数
+        self.concurrency = concurrency
+        self.per_host = per_host    # generator 后端每个主机同时运行的协程数
+        self.report_every = report_every    # 每结束多少个 URL 报告一次进度
+        self.connect_timeout = connect_timeout  # 连接的超时秒数
+        self.read_timeout = read_timeout    # 每次等待服务器数据的超时秒数
+        self.retries = retries      # 下载失败后最多重试的次数
+        self.backoff = backoff      # 第一次重试前等待时间的上限，之后每次翻倍
+        self.writers = writers      # 非阻塞后端写文件的线程数
+        self.write_queue = write_queue      # 每个写线程的队列长度上限
+        self.fsync = fsync          # 每写完多少个文件调用一次 fsync ，0 表示不调用
+        self.processes = processes  # 按主机分片并行爬取的进程数
+        self.frontier = frontier    # 保存 URL 状态的 SQLite 文件，None 表示不保存
+        self.batch = batch          # 使用 frontier 时每批交给后端的 URL 数
+        self.cafile = cafile        # 验证 https 服务器证书用的 CA 证书文件
+        self.tls_verify = tls_verify        # 是否验证 https 服务器的证书
+        self.cache = cache          # 条件请求缓存的 SQLite 文件，None 表示不使用
+        self.store = store          # 是否把图片保存到内容寻址存储里
+        self.range_parts = range_parts      # 大文件分成几段并行下载
+        self.range_threshold = range_threshold  # 超过多少 MB 的文件分段下载
+        self.compress = compress    # 是否请求服务器压缩响应体
+        self.timing_report = timing_report  # 保存分阶段计时的 JSON 文件
+        # 事件循环监控的慢回调阈值毫秒数，None 表示不监控
+        self.slow_callback = slow_callback
+        self.loop = loop            # selectors 和 generator 后端使用的事件循环
+
+
+# 记录每个 URL 的最终结果，所有后端共用
+# 后端在 URL 下载完成或者重试次数用完之后调用 success 或 failure 方法
+# on_finish 在每个 URL 结束时调用，参数为 URL 和异常对象，成功时异常对象为 None
+# on_revoke 在已经报告成功的 URL 改记为失败时调用，参数相同，为 None 时调用 on_finish
+# threads 后端会在多个线程里同时调用
+class Results:
+    def __init__(self, on_finish=None, on_revoke=None):
+        self.on_finish = on_finish
+        self.on_revoke = on_revoke
+        self.succeeded = 0
+        self.failed = 0
+        self.timings = Timings()    # 各阶段的耗时，后端在下载过程中记录
+        self._lock = threading.Lock()
+
+    # 成功的 URL 数量很多，不再逐个打印，进度由各后端的状态报告体现
+    def success(self, url):
+        self.add(url, None)
+
+    def failure(self, url, error):
+        print('URL: {} 下载失败: {}'.format(url, error))
+        self.add(url, error)
+
+    # 只记录结果不打印，多进程爬取时父进程用它汇总子进程的结果
+    def add(self, url, error):
+        with self._lock:
+            if error is None:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            if self.on_finish is not None:
+                self.on_finish(url, error)
+
+    # 非阻塞后端在写线程里写文件，URL 报告成功之后才发现写入失败，
+    # 爬取结束时由 writer.DiskWriter.report 调用
+    def write_failed(self, url, error):
+        print('URL: {} 写入文件失败: {}'.format(url, error))
+        self.revoke(url, error)
+
+    # 只改记结果不打印，多进程爬取时父进程使用
+    def revoke(self, url, error):
+        with self._lock:
+            self.succeeded -= 1
+            self.failed += 1
+            if self.on_revoke is not None:
+                self.on_revoke(url, error)
+            elif self.on_finish is not None:
+                self.on_finish(url, error)
+
+    def summary(self):
+        return '成功 {} 个，失败 {} 个'.format(self.succeeded, self.failed)
+
+
+# 返回 connect 方法所需的地址元组，参数为 urlparse 的返回值
+# 原来的 spider_*.py 直接用 url.netloc 连接 80 端口
+# 这里把主机名和端口分开，方便在本地用其它端口的服务器测试
+def address(url):
+    return url.hostname, url.port or DEFAULT_PORTS.get(url.scheme, 80)
+
+
+# 连接的来源，同一来源的 URL 可以共用连接
+# http 和 https 的连接不能混用，所以除了主机和端口还要区分协议
+def origin(url):
+    return (url.scheme,) + address(url)
+
+
+# 向服务器发送的数据的固定格式
+# keep_alive 为 True 时请求服务器保持连接，以便连接池复用
+# headers 为附加的报头字典，比如条件请求的 If-None-Match
+def request_data(url, keep_alive=False, headers=None):
+    path = url.path or '/'
+    if url.query:
+        path += '?' + url.query
+    data = 'GET {} HTTP/1.1\r\nHost: {}\r\nConnection: {}\r\n'.format(
+        path, url.netloc, 'keep-alive' if keep_alive else 'close')
+    if headers:
+        data += ''.join('{}: {}\r\n'.format(name, value)
+                        for name, value in headers.items())
+    return (data + '\r\n').encode()
+
+
+# 取 url.path 用斜杠分隔之后的最后一部分，作为保存图片的文件名
+def file_path(config, url):
+    name = os.path.basename(url.path) or 'index.html'
+    return os.path.join(config.out_dir, name)
+
+
+# 该类把一个 URL 的响应交给解析器，响应体的数据片段直接写入文件
+# 原来的爬虫先把全部响应存到内存里，这里不再缓存响应体
+# 传入 writer.DiskWriter 实例时，文件由写线程在后台写入，不占用事件循环
+# 传入 store.BlobStore 实例时，文件写入内容寻址存储
+# 传入 cache.MetaCache 实例时，本地文件完好的 URL 发送条件请求，
+# 服务器返回 304 时保留本地文件，完整下载时一边接收一边计算 SHA-256 并记录到缓存
+# 服务器压缩了响应体时边接收边解压，文件里保存的是解压后的数据，
+# 传入 decoding.TransferStats 实例时记录压缩前后的字节数
+# 传入 timing.Timings 实例时记录 ttfb 、transfer 、write 和 total 四个阶段的耗时
+class Download:
+    def __init__(self, config, url, writer=None, cache=None, stats=None,
+                 timings=None):
+        self.url = url
+        self.path = file_path(config, url)
+        self.writer = writer
+        self.cache = cache
+        self.stats = stats
+        self.timings = timings
+        self.compress = config.compress
+        self.file = None
+        self.decoder = None         # 响应体压缩过时的解压器
+        self.compressed = False     # 响应体是否压缩过
+        self.received = 0           # 收到的响应体字节数，压缩过时为解压前的大小
+        self.parser = ResponseParser(on_body=self.write,
+                                     on_headers=self.on_headers)
+        self.start = time.monotonic()
+        self.sent = None            # 发出请求的时间
+        self.first_byte = None      # 收到完整报头的时间
+        self.write_seconds = 0      # 打开、写入和关闭文件用的时间
+        self.entry = None           # 本地文件对应的缓存记录
+        self.not_modified = False   # 服务器是否返回了 304
+        self.size = 0               # 写入文件的字节数
+        self.hash = None
+        if cache is not None:
+            self.hash = hashlib.sha256()
+            self.entry = self._cached()
+
+    # 只有本地文件还在、大小也对得上时才发送条件请求，否则 304 会留下一个坏文件
+    def _cached(self):
+        entry = self.cache.get(self.url.geturl())
+        if entry is None:
+            return None
+        try:
+            if os.path.getsize(self.path) != entry.size:
+                return None
+        except OSError:
+            return None
+        return entry
+
+    # 发送给服务器的请求
+    def request(self, keep_alive=False):
+        self.sent = time.monotonic()
+        headers = {}
+        if self.compress:
+            headers['Accept-Encoding'] = ACCEPT_ENCODING
+        if self.entry is not None:
+            headers.update(self.entry.headers())
+        return request_data(self.url, keep_alive, headers)
+
+    # 报头解析完毕后调用，状态码不是 200 时放弃下载
+    # 304 只在发送了条件请求时才是正常的结果，这时没有响应体，不打开文件
+    def on_headers(self, parser):
+        self.first_byte = time.monotonic()
+        if parser.status == 304 and self.entry is not None:
+            self.not_modified = True
+            return
+        if parser.status != 200:
+            raise HTTPError('HTTP {} {}'.format(parser.status, parser.reason))
+        self.decoder = make_decoder(parser.headers.get('content-encoding', ''))
+        self.compressed = self.decoder is not None
+        self._open()
+
+    # 打开要写入的文件，args 为传给 writer.open 的其它参数
+    def _open(self, *args):
+        start = time.monotonic()
+        if self.writer is not None:
+            self.file = self.writer.open(self.path, *args,
+                                         url=self.url.geturl())
+        else:
+            self.file = open_new(self.path)
+        self.write_seconds += time.monotonic() - start
+
+    def write(self, chunk):
+        self.received += len(chunk)
+        if self.decoder is None:
+            self._write(chunk)
+            return
+        for data in self.decoder.decode(chunk):
+            self._write(data)
+
+    def _write(self, data):
+        start = time.monotonic()
+        self.file.write(data)
+        self.write_seconds += time.monotonic() - start
+        self.size += len(data)
+        if self.hash is not None:
+            self.hash.update(data)
+
+    # 需要的数据是否已接收完毕
+    @property
+    def done(self):
+        return self.parser.done
+
+    # 连接能否继续使用，只有在 done 为 True 之后才有意义
+    @property
+    def keep_alive(self):
+        return self.parser.keep_alive
+
+    # 传入收到的数据片段，返回 True 表示需要的数据已接收完毕
+    def feed(self, data):
+        self.parser.feed(data)
+        if self.done:
+            self.close()
+        return self.done
+
+    # 服务器关闭连接时调用
+    def feed_eof(self):
+        self.parser.feed_eof()
+        self.close()
+
+    # 压缩数据不完整时抛出 ParseError ，文件不关闭，由调用方调用 abort 方法删除
+    def close(self):
+        if self.decoder is not None and self.parser.done:
+            decoder, self.decoder = self.decoder, None
+            if not decoder.eof:
+                raise ParseError('压缩的响应体不完整')
+        self._count()
+        if self.file is not None:
+            start = time.monotonic()
+            if self.writer is not None:
+                # 没有接收完就关闭的文件留着续传，写入失败时由写线程区分
+                self.file.close(self.done)
+            else:
+                self.file.close()
+            self.file = None
+            self.write_seconds += time.monotonic() - start
+        if self.cache is not None and self.parser.done:
+            self._update_cache()
+        if self.timings is not None and self.parser.done:
+            self._record()
+
+    # 响应接收完毕后更新缓存，只记录一次
+    def _update_cache(self):
+        cache, self.cache = self.cache, None
+        seconds = time.monotonic() - self.start
+        if self.not_modified:
+            cache.hit(self.entry, seconds)
+            return
+        headers = self.parser.headers
+        cache.store(self.url.geturl(), headers.get('etag'),
+                    headers.get('last-modified'), self.size,
+                    self.hash.hexdigest(), seconds)
+
+    # 响应接收完毕后记录各阶段的耗时，只记录一次
+    def _record(self):
+        timings, self.timings = self.timings, None
+        now = time.monotonic()
+        if self.sent is not None:
+            timings.add('ttfb', self.first_byte - self.sent)
+            timings.add('total', now - self.sent)
+        timings.add('transfer', now - self.first_byte)
+        timings.add('write', self.write_seconds)
+
+    # 把传输的字节数记录到统计里，只记录一次
+    def _count(self):
+        if self.stats is not None:
+            stats, self.stats = self.stats, None
+            stats.add(self.compressed, self.received, self.size)
+
+    # 下载失败时关闭并删除不完整的文件
+    def abort(self):
+        self.decoder = None
+        self._count()
+        if self.file is None:
+            return
+        if self.writer is not None:
+            # 写线程关闭文件之后再删除
+            self.file.abort()
+            self.file = None
+        else:
+            self.close()
+            os.remove(self.path)
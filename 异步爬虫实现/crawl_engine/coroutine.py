@@ -0,0 +1,257 @@
+import os
+import types
+import socket
+from selectors import EVENT_READ, EVENT_WRITE
+
+from .buffer import ReadBuffer
+
+
+# 生成器协程框架：Future 、Task 和 AsyncSocket
+# 来自 spider_yield_from.py ，生成器后端和连接池共用
+# 原来 Future.set_value 在事件回调里直接调用 Task.step ，一个协程结束时会接着运行
+# 等待它的协程，栈帧层层嵌套，先被唤醒的协程可以一直运行下去，其它协程只能等着
+# 现在 Task 被唤醒时只是把 step 放进事件循环的就绪队列，事件循环每轮运行一次队列，
+# 各个协程轮流运行，栈的深度也不再随等待链增长
+# Future 实现了 __await__ ，协程既可以写成 yield from 的生成器，也可以写成 async def ；
+# 本模块和连接池的协程函数用 types.coroutine 装饰，两种写法里都能直接等待
+
+
+# 任务被取消时在协程里抛出的异常
+# 与 asyncio 一样继承 BaseException ，爬虫里的 except Exception 不会把它吞掉
+class CancelledError(BaseException):
+    pass
+
+
+# 该类的实例用于存放未来的结果，结果也可以是一个异常
+class Future:
+    def __init__(self):
+        self.value = None
+        self.exception = None
+        self.done = False
+        self.cancelled = False
+        self._step_func = []
+
+    def add_step_func(self, func):
+        self._step_func.append(func)
+
+    # Future 被取消之后，原来的回调函数可能还会设置结果，这时忽略
+    def set_value(self, value):
+        if self.done:
+            return
+        self.value = value
+        self._finish()
+
+    def set_exception(self, exception):
+        if self.done:
+            return
+        self.exception = exception
+        self._finish()
+
+    # 取消 Future ，等待它的协程里抛出 CancelledError ，已经有结果时返回 False
+    def cancel(self):
+        if self.done:
+            return False
+        self.cancelled = True
+        self.set_exception(CancelledError())
+        return True
+
+    def _finish(self):
+        self.done = True
+        for func in self._step_func:
+            func(self)
+
+    # 实现 __iter__ 方法，Future 类的实例为可迭代对象
+    def __iter__(self):
+        # 该语句起到暂停协程的作用，并返回实例本身
+        # 结果已经存在时不需要暂停，比如回调函数被同步调用的情况
+        if not self.done:
+            yield self
+        # 结果是异常时在等待它的协程里抛出
+        if self.exception is not None:
+            raise self.exception
+        # 该语句定义的返回值会赋给 yield from 语句等号前面的变量
+        return self.value
+
+    # async def 协程里的 await 语句和 yield from 一样使用 __iter__
+    __await__ = __iter__
+
+
+# AsyncSocket 类封装套接字，主要方法都是协程函数
+# 原来每次 recv 前后都要注册和注销事件监听，每个数据片段多两次 epoll_ctl 系统调用
+# 这里套接字只注册一次，监听的事件变化时才调用 modify ，关闭时注销
+class AsyncSocket:
+    def __init__(self, loop):
+        self.loop = loop
+        self.sock = socket.socket()
+        self.sock.setblocking(False)
+        # 该连接是否是从连接池里复用的
+        self.reused = False
+        self._events = 0        # 当前注册监听的事件，0 表示没有注册
+        self._waiter = None     # 正在等待事件的 Future 实例
+        self.buffer = ReadBuffer()
+
+    # 等待套接字的事件就绪，超过 timeout 秒时抛出 TimeoutError 异常
+    # 事件回调和定时器回调都会设置 Future 的值，先到的那个生效
+    @types.coroutine
+    def _wait(self, events, timeout):
+        fd = self.sock.fileno()
+        if not self._events:
+            self.loop.register(fd, events, self._on_event)
+        elif self._events != events:
+            self.loop.modify(fd, events, self._on_event)
+        self._events = events
+        f = self._waiter = Future()
+        timer = None
+        if timeout is not None:
+            timer = self.loop.call_later(timeout, self._on_timeout, f)
+        try:
+            ready = yield from f
+        finally:
+            # 任务被取消时也要取消定时器
+            if timer is not None:
+                timer.cancel()
+            if self._waiter is f:
+                self._waiter = None
+        if not ready:
+            raise TimeoutError('等待超过 {} 秒'.format(timeout))
+
+    # 事件就绪时由事件循环调用，唤醒等待的协程
+    # 没有协程等待时暂停监听，否则水平触发的事件会让事件循环空转
+    def _on_event(self):
+        f = self._waiter
+        if f is None or f.done:
+            self.pause()
+            return
+        self._waiter = None
+        f.set_value(True)
+
+    def _on_timeout(self, f):
+        if self._waiter is f:
+            self._waiter = None
+            f.set_value(False)
+
+    # 注销事件监听，比如连接放回连接池的时候，下次等待时重新注册
+    def pause(self):
+        if self._events:
+            self.loop.unregister(self.sock.fileno())
+            self._events = 0
+
+    # 向服务器发送连接请求并等待套接字可写
+    @types.coroutine
+    def connect(self, address, timeout=None):
+        try:
+            self.sock.connect(address)
+        except BlockingIOError:
+            pass
+        yield from self._wait(EVENT_WRITE, timeout)
+        # 连接失败时可写事件同样会就绪，需要检查套接字的错误码
+        error = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            raise OSError(error, os.strerror(error))
+
+    # 在已连接的套接字上进行 TLS 握手，tls 为 tls.TLSContext 实例
+    # 包装后的套接字立即替换 self.sock ，握手失败时调用方关闭的是包装后的套接字
+    @types.coroutine
+    def start_tls(self, tls, host, port, timeout=None):
+        self.sock = tls.wrap(self.sock, host, port)
+        while True:
+            events = tls.handshake(self.sock)
+            if events is None:
+                return
+            yield from self._wait(events, timeout)
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    # 该方法会多次执行，以获取服务器返回的数据片段
+    # 返回值是指向接收缓冲区的 memoryview ，下次调用此方法时会被覆盖
+    # 先直接调用 recv_into ，内核里没有数据时才等待可读事件
+    # 这样每次唤醒之后会一直读到 EAGAIN 为止，不必每个数据片段都经过一次 select
+    # 回调函数只负责唤醒协程，recv 在协程里执行，出错时异常抛给 fetch 处理
+    @types.coroutine
+    def read(self, timeout=None):
+        while True:
+            try:
+                return self.buffer.recv_into(self.sock)
+            except BlockingIOError:
+                pass
+            yield from self._wait(EVENT_READ, timeout)
+
+    def close(self):
+        self.pause()
+        self.sock.close()
+
+
+# 该类用于控制协程运行步骤
+# Task 本身也是 Future ，协程结束时它的值为协程的返回值，
+# 协程抛出异常时保存异常，异常不会传到事件循环里让整个爬虫停下来
+# 创建时和被唤醒时都通过 loop.call_soon 把 step 放进就绪队列，由事件循环运行
+class Task(Future):
+    def __init__(self, coro, loop):
+        super().__init__()
+        self.coro = coro
+        self.loop = loop
+        self._waiting = None        # 协程正在等待的 Future 实例
+        self._must_cancel = False   # 下次运行时在协程里抛出 CancelledError
+        loop.call_soon(self.step)
+
+    # 取消任务，正在等待的 Future 一起取消，异常从等待处抛出
+    # 协程可以捕获 CancelledError 做清理工作，任务结束后 cancelled 为 True
+    def cancel(self):
+        if self.done:
+            return False
+        if self._waiting is None or not self._waiting.cancel():
+            self._must_cancel = True
+        return True
+
+    def step(self):
+        self._waiting = None
+        try:
+            if self._must_cancel:
+                self._must_cancel = False
+                new_future = self.coro.throw(CancelledError())
+            else:
+                new_future = self.coro.send(None)
+        except StopIteration as e:
+            self.set_value(e.value)
+            return
+        except CancelledError as e:
+            self.cancelled = True
+            self.set_exception(e)
+            return
+        except Exception as e:
+            self.set_exception(e)
+            return
+        # 协程 yield None 表示让出一次，下一轮再运行
+        if new_future is None:
+            self.loop.call_soon(self.step)
+            return
+        self._waiting = new_future
+        new_future.add_step_func(self._wakeup)
+
+    def _wakeup(self, future):
+        self.loop.call_soon(self.step)
+
+
+# 协程函数，暂停 delay 秒
+@types.coroutine
+def sleep(loop, delay):
+    f = Future()
+    timer = loop.call_later(delay, f.set_value, None)
+    try:
+        yield from f
+    finally:
+        # 任务被取消时也要取消定时器
+        timer.cancel()
+
+
+# 协程函数，通过解析器获取域名对应的地址元组，解析失败时抛出异常
+@types.coroutine
+def resolve(resolver, host, port):
+    f = Future()
+    resolver.resolve(host, port, lambda address, error: f.set_value(
+        (address, error)))
+    address, error = yield from f
+    if error is not None:
+        raise error
+    return address
@@ -0,0 +1,92 @@
+import zlib
+import threading
+
+from .http_parser import HTTPError
+
+
+# 响应体的 gzip / deflate 解压
+# 原来的请求不带 Accept-Encoding ，HTML 页面和 SVG 之类的文本资源都按原样传输
+# 这里请求时声明支持 gzip 和 deflate ，服务器压缩了响应体时用 zlib.decompressobj
+# 在收到数据片段时逐段解压，不需要先把整个响应体存下来
+
+ACCEPT_ENCODING = 'gzip, deflate'
+MAX_OUTPUT = 65536      # 每次解压最多输出的字节数，压缩率很高的数据也不会占用太多内存
+
+
+class ContentDecoder:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'deflate':
+            # 按标准 deflate 应带 zlib 头，但有些服务器发送的是不带头的原始数据
+            self._decoder = zlib.decompressobj()
+        else:
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._started = False   # 是否已经解压出数据
+        # 还没有解压出数据时收到的压缩数据，zlib 头可能分几次到达，换成原始格式时从头解压
+        self._head = b''
+
+    # 压缩数据是否已经完整结束
+    @property
+    def eof(self):
+        return self._decoder.eof
+
+    # 传入一段压缩数据，依次生成解压后的数据片段
+    def decode(self, chunk):
+        if not self._started and self.encoding == 'deflate':
+            self._head += chunk
+        try:
+            data = self._decoder.decompress(chunk, MAX_OUTPUT)
+        except zlib.error as e:
+            if self.encoding != 'deflate' or self._started:
+                raise HTTPError('解压响应体失败: {}'.format(e))
+            # 没有 zlib 头的 deflate 数据，换成原始格式从头解压
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            self._started = True
+            head, self._head = self._head, b''
+            yield from self.decode(head)
+            return
+        if data:
+            self._started = True
+            self._head = b''
+        while data:
+            yield data
+            tail = self._decoder.unconsumed_tail
+            data = self._decoder.decompress(tail, MAX_OUTPUT) if tail else b''
+
+
+# 根据 Content-Encoding 报头返回解压器，没有压缩时返回 None
+def make_decoder(encoding):
+    encoding = encoding.strip().lower()
+    if encoding in ('', 'identity'):
+        return None
+    if encoding in ('gzip', 'x-gzip'):
+        return ContentDecoder('gzip')
+    if encoding == 'deflate':
+        return ContentDecoder('deflate')
+    raise HTTPError('不支持的 Content-Encoding: {}'.format(encoding))
+
+
+# 统计传输的字节数，所有 Download 共用一个实例
+# threads 后端会在多个线程里同时调用
+class TransferStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.responses = 0      # 压缩过的响应数
+        self.received = 0       # 其中收到的压缩数据字节数
+        self.decoded = 0        # 其中解压后的字节数
+        self.plain = 0          # 没有压缩的响应体字节数
+
+    def add(self, compressed, received, decoded):
+        with self._lock:
+            if compressed:
+                self.responses += 1
+                self.received += received
+                self.decoded += decoded
+            else:
+                self.plain += received
+
+    def status(self):
+        return ('压缩的响应 {} 个，接收 {:.2f} MB ，解压后 {:.2f} MB ；'
+                '未压缩的响应体 {:.2f} MB').format(
+            self.responses, self.received / 1048576, self.decoded / 1048576,
+            self.plain / 1048576)
@@ -0,0 +1,103 @@
+import sqlite3
+import hashlib
+from itertools import islice
+
+
+# 保存在磁盘上的 URL 队列，可以去重，爬虫中断后重新运行时从中断的地方继续
+# 原来的爬虫把全部 URL 放在列表里，进程退出后进度全部丢失
+# 这里用 SQLite 记录每个 URL 的状态，URL 从文件里逐行读入，
+# 每次只取出一批交给后端，几千万个 URL 也不会全部加载到内存里
+
+# URL 的状态
+PENDING = 0         # 等待爬取
+IN_FLIGHT = 1       # 已取出，正在爬取
+DONE = 2            # 下载完成
+FAILED = 3          # 重试次数用完仍然失败
+
+STATE_NAMES = {PENDING: '等待', IN_FLIGHT: '进行中', DONE: '完成', FAILED: '失败'}
+
+INSERT_BATCH = 10000    # 每次插入的 URL 数
+COMMIT_EVERY = 1000     # 每记录多少个结果提交一次事务
+
+
+# URL 的 64 位哈希值，用唯一索引去重
+# 索引里只有 8 个字节的哈希值，比直接给 URL 建唯一索引小得多
+# 一千万个 URL 里出现哈希冲突的概率约为百万分之三
+def url_key(url):
+    digest = hashlib.blake2b(url.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class Frontier:
+    def __init__(self, path):
+        # threads 后端会在多个线程里记录结果，调用方 common.Results 已经加了锁
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # WAL 模式下提交事务不用每次都等待 fsync ，进程崩溃时已提交的数据不会丢失
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        # id 按插入的顺序递增，URL 按读入的顺序爬取，新数据总是写在表的末尾
+        self.db.execute('CREATE TABLE IF NOT EXISTS urls ('
+                        'id INTEGER PRIMARY KEY, key INTEGER NOT NULL UNIQUE, '
+                        'url TEXT NOT NULL, state INTEGER NOT NULL DEFAULT 0)')
+        # 只给等待和正在爬取的 URL 建索引，取出一批时不用扫描整个表
+        # 查询条件须写成 state = 0 ，用参数代替 0 的话 SQLite 不会使用这个索引
+        self.db.execute('CREATE INDEX IF NOT EXISTS pending ON urls (id) '
+                        'WHERE state = 0')
+        self.db.execute('CREATE INDEX IF NOT EXISTS in_flight ON urls (id) '
+                        'WHERE state = 1')
+        # 上次运行中断时正在爬取的 URL 重新放回队列
+        self.db.execute('UPDATE urls SET state = 0 WHERE state = 1')
+        self.db.commit()
+        self._uncommitted = 0
+
+    # 从可迭代对象里逐批读取 URL 并插入，已经存在的 URL 被忽略，返回新增的数量
+    def add(self, urls):
+        urls = iter(urls)
+        added = 0
+        while True:
+            batch = [(url_key(url), url) for url in islice(urls, INSERT_BATCH)]
+            if not batch:
+                break
+            before = self.db.total_changes
+            self.db.executemany(
+                'INSERT OR IGNORE INTO urls (key, url) VALUES (?, ?)', batch)
+            added += self.db.total_changes - before
+            self.db.commit()
+        return added
+
+    # 取出最多 n 个等待爬取的 URL ，标记为正在爬取
+    def claim(self, n):
+        rows = self.db.execute('SELECT id, url FROM urls WHERE state = 0 '
+                               'ORDER BY id LIMIT ?', (n,)).fetchall()
+        self.db.executemany('UPDATE urls SET state = ? WHERE id = ?',
+                            [(IN_FLIGHT, key) for key, _ in rows])
+        self.db.commit()
+        return [url for _, url in rows]
+
+    # 记录 URL 的最终结果，参数与 common.Results 的 on_finish 相同
+    def finish(self, url, error):
+        self.db.execute('UPDATE urls SET state = ? WHERE key = ?',
+                        (DONE if error is None else FAILED, url_key(url)))
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self._uncommitted = 0
+
+    # 各状态的 URL 数量，需要扫描整个表
+    def counts(self):
+        counts = dict.fromkeys(STATE_NAMES, 0)
+        counts.update(self.db.execute(
+            'SELECT state, COUNT(*) FROM urls GROUP BY state'))
+        return counts
+
+    def status(self):
+        counts = self.counts()
+        return '，'.join('{} {} 个'.format(STATE_NAMES[state], counts[state])
+                        for state in STATE_NAMES)
+
+    def close(self):
+        self.commit()
+        self.db.close()
@@ -0,0 +1,192 @@
+# 增量式 HTTP/1.1 响应解析器
+# 原来的爬虫把全部响应存到 self.response 里，最后用 \r\n\r\n 切开
+# 这里改为收到一段数据就解析一段，响应体的数据片段立即交给回调函数处理
+# 这样每个连接占用的内存是固定的，与图片大小无关
+
+import re
+
+
+class HTTPError(Exception):
+    pass
+
+
+# 服务器返回的数据不符合 HTTP 协议时抛出此异常
+class ParseError(HTTPError):
+    pass
+
+
+# 服务器没有按请求的范围返回数据时抛出此异常，比如文件在两次请求之间发生了变化
+class RangeError(HTTPError):
+    pass
+
+
+# 解析器的状态
+HEAD = 0            # 解析状态行和报头
+BODY_LENGTH = 1     # 按 Content-Length 读取响应体
+BODY_CLOSE = 2      # 没有长度信息，读取响应体直到服务器关闭连接
+CHUNK_SIZE = 3      # 读取分块编码的块大小行
+CHUNK_DATA = 4      # 读取块数据
+CHUNK_CRLF = 5      # 读取块数据后面的 \r\n
+TRAILER = 6         # 读取分块编码结尾的 trailer 报头
+DONE = 7            # 响应解析完毕
+
+MAX_HEADER_SIZE = 65536     # 报头的最大长度
+MAX_CHUNK_LINE = 1024       # 块大小行的最大长度
+
+# int 函数也接受负号、加号、下划线和 0x 前缀，负的长度会让解析位置往回走
+DECIMAL = re.compile(r'[0-9]+')
+HEX = re.compile(rb'[0-9a-fA-F]+')
+
+
+class ResponseParser:
+    # on_headers 在报头解析完毕后调用，参数为解析器自身
+    # on_body 在收到响应体的数据片段时调用，参数为 memoryview 对象
+    # 如果需要在回调函数之外使用数据片段，须自行复制一份
+    # method 为 HEAD 时，响应没有响应体
+    def __init__(self, on_body=None, on_headers=None, method='GET'):
+        self.on_body = on_body
+        self.on_headers = on_headers
+        self.method = method
+        self.version = None
+        self.status = None
+        self.reason = None
+        # 报头字典的键统一为小写
+        self.headers = {}
+        self._state = HEAD
+        self._remaining = 0     # 当前响应体或块还需要读取的字节数
+        self._buffer = bytearray()
+
+    @property
+    def done(self):
+        return self._state == DONE
+
+    # 服务器是否会保持连接，只有在报头解析完毕之后才有意义
+    @property
+    def keep_alive(self):
+        if self._state == BODY_CLOSE:
+            return False
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection
+
+    # 向解析器传入从套接字收到的数据片段
+    # 返回值为本次解析用掉的字节数，响应解析完毕后剩余的数据属于下一个响应
+    def feed(self, data):
+        view = memoryview(data)
+        size = len(view)
+        pos = 0
+        while pos < size and self._state != DONE:
+            state = self._state
+            if state == HEAD:
+                head, pos = self._take_until(view, pos, b'\r\n\r\n',
+                                             MAX_HEADER_SIZE)
+                if head is not None:
+                    self._parse_head(head)
+            elif state in (BODY_LENGTH, CHUNK_DATA):
+                end = min(size, pos + self._remaining)
+                self._emit(view[pos:end])
+                self._remaining -= end - pos
+                pos = end
+                if not self._remaining:
+                    self._state = DONE if state == BODY_LENGTH else CHUNK_CRLF
+            elif state == BODY_CLOSE:
+                self._emit(view[pos:])
+                pos = size
+            elif state == CHUNK_SIZE:
+                line, pos = self._take_until(view, pos, b'\r\n', MAX_CHUNK_LINE)
+                if line is not None:
+                    self._parse_chunk_size(line)
+            elif state == CHUNK_CRLF:
+                line, pos = self._take_until(view, pos, b'\r\n', 2)
+                if line is not None:
+                    if line:
+                        raise ParseError('块数据后面缺少 \\r\\n')
+                    self._state = CHUNK_SIZE
+            elif state == TRAILER:
+                line, pos = self._take_until(view, pos, b'\r\n',
+                                             MAX_HEADER_SIZE)
+                # trailer 报头用不到，空行表示响应结束
+                if line is not None and not line:
+                    self._state = DONE
+        return pos
+
+    # 服务器关闭连接时调用此方法
+    # 只有读取到连接关闭为止的响应才能在这时正常结束
+    def feed_eof(self):
+        if self._state == BODY_CLOSE:
+            self._state = DONE
+        elif self._state != DONE:
+            raise ParseError('服务器在响应结束前关闭了连接')
+
+    def _emit(self, chunk):
+        if chunk and self.on_body is not None:
+            self.on_body(chunk)
+
+    # 从 view 的 pos 处开始查找分隔符，找到时返回分隔符之前的完整数据
+    # 数据可能分多次到达，没找到时先存入缓冲区，返回 None
+    # 每次最多复制 limit 个字节，所以缓冲区的大小是有限的
+    def _take_until(self, view, pos, delimiter, limit):
+        old = len(self._buffer)
+        self._buffer += view[pos:pos + limit + len(delimiter) - old]
+        index = self._buffer.find(delimiter, max(old - len(delimiter) + 1, 0))
+        if index < 0:
+            if len(self._buffer) > limit:
+                raise ParseError('报头或块大小行太长')
+            return None, len(view)
+        line = bytes(self._buffer[:index])
+        used = index + len(delimiter) - old
+        self._buffer.clear()
+        return line, pos + used
+
+    def _parse_head(self, head):
+        lines = head.decode('latin-1').split('\r\n')
+        parts = lines[0].split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise ParseError('状态行格式错误: {!r}'.format(lines[0]))
+        try:
+            status = int(parts[1])
+        except ValueError:
+            raise ParseError('状态码错误: {!r}'.format(parts[1]))
+        # 1xx 是临时响应，后面还有真正的响应，丢弃即可
+        if 100 <= status < 200:
+            return
+        self.version = parts[0]
+        self.status = status
+        self.reason = parts[2] if len(parts) > 2 else ''
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise ParseError('报头格式错误: {!r}'.format(line))
+            name = name.strip().lower()
+            value = value.strip()
+            if name in self.headers:
+                self.headers[name] += ', ' + value
+            else:
+                self.headers[name] = value
+        self._start_body()
+        if self.on_headers is not None:
+            self.on_headers(self)
+
+    # 根据状态码和报头确定读取响应体的方式
+    def _start_body(self):
+        if self.method == 'HEAD' or self.status in (204, 304):
+            self._state = DONE
+        elif 'chunked' in self.headers.get('transfer-encoding', '').lower():
+            self._state = CHUNK_SIZE
+        elif 'content-length' in self.headers:
+            length = self.headers['content-length']
+            if not DECIMAL.fullmatch(length):
+                raise ParseError('Content-Length 错误: {!r}'.format(length))
+            self._remaining = int(length)
+            self._state = BODY_LENGTH if self._remaining else DONE
+        else:
+            self._state = BODY_CLOSE
+
+    def _parse_chunk_size(self, line):
+        # 块大小后面可能有分号隔开的扩展信息，用不到
+        size = line.split(b';', 1)[0].strip()
+        if not HEX.fullmatch(size):
+            raise ParseError('块大小错误: {!r}'.format(line))
+        self._remaining = int(size, 16)
+        self._state = CHUNK_DATA if self._remaining else TRAILER
@@ -0,0 +1,207 @@
+import select
+from collections import deque
+# selectors 是对 select 的封装，它会根据不同的操作系统自动选择适合的系统调用
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+
+from .timers import TimerHeap
+
+MAX_EVENTS = 1024       # EpollLoop 每次 epoll_wait 最多取出的事件数
+
+
+# 事件循环类，selectors 回调后端和生成器 Task 后端共用
+# 原来每个 spider_*.py 都有一个 selector 全局变量和一个 loop 函数
+# 这里把二者封装到一起，每次爬取创建一个实例，不再依赖全局变量
+class EventLoop:
+    def __init__(self):
+        self.selector = DefaultSelector()
+        self.timers = TimerHeap()
+        self.ready = deque()    # call_soon 加入的 (回调函数, 参数) ，每轮运行一次
+        self.stopped = False
+        self.monitor = None
+
+    # 开启运行状况监控，monitor 为 monitor.LoopMonitor 实例
+    # 用带计时的方法替换 _run_once ，不开启时没有任何额外的判断
+    def instrument(self, monitor):
+        self.monitor = monitor
+        self._run_once = self._run_once_monitored
+
+    # 注册监听文件描述符的事件，回调函数作为 data 保存在 SelectorKey 里
+    def register(self, fd, events, callback):
+        self.selector.register(fd, events, callback)
+
+    # 修改监听的事件和回调函数
+    def modify(self, fd, events, callback):
+        self.selector.modify(fd, events, callback)
+
+    # 注销事件监听
+    def unregister(self, fd):
+        self.selector.unregister(fd)
+
+    # 文件描述符是否已注册
+    def registered(self, fd):
+        return fd in self.selector.get_map()
+
+    # delay 秒之后调用 callback(*args) ，返回值可以调用 cancel 方法取消
+    def call_later(self, delay, callback, *args):
+        return self.timers.call_later(delay, callback, *args)
+
+    # 在下一轮事件循环里调用 callback(*args) ，Task 用它安排协程的下一步
+    def call_soon(self, callback, *args):
+        self.ready.append((callback, args))
+
+    def stop(self):
+        self.stopped = True
+
+    # 还有被监听的文件描述符、定时器或者就绪的回调函数
+    def _alive(self):
+        return bool(self.selector.get_map() or self.timers or self.ready)
+
+    # select 的超时时间为最近的定时器到期的时间，没有定时器时一直阻塞，
+    # 就绪队列不为空时不阻塞
+    def _timeout(self):
+        return 0 if self.ready else self.timers.timeout()
+
+    # 查询一次被监听的事件是否就绪，运行到期的定时器，再运行就绪队列
+    def _run_once(self):
+        events = self.selector.select(self._timeout())
+        for event_key, _ in events:
+            # SelectorKey 对象的 data 属性值就是回调函数
+            callback = event_key.data
+            callback()
+        self.timers.run_due()
+        self._run_ready()
+
+    # 开启监控时使用的 _run_once
+    def _run_once_monitored(self):
+        monitor = self.monitor
+        events = monitor.select_events(self.selector, self._timeout())
+        for event_key, _ in events:
+            monitor.call(event_key.data)
+        monitor.run_timers(self.timers)
+        self._run_ready(monitor.call)
+
+    # 只运行本轮开始时已经在队列里的回调函数，运行期间新加入的留到下一轮，
+    # 一个协程反复让出时其它协程和网络事件也有机会运行
+    # call 的含义与 TimerHeap.run_due 相同
+    def _run_ready(self, call=None):
+        ready = self.ready
+        for _ in range(len(ready)):
+            callback, args = ready.popleft()
+            if call is None:
+                callback(*args)
+            else:
+                call(callback, *args)
+
+    # 事件循环，没有任何被监听的文件描述符和定时器时，说明全部任务已结束，退出循环
+    def run(self):
+        while not self.stopped and self._alive():
+            self._run_once()
+        self.close()
+
+    # 运行事件循环直到 future 有结果，返回它的值，结果是异常时抛出
+    # 空闲的连接和域名解析器可能一直注册着，不能再以没有被监听的事件作为结束的标志
+    # future 还没有结果但已经没有可等待的事件时，说明有任务丢失了唤醒它的回调，抛出异常而不是一直卡住
+    def run_until_complete(self, future):
+        while not future.done:
+            if self.stopped:
+                raise RuntimeError('事件循环已停止')
+            if not self._alive():
+                raise RuntimeError('没有可等待的事件，任务永远不会完成')
+            self._run_once()
+        if future.exception is not None:
+            raise future.exception
+        return future.value
+
+    def close(self):
+        self.selector.close()
+
+
+# 直接使用 select.epoll 的事件循环，只能在 Linux 上使用，接口与 EventLoop 相同
+# DefaultSelector 每个就绪事件都要查一次字典、创建一个 SelectorKey 命名元组，
+# 并且只支持水平触发。这里回调函数存放在以文件描述符为下标的列表里，
+# 注册时加上 EPOLLET 使用边缘触发，每次 epoll_wait 最多取出 maxevents 个事件
+# 边缘触发只在状态变化时通知一次，回调函数必须每次都读到 EAGAIN 为止，
+# 爬虫的 readable 方法和 AsyncSocket.read 本来就是这样做的
+# epoll_ctl 修改监听的事件时内核会重新检查就绪状态，切换事件之后不会漏掉已经就绪的事件
+class EpollLoop(EventLoop):
+    def __init__(self, maxevents=MAX_EVENTS):
+        self.epoll = select.epoll()
+        self.maxevents = maxevents
+        self.callbacks = []     # 下标为文件描述符，没有注册的位置为 None
+        self.count = 0          # 已注册的文件描述符数
+        self.timers = TimerHeap()
+        self.ready = deque()
+        self.stopped = False
+        self.monitor = None
+
+    def register(self, fd, events, callback):
+        self.epoll.register(fd, _epoll_mask(events))
+        if fd >= len(self.callbacks):
+            self.callbacks.extend([None] * (fd + 1 - len(self.callbacks)))
+        self.callbacks[fd] = callback
+        self.count += 1
+
+    def modify(self, fd, events, callback):
+        self.epoll.modify(fd, _epoll_mask(events))
+        self.callbacks[fd] = callback
+
+    # 文件描述符已经关闭时 epoll 已自动移除了它，与 EpollSelector 一样忽略错误
+    # 没有注册或者已经注销过的文件描述符不计数，否则 count 变成负数，事件循环提前退出
+    def unregister(self, fd):
+        try:
+            self.epoll.unregister(fd)
+        except OSError:
+            pass
+        if self.registered(fd):
+            self.callbacks[fd] = None
+            self.count -= 1
+
+    def registered(self, fd):
+        return fd < len(self.callbacks) and self.callbacks[fd] is not None
+
+    # 返回 (文件描述符, 事件) 的列表，供 _run_once 和 LoopMonitor 使用
+    def select(self, timeout=None):
+        return self.epoll.poll(timeout, self.maxevents)
+
+    def _alive(self):
+        return bool(self.count or self.timers or self.ready)
+
+    # 同一批事件里前面的回调函数可能已经注销了后面的文件描述符，这时跳过
+    def _run_once(self):
+        callbacks = self.callbacks
+        for fd, _ in self.select(self._timeout()):
+            callback = callbacks[fd]
+            if callback is not None:
+                callback()
+        self.timers.run_due()
+        self._run_ready()
+
+    def _run_once_monitored(self):
+        monitor = self.monitor
+        callbacks = self.callbacks
+        for fd, _ in monitor.select_events(self, self._timeout()):
+            callback = callbacks[fd]
+            if callback is not None:
+                monitor.call(callback)
+        monitor.run_timers(self.timers)
+        self._run_ready(monitor.call)
+
+    def close(self):
+        self.epoll.close()
+
+
+# 把 selectors 的事件常量转换为 epoll 的事件位掩码，带上边缘触发标志
+def _epoll_mask(events):
+    mask = select.EPOLLET
+    if events & EVENT_READ:
+        mask |= select.EPOLLIN
+    if events & EVENT_WRITE:
+        mask |= select.EPOLLOUT
+    return mask
+
+
+# 根据配置创建事件循环，不支持 epoll 的系统上仍然使用 EventLoop
+def new_event_loop(config):
+    if config.loop == 'epoll' and hasattr(select, 'epoll'):
+        return EpollLoop()
+    return EventLoop()
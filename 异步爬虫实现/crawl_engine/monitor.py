@@ -0,0 +1,135 @@
+import time
+
+from .timing import Histogram
+
+
+# 事件循环的运行状况监控，默认关闭
+# 原来的 loop 函数和 Loop.run 方法看不出时间花在了哪里：是在 select 里等待网络，
+# 还是某个回调函数占着事件循环不放，让其它连接的数据都在内核里排队
+# 开启后事件循环换用带计时的方法，记录每轮 select 阻塞的时间、就绪的事件数、
+# 每个回调函数（greenlet 后端是每次切换到爬虫协程）运行的时间，以及定时器晚到期的时间，
+# 超过 slow 秒的回调函数打印出来，能找到对应的 URL 时一起打印
+# 关闭时事件循环的代码和原来完全一样，没有额外的开销
+
+MAX_DEPTH = 12      # 查找 URL 时最多经过的对象层数
+
+
+# 从回调函数所属的对象出发查找正在下载的 URL
+# 爬虫实例的 _url 属性就是 URL ；生成器协程和 async def 协程查看各层等待处的局部变量，
+# greenlet 协程查看暂停处的调用栈，Future 查看等待它的 Task
+# 协程在这次回调里结束的话栈帧已经没有了，这时查看 Task 的 item 属性
+# （调度器放入的任务）和 greenlet 的 fun 属性（Hub.spawn 传入的函数）
+# 只在回调函数运行过慢时调用，不影响正常的运行速度
+def find_url(obj, depth=0):
+    if obj is None or depth > MAX_DEPTH:
+        return None
+    url = getattr(obj, '_url', None)
+    if isinstance(url, str):
+        return url
+    # 生成器协程
+    frame = getattr(obj, 'gi_frame', None)
+    if frame is not None:
+        url = _frame_url(frame)
+        return url or find_url(obj.gi_yieldfrom, depth + 1)
+    # async def 协程，cr_await 是它正在等待的对象
+    frame = getattr(obj, 'cr_frame', None)
+    if frame is not None:
+        url = _frame_url(frame)
+        return url or find_url(obj.cr_await, depth + 1)
+    # greenlet 协程，gr_frame 是暂停处的栈帧，协程结束后为 None
+    frame = getattr(obj, 'gr_frame', None)
+    while frame is not None:
+        url = _frame_url(frame)
+        if url:
+            return url
+        frame = frame.f_back
+    for name in ('coro', '_waiter', 'item', 'fun'):
+        value = getattr(obj, name, None)
+        url = find_url(getattr(value, '__self__', value), depth + 1)
+        if url:
+            return url
+    for func in getattr(obj, '_step_func', ()):
+        url = find_url(getattr(func, '__self__', None), depth + 1)
+        if url:
+            return url
+    return None
+
+
+# 在栈帧的局部变量里找爬虫实例，比如 self 或者调度器里的 item
+def _frame_url(frame):
+    for value in frame.f_locals.values():
+        url = getattr(value, '_url', None)
+        if isinstance(url, str):
+            return url
+    return None
+
+
+class LoopMonitor:
+    # slow 为慢回调的阈值秒数
+    def __init__(self, slow=0.1):
+        self.slow = slow
+        self.iterations = 0         # 事件循环的轮数
+        self.select = Histogram()   # 每轮 select 阻塞的秒数
+        self.events = Histogram()   # 每轮就绪的事件数
+        self.callbacks = Histogram()    # 每个回调函数运行的秒数
+        self.lag = Histogram()      # 定时器比预定时间晚运行的秒数
+        self.slow_callbacks = 0
+
+    # 调用 select 并记录阻塞的时间和就绪的事件数
+    def select_events(self, selector, timeout):
+        start = time.monotonic()
+        events = selector.select(timeout)
+        self.select.add(time.monotonic() - start)
+        self.events.add(len(events))
+        self.iterations += 1
+        return events
+
+    # 运行回调函数并计时，超过阈值时打印
+    # 回调函数运行之后套接字等待的 Future 会被清空，所以先记下来，查找 URL 时使用
+    def call(self, callback, *args):
+        owner = getattr(callback, '__self__', None)
+        waiter = getattr(owner, '_waiter', None)
+        start = time.monotonic()
+        try:
+            return callback(*args)
+        finally:
+            elapsed = time.monotonic() - start
+            self.callbacks.add(elapsed)
+            if elapsed >= self.slow:
+                self._report(callback, elapsed,
+                             find_url(owner) or find_url(waiter))
+
+    # 运行到期的定时器，记录最早到期的那个晚了多久
+    def run_timers(self, timers):
+        lateness = timers.lateness()
+        if lateness is not None:
+            self.lag.add(lateness)
+        timers.run_due(self.call)
+
+    def _report(self, callback, elapsed, url):
+        self.slow_callbacks += 1
+        name = getattr(callback, '__qualname__', repr(callback))
+        print('慢回调 {:.1f} 毫秒: {}{}'.format(
+            elapsed * 1000, name, '' if url is None else ' URL: ' + url))
+
+    def status(self):
+        lines = ['事件循环 {} 轮，慢回调 {} 个（超过 {:.0f} 毫秒）'.format(
+            self.iterations, self.slow_callbacks, self.slow * 1000)]
+        for name, histogram, scale, unit in (
+                ('select 阻塞', self.select, 1000, '毫秒'),
+                ('就绪事件数', self.events, 1, '个'),
+                ('回调用时', self.callbacks, 1000, '毫秒'),
+                ('定时器延迟', self.lag, 1000, '毫秒')):
+            lines.append('{}：p50 {:.1f} p90 {:.1f} p99 {:.1f} 最大 {:.1f} {}'
+                         .format(name, histogram.percentile(50) * scale,
+                                 histogram.percentile(90) * scale,
+                                 histogram.percentile(99) * scale,
+                                 histogram.max * scale, unit))
+        return '\n'.join(lines)
+
+
+# 根据配置创建监控，没有设置慢回调阈值时返回 None
+def open_monitor(config):
+    if config.slow_callback is None:
+        return None
+    return LoopMonitor(config.slow_callback / 1000)
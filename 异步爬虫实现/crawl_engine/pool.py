@@ -0,0 +1,159 @@
+import time
+import types
+import socket
+from collections import deque
+
+from .coroutine import AsyncSocket, Future, resolve
+
+
+# 检查空闲连接是否还能使用
+# 服务器关闭连接后套接字可读，recv 返回空字节串
+# 空闲连接上不应该有任何数据，收到数据或者出错都说明连接不能再用
+# TLS 套接字的 recv 不支持 MSG_PEEK ，这里直接查看底层的套接字
+def is_alive(sock):
+    try:
+        socket.socket.recv(sock, 1, socket.MSG_PEEK)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+# 按 (协议, 主机, 端口) 保存空闲的 keep-alive 连接，供生成器协程复用
+# 原来每个 URL 都新建一个套接字，每张图片都要经历一次 TCP 握手
+# https 的连接在 TCP 连接建立后进行 TLS 握手，复用连接时两次握手都省掉了
+class ConnectionPool:
+    # max_per_host 为每个主机最多同时打开的连接数，idle_timeout 为空闲连接的最长保留秒数
+    # connect_timeout 为新建连接的超时秒数，包括 TLS 握手
+    # tls 为 tls.TLSContext 实例，用于 https 的连接
+    # timings 为 timing.Timings 实例，新建连接时记录 dns 和 connect 阶段的耗时
+    def __init__(self, loop, resolver, max_per_host=20, idle_timeout=30,
+                 connect_timeout=None, tls=None, timings=None):
+        self.loop = loop
+        self.resolver = resolver
+        self.tls = tls
+        self.timings = timings
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._idle = {}         # 空闲连接，值为 (AsyncSocket 实例, 放回时间) 的队列
+        self._count = {}        # 已打开的连接数，包括空闲的和正在使用的
+        self._waiters = {}      # 等待连接的协程的 Future 实例队列
+        self.created = 0        # 新建连接的次数
+        self.reused = 0         # 复用连接的次数
+
+    # 协程函数，返回一个已连接的 AsyncSocket 实例
+    # 有空闲连接时直接使用，连接数没达到上限时新建连接，否则等待其它协程放回连接
+    @types.coroutine
+    def acquire(self, address):
+        while True:
+            sock = self._pop_idle(address)
+            if sock is not None:
+                return sock
+            if self._count.get(address, 0) < self.max_per_host:
+                return (yield from self._connect(address))
+            f = Future()
+            self._waiters.setdefault(address, deque()).append(f)
+            # 其它协程放回连接时 value 为该连接，关闭连接时 value 为 None
+            sock = yield from f
+            if sock is not None:
+                self.reused += 1
+                return sock
+
+    # 响应接收完毕且服务器允许保持连接时，调用此方法放回连接
+    # address 为 common.origin 的返回值
+    def release(self, address, sock):
+        self._save_session(address, sock)
+        sock.reused = True
+        waiter = self._pop_waiter(address)
+        if waiter is not None:
+            waiter.set_value(sock)
+            return
+        # 空闲连接不监听事件，否则事件循环会因为它一直运行下去
+        sock.pause()
+        idle = self._idle.setdefault(address, deque())
+        idle.append((sock, time.monotonic()))
+        self._evict(address, idle)
+
+    # 连接出错或者服务器要求关闭连接时，调用此方法关闭连接
+    def discard(self, address, sock):
+        self._save_session(address, sock)
+        sock.close()
+        self._forget(address)
+
+    # 爬取结束后关闭全部空闲连接
+    def close(self):
+        for address, idle in self._idle.items():
+            while idle:
+                sock, _ = idle.popleft()
+                sock.close()
+                self._count[address] -= 1
+        self._idle.clear()
+
+    @types.coroutine
+    def _connect(self, address):
+        self._count[address] = self._count.get(address, 0) + 1
+        scheme, host, port = address
+        sock = AsyncSocket(self.loop)
+        try:
+            start = time.monotonic()
+            ip_address = yield from resolve(self.resolver, host, port)
+            resolved = time.monotonic()
+            yield from sock.connect(ip_address, self.connect_timeout)
+            if scheme == 'https':
+                yield from sock.start_tls(self.tls, host, port,
+                                          self.connect_timeout)
+        except BaseException:
+            # 任务在连接或握手期间被取消时抛出的 CancelledError 不是 OSError ，
+            # 同样要关闭套接字、归还名额
+            self.discard(address, sock)
+            raise
+        self.created += 1
+        if self.timings is not None:
+            self.timings.add('dns', resolved - start)
+            self.timings.add('connect', time.monotonic() - resolved)
+        return sock
+
+    # 收到响应之后保存 TLS 会话，同一主机的新连接可以复用
+    def _save_session(self, address, sock):
+        scheme, host, port = address
+        if scheme == 'https':
+            self.tls.save(sock.sock, host, port)
+
+    # 连接数减一，空出的名额交给一个等待中的协程
+    def _forget(self, address):
+        self._count[address] -= 1
+        waiter = self._pop_waiter(address)
+        if waiter is not None:
+            waiter.set_value(None)
+
+    # 取出一个还在等待的 Future ，等待的任务被取消时它已经有结果了，跳过
+    def _pop_waiter(self, address):
+        waiters = self._waiters.get(address)
+        while waiters:
+            f = waiters.popleft()
+            if not f.done:
+                return f
+        return None
+
+    # 优先使用最近放回的连接，它被服务器关闭的可能性最小
+    def _pop_idle(self, address):
+        idle = self._idle.get(address)
+        while idle:
+            sock, since = idle.pop()
+            if time.monotonic() - since < self.idle_timeout and \
+                    is_alive(sock.sock):
+                self.reused += 1
+                return sock
+            sock.close()
+            self._count[address] -= 1
+        return None
+
+    # 队列左边是放得最久的连接，关闭其中超过 idle_timeout 的
+    def _evict(self, address, idle):
+        deadline = time.monotonic() - self.idle_timeout
+        while idle and idle[0][1] < deadline:
+            sock, _ = idle.popleft()
+            sock.close()
+            self._count[address] -= 1
@@ -0,0 +1,108 @@
+import time
+
+from .common import Download, request_data
+from .http_parser import RangeError
+
+
+# 断点续传和分段下载
+# 原来连接中途断开时只能从头重新下载，大文件也只能用一个连接下载
+# 服务器返回 Accept-Ranges: bytes 和 Content-Length 时，记录每一段已经写到的位置，
+# 失败后用 Range 请求只下载剩下的部分；超过 range_threshold MB 的文件
+# 预先分配好整个文件，分成 range_parts 段，每段用一个连接下载并写入各自的位置
+
+
+# 把 [start, end] 分成 n 段，返回 [起始位置, 结束位置] 的列表，两端都包含在内
+def split_range(start, end, n):
+    size = end - start + 1
+    n = max(1, min(n, size))
+    bounds = [start + size * i // n for i in range(n + 1)]
+    return [[bounds[i], bounds[i + 1] - 1] for i in range(n)]
+
+
+# 解析 Content-Range 报头，返回起始位置，格式为 bytes 起始位置-结束位置/总长度
+def content_range_start(value):
+    unit, _, spec = value.partition(' ')
+    try:
+        return int(spec.split('-', 1)[0]) if unit == 'bytes' else None
+    except ValueError:
+        return None
+
+
+# 响应体是否压缩过，压缩过的数据的位置和文件里的位置对不上
+def encoded(parser):
+    encoding = parser.headers.get('content-encoding', '').strip().lower()
+    return encoding not in ('', 'identity')
+
+
+# 支持范围请求的 Download
+# part 为 None 时请求整个文件，服务器支持范围请求的话在报头解析完毕后设置 part ；
+# 否则只请求 part 指定的范围。part 是 [起始位置, 结束位置] 的列表，
+# 每写入一段数据起始位置就后移，失败后剩下的范围就是还需要下载的部分
+class RangeDownload(Download):
+    def __init__(self, config, url, writer, cache=None, stats=None,
+                 timings=None, part=None, validator=None):
+        super().__init__(config, url, writer,
+                         cache if part is None else None, stats, timings)
+        self.config = config
+        self.part = part
+        # 文件的 ETag 或 Last-Modified ，放在 If-Range 里，文件变化时服务器不会按范围返回
+        self.validator = validator
+        self.rest = None    # 分段下载时其它各段的范围，由调用方负责下载
+
+    @property
+    def done(self):
+        return self.parser.done or (self.part is not None and
+                                    self.part[0] > self.part[1])
+
+    # 分段下载时第一段收完就结束，响应还没有接收完，连接不能继续使用
+    @property
+    def keep_alive(self):
+        return self.parser.done and self.parser.keep_alive
+
+    def request(self, keep_alive=False):
+        if self.part is None:
+            return super().request(keep_alive)
+        self.sent = time.monotonic()
+        # 范围是按未压缩的数据计算的，不能让服务器压缩
+        headers = {'Range': 'bytes={}-{}'.format(*self.part),
+                   'Accept-Encoding': 'identity'}
+        if self.validator:
+            headers['If-Range'] = self.validator
+        return request_data(self.url, keep_alive, headers)
+
+    def on_headers(self, parser):
+        self.first_byte = time.monotonic()
+        if self.part is not None:
+            if parser.status != 206 or encoded(parser) or content_range_start(
+                    parser.headers.get('content-range', '')) != self.part[0]:
+                raise RangeError('服务器没有按请求的范围返回数据: HTTP {}'.format(
+                    parser.status))
+            self._open(self.part[0])
+            return
+        length = parser.headers.get('content-length', '')
+        # 使用内容寻址存储时数据必须按顺序写入，不能续传
+        if parser.status != 200 or self.config.store or encoded(parser) \
+                or not length.isdigit() \
+                or parser.headers.get('accept-ranges', '').lower() != 'bytes':
+            return super().on_headers(parser)
+        length = int(length)
+        self.part = [0, length - 1]
+        self.validator = parser.headers.get('etag') or \
+            parser.headers.get('last-modified')
+        if length < self.config.range_threshold * 1048576 or \
+                self.config.range_parts < 2:
+            return super().on_headers(parser)
+        # 响应体的哈希值不完整，不能记录到缓存里
+        self.cache = None
+        self.hash = None
+        self._open(0, length)
+        parts = split_range(0, length - 1, self.config.range_parts)
+        self.part[1] = parts[0][1]
+        self.rest = parts[1:]
+
+    # 超出范围的数据属于其它段，丢弃
+    def write(self, chunk):
+        if self.part is not None:
+            chunk = chunk[:self.part[1] - self.part[0] + 1]
+            self.part[0] += len(chunk)
+        super().write(chunk)
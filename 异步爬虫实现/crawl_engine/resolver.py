@@ -0,0 +1,161 @@
+import time
+import socket
+import threading
+from collections import deque
+from selectors import EVENT_READ
+from concurrent.futures import ThreadPoolExecutor
+
+
+# 域名解析层，所有后端共用
+# 非阻塞套接字的 connect 方法传入域名时，仍然会在事件循环所在的线程里
+# 阻塞调用 getaddrinfo ，每个 URL 都解析一次，一万个 URL 就卡住事件循环一万次
+# 这里把解析结果缓存 ttl 秒，同一域名的并发查询合并为一次
+# 和原来的爬虫一样只使用 IPv4 地址
+
+
+# 带过期时间的解析结果缓存，键为 (主机, 端口) ，值为 (地址元组, 过期时间)
+class DNSCache:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._entries = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def set(self, key, address):
+        self._entries[key] = (address, time.monotonic() + self.ttl)
+
+
+# 在当前线程里调用 getaddrinfo ，返回 connect 方法所需的地址元组
+# 主机名的某一段超过 63 个字符时 IDNA 编码失败，getaddrinfo 抛出的是 UnicodeError ，
+# 这里转换为 socket.gaierror ，各后端按 OSError 统一报告为解析失败
+def getaddrinfo(host, port):
+    try:
+        infos = socket.getaddrinfo(host, port, socket.AF_INET,
+                                   socket.SOCK_STREAM)
+    except UnicodeError as e:
+        raise socket.gaierror('无效的主机名 {}: {}'.format(host, e)) from e
+    return infos[0][4]
+
+
+# 回调式解析器的基类，负责缓存和合并查询，在事件循环所在的线程里使用
+# 子类实现 _lookup 方法发起查询，查询结束后在事件循环线程里调用 _finish 方法
+class Resolver:
+    def __init__(self, ttl=300):
+        self.cache = DNSCache(ttl)
+        self._pending = {}      # 正在查询的键，值为等待结果的回调函数列表
+        self.lookups = 0        # 实际查询的次数
+
+    # 返回缓存中未过期的地址，没有时返回 None
+    def cached(self, host, port):
+        return self.cache.get((host, port))
+
+    # 解析域名，结束后调用 callback(address, error)
+    # 缓存命中时立即调用回调函数
+    def resolve(self, host, port, callback):
+        key = (host, port)
+        address = self.cache.get(key)
+        if address is not None:
+            callback(address, None)
+            return
+        callbacks = self._pending.get(key)
+        if callbacks is not None:
+            callbacks.append(callback)
+            return
+        self._pending[key] = [callback]
+        self.lookups += 1
+        self._lookup(key)
+
+    def _lookup(self, key):
+        raise NotImplementedError
+
+    def _finish(self, key, address, error):
+        if error is None:
+            self.cache.set(key, address)
+        for callback in self._pending.pop(key):
+            callback(address, error)
+
+
+# 在线程池里查询，通过 socketpair 唤醒事件循环，在事件循环线程里调用回调函数
+# loop 须提供 register(fd, events, callback) 和 unregister(fd) 方法
+# 只在有查询进行时注册监听，否则事件循环会因为这个文件描述符一直运行下去
+class ThreadedResolver(Resolver):
+    def __init__(self, loop, ttl=300, workers=4):
+        super().__init__(ttl)
+        self.loop = loop
+        self._executor = ThreadPoolExecutor(workers)
+        self._results = deque()     # 查询线程放入结果，事件循环线程取出
+        self._rsock, self._wsock = socket.socketpair()
+        self._rsock.setblocking(False)
+        self._registered = False
+
+    def _lookup(self, key):
+        if not self._registered:
+            self.loop.register(self._rsock.fileno(), EVENT_READ, self._dispatch)
+            self._registered = True
+        self._executor.submit(self._run_lookup, key)
+
+    # 在查询线程里运行
+    # 任何异常都要放入结果，否则等待的回调函数永远不会被调用，事件循环也不会结束
+    def _run_lookup(self, key):
+        try:
+            result = (key, getaddrinfo(*key), None)
+        except Exception as e:
+            result = (key, None, e)
+        self._results.append(result)
+        self._wsock.send(b'\0')
+
+    # 唤醒事件循环的数据可读时，在事件循环线程里运行
+    def _dispatch(self):
+        try:
+            self._rsock.recv(4096)
+        except BlockingIOError:
+            pass
+        while self._results:
+            self._finish(*self._results.popleft())
+        if not self._pending and self._registered:
+            self.loop.unregister(self._rsock.fileno())
+            self._registered = False
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._rsock.close()
+        self._wsock.close()
+
+
+# 阻塞式解析器，供 blocking 和 threads 后端使用，可以在多个线程里同时调用
+# 同一域名的查询正在进行时，其它线程等待它的结果
+class BlockingResolver:
+    def __init__(self, ttl=300):
+        self.cache = DNSCache(ttl)
+        self._lock = threading.Lock()
+        self._pending = {}      # 正在查询的键，值为 threading.Event 实例
+        self.lookups = 0
+
+    def resolve(self, host, port):
+        key = (host, port)
+        while True:
+            with self._lock:
+                address = self.cache.get(key)
+                if address is not None:
+                    return address
+                event = self._pending.get(key)
+                if event is None:
+                    event = self._pending[key] = threading.Event()
+                    self.lookups += 1
+                    break
+            # 其它线程正在查询，等它结束后重新检查缓存
+            # 查询失败时缓存里没有结果，循环回去由当前线程重新查询
+            event.wait()
+        try:
+            address = getaddrinfo(host, port)
+            with self._lock:
+                self.cache.set(key, address)
+            return address
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
@@ -0,0 +1,31 @@
+import ssl
+import random
+
+from .http_parser import HTTPError, ParseError, RangeError
+
+
+# 指数退避加随机抖动的重试策略
+# 第 n 次重试之前等待 0 到 min(cap, base * 2 ** n) 之间的随机秒数
+# 随机抖动避免大量失败的请求在同一时刻重试
+class Backoff:
+    def __init__(self, retries=2, base=0.5, cap=30):
+        self.retries = retries      # 最多重试的次数
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+# 判断下载失败后是否值得重试
+# 网络错误、响应不完整、服务器错误和请求过多可以重试，404 之类的错误重试也没用
+# 证书验证失败重试也不会成功，范围请求出错时重新下载整个文件
+def retryable(error, download):
+    if isinstance(error, ssl.SSLCertVerificationError):
+        return False
+    if isinstance(error, (OSError, ParseError, RangeError)):
+        return True
+    if isinstance(error, HTTPError):
+        status = download.parser.status
+        return status is None or status >= 500 or status == 429
+    return False
@@ -0,0 +1,114 @@
+import types
+from collections import deque
+
+from .coroutine import Future, Task
+
+
+# 限制并发数的调度器，建立在生成器协程框架的 Task 之上
+# 原来的 main 函数为每个 URL 立即创建一个 Task ，十万个 URL 就是十万个套接字
+# 这里先把任务放进队列，同时运行的协程数不超过 concurrency ，
+# 同一主机的不超过 per_host ，一个协程结束后立即从队列里取下一个任务
+# 任务可以是 URL 字符串，也可以是爬虫实例，由 make_coro 和 host_of 解释
+# 调度器记录尚未结束的任务数，join 方法返回的 Future 在全部任务结束后得到结果，
+# 运行期间随时可以加入新任务
+class Scheduler:
+    # make_coro 是一个函数，参数为任务，返回值为执行该任务的协程
+    # host_of 是一个函数，参数为任务，返回值为该任务的主机标识
+    # 每结束 report_every 个协程打印一次队列深度和进行中的数量，0 表示不打印
+    def __init__(self, loop, make_coro, host_of, concurrency=100, per_host=20,
+                 report_every=0):
+        self.loop = loop
+        self.make_coro = make_coro
+        self.host_of = host_of
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.report_every = report_every
+        self.queue = deque()        # 等待运行的任务
+        self.blocked = {}           # 因所在主机的协程数已满而等待的任务
+        self.blocked_count = 0
+        self.in_flight = 0          # 正在运行的协程数
+        self.host_in_flight = {}    # 每个主机正在运行的协程数
+        self.finished = 0           # 已结束的协程数
+        self.delayed = 0            # 通过 add_later 方法加入、还没到时间的任务数
+        self.errors = []            # 协程抛出的异常，元素为 (任务, 异常对象)
+        self._joiners = []          # join 方法返回的 Future 实例
+
+    # 队列深度，包括因主机限制而等待的任务
+    @property
+    def queued(self):
+        return len(self.queue) + self.blocked_count
+
+    # 尚未结束的任务数
+    @property
+    def outstanding(self):
+        return self.queued + self.in_flight + self.delayed
+
+    def status(self):
+        return '队列中 {} 个，进行中 {} 个，已结束 {} 个'.format(
+            self.queued, self.in_flight, self.finished)
+
+    def add(self, item):
+        self.queue.append(item)
+        self._fill()
+
+    # delay 秒之后加入任务，比如等待重试的任务，等待期间不占用并发的名额
+    def add_later(self, delay, item):
+        self.delayed += 1
+        self.loop.call_later(delay, self._add_delayed, item)
+
+    def _add_delayed(self, item):
+        self.delayed -= 1
+        self.add(item)
+
+    # 返回一个 Future 实例，全部任务结束后它的值为 errors 列表
+    # 配合 EventLoop.run_until_complete 使用
+    def join(self):
+        f = Future()
+        self._joiners.append(f)
+        self._check_done()
+        return f
+
+    def _check_done(self):
+        if self.outstanding or not self._joiners:
+            return
+        joiners, self._joiners = self._joiners, []
+        for f in joiners:
+            f.set_value(self.errors)
+
+    # 在并发数允许的范围内从队列里取出任务并启动协程
+    # Task 在下一轮事件循环里才开始运行，这里不会被协程结束时的调用重入
+    def _fill(self):
+        while self.in_flight < self.concurrency and self.queue:
+            item = self.queue.popleft()
+            host = self.host_of(item)
+            if self.host_in_flight.get(host, 0) >= self.per_host:
+                self.blocked.setdefault(host, deque()).append(item)
+                self.blocked_count += 1
+                continue
+            self.in_flight += 1
+            self.host_in_flight[host] = self.host_in_flight.get(host, 0) + 1
+            # 记下任务，事件循环监控据此找到慢回调对应的 URL
+            task = Task(self._run(item, host), self.loop)
+            task.item = item
+
+    # 协程抛出的异常记录下来，不影响其它任务
+    # make_coro 返回的可以是 async def 定义的协程，所以本身也要标记为协程
+    @types.coroutine
+    def _run(self, item, host):
+        try:
+            yield from self.make_coro(item)
+        except Exception as e:
+            self.errors.append((item, e))
+        finally:
+            self.in_flight -= 1
+            self.host_in_flight[host] -= 1
+            self.finished += 1
+            if self.report_every and not self.finished % self.report_every:
+                print(self.status())
+            # 该主机有等待的任务时，放到队列最前面优先运行
+            blocked = self.blocked.get(host)
+            if blocked:
+                self.queue.appendleft(blocked.popleft())
+                self.blocked_count -= 1
+            self._fill()
+            self._check_done()
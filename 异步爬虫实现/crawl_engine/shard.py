@@ -0,0 +1,139 @@
+import time
+import zlib
+import multiprocessing
+from collections import Counter
+from urllib.parse import urlparse
+from multiprocessing.connection import wait
+
+from .backends import get_backend
+from .common import Results
+
+
+# 多进程分片爬取
+# 单进程的事件循环在 URL 很多时会被解析和记账占满一个 CPU 核心
+# 这里按主机的哈希值把 URL 分成 N 份，每个子进程用选定的后端爬取一份，
+# 同一主机的 URL 在同一个进程里，连接池和管线化仍然有效
+# 子进程通过管道把每个 URL 的结果发给父进程，子进程异常退出时，
+# 父进程把它还没有结果的 URL 交给一个新的子进程重新爬取
+
+MAX_RESTARTS = 3        # 每个分片最多重启的次数
+
+
+# 根据主机名计算 URL 属于哪个分片，crc32 在不同进程里的结果相同
+def shard_of(url, n):
+    host = urlparse(url).hostname or ''
+    return zlib.crc32(host.encode()) % n
+
+
+def partition(urls, n):
+    shards = [[] for _ in range(n)]
+    for url in urls:
+        shards[shard_of(url, n)].append(url)
+    return shards
+
+
+# 子进程的入口函数，结果和统计信息都通过 conn 发送
+def work(backend_name, urls, config, conn):
+    def on_finish(url, error):
+        conn.send(('result', url, None if error is None else str(error)))
+
+    # 写文件失败时已经报告成功的 URL 改记为失败
+    def on_revoke(url, error):
+        conn.send(('revoke', url, str(error)))
+
+    results = Results(on_finish, on_revoke)
+    start = time.time()
+    get_backend(backend_name).run(urls, config, results)
+    conn.send(('stats', time.time() - start, results.timings.histograms))
+    conn.close()
+
+
+# 父进程里记录一个分片的状态
+class Shard:
+    def __init__(self, index, urls):
+        self.index = index
+        self.pending = Counter(urls)    # 还没有结果的 URL ，同一 URL 可能出现多次
+        self.restarts = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.elapsed = 0
+        self.process = None
+        self.conn = None
+
+    def start(self, backend_name, config):
+        self.conn, child_conn = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(
+            target=work, args=(backend_name, list(self.pending.elements()),
+                               config, child_conn))
+        self.process.start()
+        # 父进程关闭写端，子进程退出后读端才能读到 EOF
+        child_conn.close()
+
+    # 读取管道里已经到达的全部消息，返回 False 表示子进程已关闭管道
+    def drain(self, results):
+        while self.conn.poll():
+            try:
+                message = self.conn.recv()
+            except EOFError:
+                return False
+            if message[0] == 'result':
+                _, url, error = message
+                self.pending[url] -= 1
+                if not self.pending[url]:
+                    del self.pending[url]
+                if error is None:
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+                results.add(url, error)
+            elif message[0] == 'revoke':
+                _, url, error = message
+                self.succeeded -= 1
+                self.failed += 1
+                results.revoke(url, error)
+            else:
+                self.elapsed += message[1]
+                results.timings.merge(message[2])
+        return True
+
+    def status(self):
+        return '进程 {} ：成功 {} 个，失败 {} 个，耗时 {:.3f}s，重启 {} 次'.format(
+            self.index, self.succeeded, self.failed, self.elapsed,
+            self.restarts)
+
+
+def run(backend_name, urls, config, results):
+    shards = [Shard(i, part) for i, part in
+              enumerate(partition(urls, config.processes))]
+    running = [shard for shard in shards if shard.pending]
+    for shard in running:
+        shard.start(backend_name, config)
+    while running:
+        ready = wait([shard.conn for shard in running] +
+                     [shard.process.sentinel for shard in running])
+        for shard in running[:]:
+            if shard.conn in ready:
+                shard.drain(results)
+            if shard.process.sentinel not in ready:
+                continue
+            # 子进程已退出，管道里剩下的消息都已到达
+            shard.drain(results)
+            shard.conn.close()
+            shard.process.join()
+            running.remove(shard)
+            if not shard.pending:
+                continue
+            print('进程 {} 异常退出，退出码 {} ，还有 {} 个 URL 没有结果'.format(
+                shard.index, shard.process.exitcode,
+                sum(shard.pending.values())))
+            if shard.restarts < MAX_RESTARTS:
+                shard.restarts += 1
+                shard.start(backend_name, config)
+                running.append(shard)
+            else:
+                for url in shard.pending.elements():
+                    results.failure(url, '子进程多次异常退出')
+                    shard.failed += 1
+    for shard in shards:
+        if shard.process is not None:
+            print(shard.status())
@@ -0,0 +1,124 @@
+import os
+import hashlib
+import tempfile
+import threading
+
+
+# 内容寻址的图片存储
+# 原来每个 URL 按文件名各存一份，同一张图片换个名字就要多存一份
+# 这里一边接收一边计算响应体的 SHA-256 ，每种内容只在 .blobs 目录里保存一份，
+# 按哈希值的前两级分目录存放，图片的文件名（原来 pic/ 下的路径）是指向它的硬链接
+# 重复的内容先写入临时文件，算出哈希值后发现已有相同的内容就删除，
+# 文件在写回磁盘之前就被删除，通常不会产生实际的磁盘写入
+
+BLOB_DIR = '.blobs'
+
+
+# 先删除旧文件再创建新文件，参数和内置的 open 函数相同
+# 旧文件可能是内容寻址存储里的硬链接，直接截断会改掉所有同内容的图片
+def open_new(path, mode='wb'):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    return open(path, mode)
+
+
+# BlobStore.open 方法的返回值，写入的数据先存到临时文件里
+class StoreFile:
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        self.hash = hashlib.sha256()
+        self.size = 0
+        fd, self.temp = tempfile.mkstemp(dir=store.temp_dir)
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    # 写线程调用 fsync 时用到
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    # 写完后把临时文件放进存储，并让文件名指向它
+    # done 和 writer.AsyncFile.close 的参数相同，这里不分段也不续传，所以不用
+    def close(self, done=True):
+        self.file.close()
+        self.store.commit(self)
+
+    # 下载失败时删除临时文件，文件名原来指向的内容保持不变
+    def abort(self):
+        self.file.close()
+        os.remove(self.temp)
+
+
+class BlobStore:
+    # root 为图片保存目录，内容保存在其中的 .blobs 目录里
+    def __init__(self, root):
+        self.root = root
+        self.blob_dir = os.path.join(root, BLOB_DIR)
+        self.temp_dir = os.path.join(self.blob_dir, 'tmp')
+        os.makedirs(self.temp_dir, exist_ok=True)
+        # 多个写线程同时调用 commit 方法
+        self._lock = threading.Lock()
+        self.files = 0          # 保存的文件数
+        self.blobs = 0          # 其中内容第一次出现的文件数
+        self.bytes_written = 0  # 新内容的字节数
+        self.bytes_saved = 0    # 因内容重复没有保存的字节数
+
+    # 参数和内置的 open 函数相同，可以作为 writer.DiskWriter 的 opener 参数
+    # 也可以代替 DiskWriter 传给 common.Download ，url 和 DiskWriter.open 的参数相同，不用
+    def open(self, path, mode='wb', url=None):
+        return StoreFile(self, path)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest[2:4], digest)
+
+    def commit(self, f):
+        digest = f.hash.hexdigest()
+        blob = self.blob_path(digest)
+        # 两个线程同时保存相同的内容时，检查和重命名不加锁会都算作新内容
+        with self._lock:
+            new = not os.path.exists(blob)
+            if new:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(f.temp, blob)
+        if not new:
+            os.remove(f.temp)
+        # 先在临时文件名上建立硬链接再重命名，替换旧文件的过程是原子的
+        # 文件名已经指向这份内容时 rename 什么都不做，临时的硬链接会留下来，所以跳过
+        if not self._linked(blob, f.path):
+            os.link(blob, f.temp)
+            os.replace(f.temp, f.path)
+        with self._lock:
+            self.files += 1
+            if new:
+                self.blobs += 1
+                self.bytes_written += f.size
+            else:
+                self.bytes_saved += f.size
+
+    def _linked(self, blob, path):
+        try:
+            return os.path.samefile(blob, path)
+        except FileNotFoundError:
+            return False
+
+    def status(self):
+        return ('保存文件 {} 个，不同内容 {} 个，写入 {:.1f} MB ，'
+                '去重节省 {:.1f} MB').format(
+            self.files, self.blobs, self.bytes_written / 1048576,
+            self.bytes_saved / 1048576)
+
+
+# 根据配置打开存储，不使用内容寻址存储时返回 None
+def open_store(config):
+    if not config.store:
+        return None
+    return BlobStore(config.out_dir)
@@ -0,0 +1,112 @@
+import time
+import heapq
+
+
+# 定时器，由 TimerHeap.call_later 方法创建
+class Timer:
+    def __init__(self, heap, when, callback, args):
+        self.heap = heap
+        self.when = when            # 到期的时间点，time.monotonic 的值
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    # heapq 模块通过小于号比较定时器，到期时间早的排在前面
+    def __lt__(self, other):
+        return self.when < other.when
+
+    # 取消定时器，定时器暂时留在堆里，到期或堆重建时再丢弃
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self.heap._cancelled += 1
+
+
+# 基于堆的定时器集合，事件循环用它计算 select 的超时时间并运行到期的回调函数
+# 原来的事件循环调用 select 时没有超时时间，一个不响应的服务器会让整个爬虫一直卡住
+class TimerHeap:
+    def __init__(self):
+        self._heap = []
+        self._cancelled = 0     # 堆里已取消的定时器数量
+
+    # 有效定时器的数量，事件循环据此判断是否还有任务
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    # delay 秒之后调用 callback(*args) ，返回值为 Timer 实例，可以用来取消
+    def call_later(self, delay, callback, *args):
+        timer = Timer(self, time.monotonic() + delay, callback, args)
+        heapq.heappush(self._heap, timer)
+        return timer
+
+    # 距离最近的定时器到期还有多少秒，没有定时器时返回 None
+    def timeout(self):
+        heap = self._heap
+        while heap and heap[0].cancelled:
+            heapq.heappop(heap)
+            self._cancelled -= 1
+        if not heap:
+            return None
+        return max(0, heap[0].when - time.monotonic())
+
+    # 最早到期的定时器已经晚了多少秒，还没有定时器到期时返回 None
+    # 堆顶可能是已取消的定时器，这里不区分，只用于统计
+    def lateness(self):
+        if not self._heap:
+            return None
+        late = time.monotonic() - self._heap[0].when
+        return late if late >= 0 else None
+
+    # 运行全部到期的定时器的回调函数
+    # call 为 None 时直接调用，否则通过 call(回调函数, *参数) 调用，供 monitor 模块计时
+    def run_due(self, call=None):
+        heap = self._heap
+        now = time.monotonic()
+        while heap and heap[0].when <= now:
+            timer = heapq.heappop(heap)
+            if timer.cancelled:
+                self._cancelled -= 1
+                continue
+            # 标记为已取消，之后再调用 cancel 方法不会影响计数
+            timer.cancelled = True
+            if call is None:
+                timer.callback(*timer.args)
+            else:
+                call(timer.callback, *timer.args)
+        # 已取消的定时器太多时重建堆，避免堆无限增长
+        if self._cancelled > 512 and self._cancelled * 2 > len(heap):
+            self._heap = [timer for timer in heap if not timer.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+
+
+# 空闲超时，超过 timeout 秒没有调用 touch 方法时调用 callback
+# 每收到一段数据都取消再新建定时器的话，堆里会堆积大量已取消的定时器
+# 这里只保留一个定时器，到期时检查最后一次活动的时间，没超时就按剩余时间重新定时
+class IdleTimeout:
+    def __init__(self, loop, timeout, callback):
+        self.loop = loop
+        self.timeout = timeout
+        self.callback = callback
+        self.last = time.monotonic()
+        self.timer = loop.call_later(timeout, self._check)
+
+    def touch(self):
+        self.last = time.monotonic()
+
+    # 更换超时秒数并重新计时，比如连接成功后从连接超时换成读取超时
+    def reset(self, timeout):
+        self.timer.cancel()
+        self.timeout = timeout
+        self.touch()
+        self.timer = self.loop.call_later(timeout, self._check)
+
+    def cancel(self):
+        self.timer.cancel()
+
+    def _check(self):
+        remaining = self.last + self.timeout - time.monotonic()
+        if remaining <= 0:
+            self.callback()
+        else:
+            self.timer = self.loop.call_later(remaining, self._check)
@@ -0,0 +1,113 @@
+import json
+import math
+import threading
+
+
+# 分阶段计时
+# 原来的爬虫每个 URL 只打印一次总耗时，看不出时间花在了哪里
+# 这里把每次下载分成几个阶段分别计时，结果放进内存里的直方图，
+# 爬取结束后报告各阶段的 p50 / p90 / p99 ，并可以保存为 JSON 文件
+# 各阶段的含义：
+#   queue       URL 交给后端之后等待开始下载的时间，重试时从退避结束算起
+#   dns         新建连接时的域名解析，缓存命中时接近 0
+#   connect     新建连接时的 TCP 连接，https 的 URL 包括 TLS 握手
+#   ttfb        发出请求到收到完整的响应报头
+#   transfer    收到报头到响应体接收完毕
+#   write       打开、写入和关闭文件用的时间，使用写线程时是放进队列的时间，
+#               队列满了要等待时也算在里面
+#   total       发出请求到响应体接收完毕，即一次请求的延迟
+# dns 和 connect 只在新建连接时记录，其余各阶段每次成功的下载记录一次
+
+PHASES = ('queue', 'dns', 'connect', 'ttfb', 'transfer', 'write', 'total')
+
+MIN_VALUE = 1e-6        # 小于 1 微秒的值都放进第一个桶
+GROWTH = 1.05           # 相邻两个桶上界的比值，报告的分位数最多偏大 5%
+LOG_GROWTH = math.log(GROWTH)
+
+
+# 对数分桶的直方图，内存占用和样本数无关，一百万个样本也只有几百个桶
+class Histogram:
+    def __init__(self):
+        self.buckets = {}   # 桶序号 -> 样本数
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        if value < MIN_VALUE:
+            index = 0
+        else:
+            index = int(math.log(value / MIN_VALUE) / LOG_GROWTH) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    # 返回第 q 百分位数所在桶的上界，不超过最大值
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * q / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(MIN_VALUE * GROWTH ** index, self.max)
+        return self.max
+
+    # 单位为秒，buckets 为 [桶的上界, 样本数] 的列表，按上界从小到大排列
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': [[MIN_VALUE * GROWTH ** index, self.buckets[index]]
+                        for index in sorted(self.buckets)],
+        }
+
+
+# 各阶段的直方图，Results 持有一个实例，所有后端共用
+# threads 后端会在多个线程里同时调用
+class Timings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {phase: Histogram() for phase in PHASES}
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.histograms[phase].add(seconds)
+
+    # 合并子进程发来的 histograms 字典
+    def merge(self, histograms):
+        with self._lock:
+            for phase, histogram in histograms.items():
+                self.histograms[phase].merge(histogram)
+
+    def report(self):
+        with self._lock:
+            return {phase: self.histograms[phase].to_dict()
+                    for phase in PHASES}
+
+    def status(self):
+        # 汉字占两列宽，表头按显示宽度手工对齐，单位为毫秒
+        lines = ['阶段        次数      p50      p90      p99     最大  （毫秒）']
+        for phase, item in self.report().items():
+            lines.append('{:<10}{:>6}{:>9.1f}{:>9.1f}{:>9.1f}{:>9.1f}'.format(
+                phase, item['count'], item['p50'] * 1000, item['p90'] * 1000,
+                item['p99'] * 1000, item['max'] * 1000))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
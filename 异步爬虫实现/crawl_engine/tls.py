@@ -0,0 +1,62 @@
+import ssl
+from selectors import EVENT_READ, EVENT_WRITE
+
+
+# https 的 URL 使用的 TLS 连接，各后端共用
+# 原来的爬虫一律连接 80 端口发送明文请求，https 的网站无法下载
+# 非阻塞后端的握手由事件循环驱动：do_handshake 抛出 SSLWantReadError 时等待可读事件，
+# 抛出 SSLWantWriteError 时等待可写事件，事件就绪后再次调用，直到握手完成
+# 同一主机的新连接带上之前连接的会话，服务器支持的话可以跳过完整的握手
+
+
+# 一次运行只创建一个实例，会话只能在创建它的 SSLContext 里复用
+class TLSContext:
+    # cafile 为验证服务器证书用的 CA 证书文件，比如本地测试服务器的自签名证书
+    # verify 为 False 时不验证证书
+    def __init__(self, cafile=None, verify=True):
+        self.context = ssl.create_default_context(cafile=cafile)
+        if not verify:
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self.sessions = {}      # 每个 (主机, 端口) 最近一次连接的会话
+        self.handshakes = 0     # 完成握手的次数
+        self.resumed = 0        # 其中复用会话的次数
+
+    # 包装已连接的套接字，主机名通过 SNI 发给服务器并用来验证证书
+    # 包装之后原来的套接字对象不再可用，文件描述符不变，事件监听不受影响
+    def wrap(self, sock, host, port):
+        return self.context.wrap_socket(
+            sock, server_hostname=host, do_handshake_on_connect=False,
+            session=self.sessions.get((host, port)))
+
+    # 进行握手，完成时返回 None ，否则返回需要等待的事件
+    # 阻塞的套接字调用一次就会完成握手，证书验证失败等错误以 SSLError 异常抛出
+    def handshake(self, sock):
+        try:
+            sock.do_handshake()
+        except ssl.SSLWantReadError:
+            return EVENT_READ
+        except ssl.SSLWantWriteError:
+            return EVENT_WRITE
+        self.handshakes += 1
+        if sock.session_reused:
+            self.resumed += 1
+        return None
+
+    # 保存连接的会话，供同一主机的下一个连接复用
+    # TLS 1.3 的会话票据在握手之后才由服务器发来，所以在收到响应之后调用
+    # 连接失败时套接字可能还没有包装，这时什么都不做
+    # 握手没有完成时读取 session 会抛出 ValueError ，同样跳过
+    def save(self, sock, host, port):
+        if not isinstance(sock, ssl.SSLSocket):
+            return
+        try:
+            session = sock.session
+        except ValueError:
+            return
+        if session is not None:
+            self.sessions[(host, port)] = session
+
+    def status(self):
+        return 'TLS 握手 {} 次，复用会话 {} 次'.format(self.handshakes,
+                                                     self.resumed)
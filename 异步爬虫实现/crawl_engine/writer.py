@@ -0,0 +1,230 @@
+import os
+import queue
+import threading
+
+from .store import open_new
+
+
+# 后台写文件，供非阻塞的后端使用
+# 原来的爬虫在事件循环的回调函数或协程里直接写文件，磁盘慢或者文件大的时候，
+# 一次 write 就会让其它所有连接等着。这里事件循环只把数据片段放进队列，
+# 由专门的写线程写入磁盘。每个线程的队列有长度上限，写线程跟不上时
+# 事件循环在放入数据时等待，内存占用不会无限增长
+# 写入失败时 URL 往往已经报告为成功，写线程记下这些 URL ，
+# 爬取结束后由后端调用 DiskWriter.report 改记为失败
+
+
+# 打开文件并移到 offset 处，断点续传和分段下载时使用
+# size 不为 None 时创建新文件并预先分配 size 个字节，各段的数据写入各自的位置
+def open_at(path, offset, size=None):
+    if size is None:
+        file = open(path, 'r+b')
+    else:
+        file = open_new(path)
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(file.fileno(), 0, size)
+        else:
+            file.truncate(size)
+    file.seek(offset)
+    return file
+
+
+# 写线程的任务
+OPEN = 0
+WRITE = 1
+CLOSE = 2
+ABORT = 3
+REMOVE = 4
+FORGET = 5
+STOP = 6
+
+
+# DiskWriter.open 方法的返回值，用法和文件对象类似，所有方法都只是把任务放进队列
+# 同一个文件的任务由同一个写线程按顺序执行
+class AsyncFile:
+    def __init__(self, worker, path, offset=None, size=None, url=None):
+        self.worker = worker
+        self.path = path
+        self.url = url      # 写入失败时报告的 URL
+        self.file = None    # 真正的文件对象，只在写线程里使用
+        self.error = None   # 打开或写入失败的异常，只在写线程里使用
+        self.done = False   # 关闭时响应是否已经接收完
+        self.opened = False  # 写线程是否打开了 path ，只有打开过才能删除
+        worker.put((OPEN, self, None if offset is None else (offset, size)))
+
+    # data 可能是指向接收缓冲区的 memoryview ，缓冲区会被下次读取覆盖，所以先复制一份
+    def write(self, data):
+        self.worker.put((WRITE, self, bytes(data)))
+
+    # done 为 False 表示响应没有接收完，文件留着续传，写入失败时不算作 URL 的结果
+    def close(self, done=True):
+        self.done = done
+        self.worker.put((CLOSE, self, None))
+
+    # 下载失败时关闭并删除不完整的文件
+    def abort(self):
+        self.worker.put((ABORT, self, None))
+
+
+class WriterThread(threading.Thread):
+    # maxsize 为队列里最多的任务数，fsync 为每关闭多少个文件调用一次 fsync ，0 表示不调用
+    def __init__(self, writer, maxsize, fsync, opener):
+        super().__init__(daemon=True)
+        self.writer = writer
+        self.queue = queue.Queue(maxsize)
+        self.fsync = fsync
+        self.opener = opener
+        self._unsynced = []     # 已写完、等待 fsync 的文件
+
+    def put(self, task):
+        self.queue.put(task)
+
+    def run(self):
+        while True:
+            op, f, data = self.queue.get()
+            if op == STOP:
+                break
+            try:
+                self._execute(op, f, data)
+            except OSError as e:
+                self._discard(f)
+                self.writer.failed(f, e)
+                if op == CLOSE:
+                    self.writer.lost(f)
+        self._sync()
+
+    def _execute(self, op, f, data):
+        if op == REMOVE:
+            self._remove(data)
+        elif op == FORGET:
+            self.writer._forget(data)
+        elif op == OPEN:
+            if data is None:
+                f.file = self.opener(f.path, 'wb')
+            else:
+                f.file = open_at(f.path, *data)
+            f.opened = True
+        elif f.file is None:
+            # 打开或写入失败的文件，后面的任务全部忽略，下载完成时记下 URL
+            if op == CLOSE and f.error is not None:
+                self.writer.lost(f)
+            return
+        elif op == WRITE:
+            f.file.write(data)
+        elif op == CLOSE:
+            if self.fsync:
+                f.file.flush()
+                self._unsynced.append(f)
+                if len(self._unsynced) >= self.fsync:
+                    self._sync()
+            else:
+                f.file.close()
+                f.file = None
+        elif op == ABORT:
+            self._discard(f)
+
+    # 下载或写入失败时关闭并删除不完整的文件
+    # 内容寻址存储的文件有 abort 方法，只删除临时文件
+    # 打开失败时 path 上可能是以前下载的完整文件，不能删除
+    def _discard(self, f):
+        file, f.file = f.file, None
+        opened, f.opened = f.opened, False
+        try:
+            if hasattr(file, 'abort'):
+                file.abort()
+                return
+            if file is not None:
+                file.close()
+            if opened:
+                os.remove(f.path)
+        except OSError:
+            pass
+
+    # 删除为断点续传保留的文件，文件不存在时忽略
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # 把一批文件写入磁盘后关闭，比每个文件单独 fsync 的次数少
+    def _sync(self):
+        while self._unsynced:
+            f = self._unsynced.pop()
+            try:
+                os.fsync(f.file.fileno())
+                f.file.close()
+            except OSError as e:
+                self.writer.failed(f, e)
+                self.writer.lost(f)
+            f.file = None
+
+
+# 写线程池，文件按路径的哈希值分给各个写线程
+class DiskWriter:
+    # workers 为写线程数，queue_size 为每个写线程的队列长度上限
+    # fsync 为每关闭多少个文件调用一次 fsync ，0 表示交给操作系统决定何时写入磁盘
+    # opener 为打开文件的函数，参数和内置的 open 函数相同，默认先删除旧文件再创建
+    # 使用内容寻址存储时传入 store.BlobStore 实例的 open 方法
+    def __init__(self, workers=2, queue_size=256, fsync=0, opener=open_new):
+        self._lock = threading.Lock()
+        self.errors = 0         # 写入失败的文件数
+        self._lost = {}         # 下载完成但写入失败的 URL ，值为异常对象
+        self._threads = [WriterThread(self, queue_size, fsync, opener)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    # offset 不为 None 时打开已有的文件并从 offset 处写入，参数的含义与 open_at 相同
+    # 同一路径总是交给同一个写线程，断点续传和分段下载时同一个文件会打开多次，
+    # 这样后面的打开一定在创建文件之后执行，几个 URL 保存为同一个文件名时也不会同时写入
+    # url 为写入失败时报告的 URL
+    def open(self, path, offset=None, size=None, url=None):
+        thread = self._threads[hash(path) % len(self._threads)]
+        return AsyncFile(thread, path, offset, size, url)
+
+    # 删除文件，排在同一路径之前的任务之后执行
+    # 断点续传的下载最终失败时用它删除保留的不完整文件
+    def remove(self, path):
+        thread = self._threads[hash(path) % len(self._threads)]
+        thread.put((REMOVE, None, path))
+
+    # 不再报告 url 的写入失败，排在同一路径之前的任务之后执行
+    # 下载最终失败、已经报告为失败的 URL 使用
+    def forget(self, path, url):
+        thread = self._threads[hash(path) % len(self._threads)]
+        thread.put((FORGET, None, url))
+
+    # 以下三个方法在写线程里调用
+    # 文件打开、写入或关闭失败时调用
+    def failed(self, f, error):
+        f.error = error
+        with self._lock:
+            self.errors += 1
+        print('文件 {} 写入失败: {}'.format(f.path, error))
+
+    # 文件关闭时已经写入失败，或者关闭本身失败时调用，只记录下载完成的 URL
+    def lost(self, f):
+        if f.url is not None and f.done:
+            with self._lock:
+                self._lost[f.url] = f.error
+
+    def _forget(self, url):
+        with self._lock:
+            self._lost.pop(url, None)
+
+    # close 之后在事件循环所在的线程里调用，results 为 common.Results 实例
+    # 下载完成但写入失败的 URL 改记为失败，并删除缓存记录，下次爬取时重新下载
+    def report(self, results, cache=None):
+        for url, error in self._lost.items():
+            results.write_failed(url, error)
+            if cache is not None:
+                cache.forget(url)
+        self._lost = {}
+
+    # 等待全部任务执行完毕，爬取结束后调用
+    def close(self):
+        for thread in self._threads:
+            thread.put((STOP, None, None))
+        for thread in self._threads:
+            thread.join()
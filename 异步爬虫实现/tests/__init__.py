@@ -0,0 +1,13 @@
+# crawl_engine 的测试，只依赖标准库，在本目录的上一级运行：
+# python -m unittest
+# 需要 greenlet 的测试在没有安装时跳过
+from crawl_engine.backends import get_backend
+
+
+# 后端依赖的第三方库是否已安装
+def has_backend(name):
+    try:
+        get_backend(name)
+    except ImportError:
+        return False
+    return True
@@ -0,0 +1,134 @@
+import os
+import re
+import ssl
+import zlib
+import shutil
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 测试用的本地服务器，在后台线程里运行，端口由系统分配
+# files 为路径到文件内容的字典，支持 ETag 、Range 和 If-Range ，
+# 传入 SSLContext 时作为 https 服务器，握手在处理请求的线程里进行
+# drops 为路径到次数的字典，该路径接下来的这么多次响应只发送一半的响应体就断开连接，
+# 用来模拟下载中途断线；errors 的格式相同，该路径接下来的这么多次请求返回 503
+# requests 按顺序记录收到的每个请求的路径和报头
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+        data = server.files.get(self.path)
+        if data is None:
+            return self.send_status(404)
+        if server.take(server.errors, self.path):
+            return self.send_status(503)
+        etag = '"{:x}"'.format(zlib.crc32(data))
+        status = 200
+        start, end = 0, len(data) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range', etag) == etag:
+            status = 206
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+        body = data[start:end + 1]
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, len(data)))
+        self.end_headers()
+        if server.take(server.drops, self.path):
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def send_status(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, files, context=None):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.files = files
+        self.context = context
+        self.drops = {}
+        self.errors = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.port = self.server_address[1]
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    # counts 里 path 的次数大于 0 时减一并返回 True
+    def take(self, counts, path):
+        with self.lock:
+            count = counts.get(path, 0)
+            if count:
+                counts[path] = count - 1
+            return bool(count)
+
+    def get_request(self):
+        sock, address = super().get_request()
+        if self.context is not None:
+            sock = self.context.wrap_socket(sock, server_side=True,
+                                            do_handshake_on_connect=False)
+        return sock, address
+
+    def finish_request(self, request, client_address):
+        if self.context is not None:
+            try:
+                request.do_handshake()
+            except OSError:
+                return
+        super().finish_request(request, client_address)
+
+    def url(self, path):
+        scheme = 'http' if self.context is None else 'https'
+        return '{}://127.0.0.1:{}{}'.format(scheme, self.port, path)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+# 用 openssl 命令生成 localhost 和 127.0.0.1 的自签名证书，返回 (目录, 证书文件, 私钥文件)
+# 没有 openssl 命令时返回 None ，由调用方跳过测试
+def make_certificate():
+    if shutil.which('openssl') is None:
+        return None
+    directory = tempfile.mkdtemp(prefix='crawl_test_tls_')
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+         '-keyout', key, '-out', cert, '-days', '1', '-subj', '/CN=localhost',
+         '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return directory, cert, key
+
+
+def server_context(cert, key):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
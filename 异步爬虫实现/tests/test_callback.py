@@ -0,0 +1,73 @@
+import time
+import socket
+import tempfile
+import threading
+import unittest
+from selectors import EVENT_WRITE
+
+from crawl_engine.backends.callback import Crawler
+from crawl_engine.buffer import ReadBuffer
+from crawl_engine.common import Config, Download, Results
+from crawl_engine.loop import EventLoop
+from crawl_engine.retry import Backoff
+from crawl_engine.timers import IdleTimeout
+from crawl_engine.tls import TLSContext
+
+
+# selectors 后端的 Crawler 发送请求时，一次发送不完的部分等下次可写时再发送
+# 用 socketpair 代替连接，请求比套接字的发送缓冲区大得多，对端读完整个请求才返回响应
+
+REQUEST = b'GET /a.png HTTP/1.1\r\nX-Pad: ' + b'x' * 4000000 + b'\r\n\r\n'
+RESPONSE = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'
+
+
+class PartialSendTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sock, self.peer = socket.socketpair()
+        self.received = bytearray()
+
+    def tearDown(self):
+        self.sock.close()
+        self.peer.close()
+        self.directory.cleanup()
+
+    # 对端慢慢读取，读完整个请求后返回响应
+    def serve(self):
+        self.peer.settimeout(10)
+        try:
+            while len(self.received) < len(REQUEST):
+                time.sleep(0.001)
+                data = self.peer.recv(65536)
+                if not data:
+                    return
+                self.received += data
+            self.peer.sendall(RESPONSE)
+        except OSError:
+            pass
+
+    def test_large_request(self):
+        loop = EventLoop()
+        config = Config(out_dir=self.directory.name, read_timeout=5)
+        results = Results()
+        crawler = Crawler('http://example.com/a.png', loop, None,
+                          TLSContext(), Backoff(0), None, None, None, results,
+                          config)
+        crawler.download = Download(config, crawler.url)
+        crawler.download.request = lambda keep_alive=False: REQUEST
+        crawler.sock = self.sock
+        crawler.sock.setblocking(False)
+        crawler.buffer = ReadBuffer()
+        crawler.resolved = time.monotonic()
+        crawler.deadline = IdleTimeout(loop, 5, crawler.timeout)
+        loop.register(self.sock.fileno(), EVENT_WRITE, crawler.connected)
+        thread = threading.Thread(target=self.serve)
+        thread.start()
+        loop.run()
+        thread.join()
+        self.assertEqual(bytes(self.received), REQUEST)
+        self.assertEqual((results.succeeded, results.failed), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from crawl_engine.coroutine import CancelledError, Future, Task, sleep
+from crawl_engine.loop import EventLoop
+from crawl_engine.scheduler import Scheduler
+
+
+# 生成器协程框架和调度器，包括 async def 定义的协程
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = EventLoop()
+
+    def schedule(self, make_coro, items):
+        scheduler = Scheduler(self.loop, make_coro, lambda item: item % 2,
+                              concurrency=2, per_host=1)
+        for item in items:
+            scheduler.add(item)
+        return self.loop.run_until_complete(scheduler.join())
+
+    # 等待一个由事件循环设置结果的 Future ，和爬虫等待套接字事件的路径相同
+    def wait(self, value):
+        f = Future()
+        self.loop.call_soon(f.set_value, value)
+        return f
+
+    def test_async_def_coroutine(self):
+        done = []
+
+        async def fetch(item):
+            value = await self.wait(item)
+            if value == 2:
+                raise ValueError(value)
+            done.append(value)
+
+        errors = self.schedule(fetch, range(5))
+        self.assertEqual(sorted(done), [0, 1, 3, 4])
+        self.assertEqual(len(errors), 1)
+        item, error = errors[0]
+        self.assertEqual(item, 2)
+        self.assertIsInstance(error, ValueError)
+
+    def test_generator_coroutine(self):
+        done = []
+
+        def fetch(item):
+            done.append((yield from self.wait(item)))
+
+        self.assertEqual(self.schedule(fetch, range(5)), [])
+        self.assertEqual(sorted(done), list(range(5)))
+
+
+class SleepTest(unittest.TestCase):
+    # 取消正在 sleep 的任务时定时器一起取消，不会让事件循环多等 60 秒
+    def test_cancel_removes_timer(self):
+        loop = EventLoop()
+        task = Task(sleep(loop, 60), loop)
+        loop.call_soon(task.cancel)
+        with self.assertRaises(CancelledError):
+            loop.run_until_complete(task)
+        self.assertTrue(task.cancelled)
+        self.assertIsInstance(task.exception, CancelledError)
+        self.assertEqual(len(loop.timers), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
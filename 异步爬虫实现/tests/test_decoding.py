@@ -0,0 +1,114 @@
+import os
+import gzip
+import zlib
+import tempfile
+import unittest
+from urllib.parse import urlparse
+
+from crawl_engine.common import Config, Download
+from crawl_engine.decoding import MAX_OUTPUT, make_decoder
+from crawl_engine.http_parser import HTTPError, ParseError
+
+
+# 响应体的 gzip / deflate 解压，压缩数据按各种大小切开后逐段传入
+
+DATA = b''.join(b'line %d of a compressible body\n' % i
+                for i in range(20000)) + os.urandom(3000)
+
+
+def raw_deflate(data):
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+ENCODED = {
+    'gzip': gzip.compress(DATA),
+    'deflate': zlib.compress(DATA),      # 标准的 deflate 带 zlib 头
+}
+
+
+class ContentDecoderTest(unittest.TestCase):
+    def decode(self, encoding, body, step):
+        decoder = make_decoder(encoding)
+        out = bytearray()
+        for i in range(0, len(body), step):
+            for data in decoder.decode(body[i:i + step]):
+                self.assertLessEqual(len(data), MAX_OUTPUT)
+                out += data
+        return decoder, bytes(out)
+
+    def check(self, encoding, body):
+        for step in (1, 7, 4096, len(body)):
+            with self.subTest(encoding=encoding, step=step):
+                decoder, out = self.decode(encoding, body, step)
+                self.assertTrue(decoder.eof)
+                self.assertEqual(out, DATA)
+
+    def test_gzip(self):
+        self.check('gzip', ENCODED['gzip'])
+        self.check('x-gzip', ENCODED['gzip'])
+
+    def test_zlib_deflate(self):
+        self.check('deflate', ENCODED['deflate'])
+
+    # 不带 zlib 头的原始 deflate 数据，解压失败后换成原始格式从头解压
+    def test_raw_deflate(self):
+        self.check('Deflate', raw_deflate(DATA))
+
+    def test_truncated(self):
+        for encoding, body in ENCODED.items():
+            with self.subTest(encoding=encoding):
+                decoder, out = self.decode(encoding, body[:len(body) // 2],
+                                           4096)
+                self.assertFalse(decoder.eof)
+                self.assertTrue(DATA.startswith(out))
+
+    def test_corrupt(self):
+        with self.assertRaises(HTTPError):
+            self.decode('gzip', b'not gzip data', 4096)
+
+    def test_identity(self):
+        self.assertIsNone(make_decoder(''))
+        self.assertIsNone(make_decoder(' identity '))
+        with self.assertRaises(HTTPError):
+            make_decoder('br')
+
+
+# 通过 Download 解析完整的响应，压缩数据不完整时在关闭文件时抛出异常
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.config = Config(out_dir=self.directory.name)
+        self.path = os.path.join(self.directory.name, 'a.svg')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def download(self, encoding, body):
+        download = Download(self.config, urlparse('http://example.com/a.svg'))
+        head = ('HTTP/1.1 200 OK\r\nContent-Encoding: {}\r\n'
+                'Content-Length: {}\r\n\r\n').format(encoding, len(body))
+        self.assertIn(b'Accept-Encoding: gzip, deflate', download.request())
+        return download, download.feed(head.encode() + body)
+
+    def test_decoded_file(self):
+        for encoding, body in (('gzip', ENCODED['gzip']),
+                               ('deflate', ENCODED['deflate']),
+                               ('deflate', raw_deflate(DATA))):
+            with self.subTest(encoding=encoding):
+                download, done = self.download(encoding, body)
+                self.assertTrue(done)
+                self.assertEqual((download.received, download.size),
+                                 (len(body), len(DATA)))
+                with open(self.path, 'rb') as f:
+                    self.assertEqual(f.read(), DATA)
+
+    def test_truncated_raises_on_close(self):
+        for encoding, body in ENCODED.items():
+            with self.subTest(encoding=encoding):
+                with self.assertRaises(ParseError):
+                    self.download(encoding, body[:len(body) // 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
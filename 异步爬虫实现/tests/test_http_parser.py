@@ -0,0 +1,115 @@
+import unittest
+
+from crawl_engine.http_parser import ParseError, ResponseParser
+
+
+# 增量式响应解析器，数据按各种方式切开后分多次传入，结果应该相同
+
+CHUNKED = (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+           b'5;name=value\r\nhello\r\n6\r\n world\r\n0\r\n'
+           b'Checksum: abc\r\nExpires: never\r\n\r\n')
+
+
+class ResponseParserTest(unittest.TestCase):
+    # 依次传入各个数据片段，返回解析器、响应体和每次用掉的字节数
+    def parse(self, chunks, method='GET'):
+        body = bytearray()
+        parser = ResponseParser(body.extend, method=method)
+        used = [parser.feed(chunk) for chunk in chunks]
+        return parser, bytes(body), used
+
+    # 每次传入 step 个字节
+    def split(self, data, step):
+        return [data[i:i + step] for i in range(0, len(data), step)]
+
+    def test_content_length(self):
+        data = b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\nX-A: 1\r\n\r\nhello'
+        for step in (1, 2, 3, 7, len(data)):
+            with self.subTest(step=step):
+                parser, body, _ = self.parse(self.split(data, step))
+                self.assertTrue(parser.done)
+                self.assertEqual(body, b'hello')
+                self.assertEqual(parser.status, 200)
+                self.assertEqual(parser.headers['x-a'], '1')
+                self.assertTrue(parser.keep_alive)
+
+    # 块大小行、块数据后的 \r\n 和 trailer 报头都可能被切开
+    def test_chunked_with_trailers(self):
+        for step in (1, 2, 3, 5, 11, len(CHUNKED)):
+            with self.subTest(step=step):
+                parser, body, _ = self.parse(self.split(CHUNKED, step))
+                self.assertTrue(parser.done)
+                self.assertEqual(body, b'hello world')
+
+    # 分隔符 \r\n\r\n 在两次传入的数据之间切开
+    def test_split_delimiter(self):
+        head = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n'
+        for cut in range(len(head) - 4, len(head)):
+            with self.subTest(cut=cut):
+                parser, body, _ = self.parse([head[:cut], head[cut:] + b'ok'])
+                self.assertTrue(parser.done)
+                self.assertEqual(body, b'ok')
+
+    def test_interim_response(self):
+        data = (b'HTTP/1.1 100 Continue\r\n\r\n'
+                b'HTTP/1.1 103 Early Hints\r\nLink: </a.css>\r\n\r\n'
+                b'HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\nabc')
+        for step in (1, 4, len(data)):
+            with self.subTest(step=step):
+                parser, body, _ = self.parse(self.split(data, step))
+                self.assertTrue(parser.done)
+                self.assertEqual(parser.status, 200)
+                self.assertNotIn('link', parser.headers)
+                self.assertEqual(body, b'abc')
+
+    # 响应结束后的数据属于下一个响应，不会被用掉
+    def test_pipelined_remainder(self):
+        first = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'
+        parser, body, used = self.parse([first + b'HTTP/1.1 404'])
+        self.assertEqual(used, [len(first)])
+        self.assertEqual(body, b'ok')
+
+    def test_read_until_close(self):
+        parser, body, _ = self.parse([b'HTTP/1.0 200 OK\r\n\r\nab', b'cd'])
+        self.assertFalse(parser.done)
+        self.assertFalse(parser.keep_alive)
+        parser.feed_eof()
+        self.assertTrue(parser.done)
+        self.assertEqual(body, b'abcd')
+
+    def test_eof_before_end(self):
+        parser, _, _ = self.parse([b'HTTP/1.1 200 OK\r\nContent-Length: 5'
+                                   b'\r\n\r\nhel'])
+        with self.assertRaises(ParseError):
+            parser.feed_eof()
+
+    def test_head_has_no_body(self):
+        parser, body, _ = self.parse(
+            [b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n'], method='HEAD')
+        self.assertTrue(parser.done)
+        self.assertEqual(body, b'')
+
+    # 负数或者带符号、前缀的长度都不接受，否则解析位置会往回走
+    def test_invalid_content_length(self):
+        for length in (b'-5', b'+5', b'5x', b'0x5', b'1_0', b'', b'5, 6'):
+            with self.subTest(length=length):
+                with self.assertRaises(ParseError):
+                    self.parse([b'HTTP/1.1 200 OK\r\nContent-Length: ' +
+                                length + b'\r\n\r\nhello'])
+
+    def test_invalid_chunk_size(self):
+        for size in (b'-a', b'-5', b'+5', b'0x5', b'1_0', b''):
+            with self.subTest(size=size):
+                with self.assertRaises(ParseError):
+                    self.parse([b'HTTP/1.1 200 OK\r\n'
+                                b'Transfer-Encoding: chunked\r\n\r\n' +
+                                size + b'\r\nhello\r\n0\r\n\r\n'])
+
+    def test_bad_chunk_terminator(self):
+        with self.assertRaises(ParseError):
+            self.parse([b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n'
+                        b'\r\n2\r\nokXX0\r\n\r\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+from . import has_backend
+
+if has_backend('greenlet'):
+    from crawl_engine.backends.hub import Hub, Pool
+
+
+# greenlet 后端的协程池
+@unittest.skipUnless(has_backend('greenlet'), '没有安装 greenlet')
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.hub = Hub()
+
+    def tearDown(self):
+        self.hub.resolver.close()
+
+    def test_imap_unordered(self):
+        pool = Pool(self.hub, 3)
+        results = []
+
+        def work(i):
+            self.hub.sleep(0.001 * (i % 4))
+            return i * i
+
+        def feed():
+            results.extend(pool.imap_unordered(work, range(20)))
+
+        self.hub.spawn(feed)
+        self.hub.switch()
+        self.assertEqual(sorted(results), [i * i for i in range(20)])
+        self.assertEqual(pool.created, 3)
+
+    # 池满时在主协程里调用 spawn 报错，不能留下等待的任务，
+    # 否则工作协程之后会切换到主协程
+    def test_spawn_full_pool_from_main(self):
+        pool = Pool(self.hub, 1)
+        first = pool.spawn(lambda: 1)
+        with self.assertRaises(RuntimeError):
+            pool.spawn(lambda: 2)
+        self.assertEqual(len(pool.pending), 0)
+        self.hub.switch()
+        self.assertTrue(first.done)
+        self.assertEqual(pool.finished, 1)
+        self.assertEqual(self.hub.running, 0)
+
+    def test_get_from_main(self):
+        pool = Pool(self.hub, 1)
+        job = pool.spawn(lambda: 1)
+        with self.assertRaises(RuntimeError):
+            job.get()
+        self.hub.switch()
+        self.assertEqual(job.get(), 1)
+        self.assertEqual(self.hub.running, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
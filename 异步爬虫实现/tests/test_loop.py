@@ -0,0 +1,106 @@
+import select
+import socket
+import unittest
+from selectors import EVENT_READ, EVENT_WRITE
+
+from crawl_engine.loop import EpollLoop
+
+
+# 直接使用 epoll 的事件循环，只能在 Linux 上测试
+@unittest.skipUnless(hasattr(select, 'epoll'), '没有 select.epoll')
+class EpollLoopTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = EpollLoop()
+        self.a, self.b = socket.socketpair()
+        self.a.setblocking(False)
+        self.b.setblocking(False)
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+        self.loop.close()
+
+    def test_register_accounting(self):
+        fd = self.a.fileno()
+        self.assertFalse(self.loop._alive())
+        self.loop.register(fd, EVENT_READ, print)
+        self.assertTrue(self.loop.registered(fd))
+        self.assertEqual(self.loop.count, 1)
+        self.loop.modify(fd, EVENT_WRITE, repr)
+        self.assertIs(self.loop.callbacks[fd], repr)
+        self.assertEqual(self.loop.count, 1)
+        self.loop.register(self.b.fileno(), EVENT_READ, print)
+        self.assertEqual(self.loop.count, 2)
+        # 重复注销和注销没有注册过的文件描述符都不影响计数
+        self.loop.unregister(fd)
+        self.loop.unregister(fd)
+        self.loop.unregister(fd + 100)
+        self.assertFalse(self.loop.registered(fd))
+        self.assertEqual(self.loop.count, 1)
+        self.assertTrue(self.loop._alive())
+        self.loop.unregister(self.b.fileno())
+        self.assertEqual(self.loop.count, 0)
+        self.assertFalse(self.loop._alive())
+
+    # 文件描述符关闭后 epoll 已自动移除，注销时忽略错误
+    def test_unregister_closed_fd(self):
+        fd = self.a.fileno()
+        self.loop.register(fd, EVENT_READ, print)
+        self.a.close()
+        self.loop.unregister(fd)
+        self.assertEqual(self.loop.count, 0)
+
+    # 切换事件时内核重新检查就绪状态，已经可写的套接字马上通知
+    def test_modify_switches_events(self):
+        fd = self.a.fileno()
+        self.loop.register(fd, EVENT_READ, print)
+        self.assertEqual(self.loop.select(0), [])
+        self.loop.modify(fd, EVENT_WRITE, print)
+        self.assertEqual([ready for ready, _ in self.loop.select(0)], [fd])
+
+    # 边缘触发：数据分几次到达，回调函数每次都读到 EAGAIN 为止
+    def test_edge_triggered_drain(self):
+        chunks = [b'x' * 100000, b'y' * 10, b'z' * 50000]
+        received = bytearray()
+        wakeups = []
+
+        def readable():
+            wakeups.append(len(received))
+            while True:
+                try:
+                    data = self.a.recv(4096)
+                except BlockingIOError:
+                    return
+                if not data:
+                    self.loop.unregister(self.a.fileno())
+                    return
+                received.extend(data)
+
+        def send(i):
+            self.b.sendall(chunks[i])
+            if i + 1 < len(chunks):
+                self.loop.call_later(0.01, send, i + 1)
+            else:
+                self.b.shutdown(socket.SHUT_WR)
+
+        self.loop.register(self.a.fileno(), EVENT_READ, readable)
+        self.loop.call_later(0, send, 0)
+        self.loop.run()
+        self.assertEqual(bytes(received), b''.join(chunks))
+        self.assertGreaterEqual(len(wakeups), len(chunks))
+        self.assertEqual(self.loop.count, 0)
+
+    # 没有读完时不会再次通知，直到有新的数据到达
+    def test_edge_triggered_notifies_once(self):
+        fd = self.a.fileno()
+        self.loop.register(fd, EVENT_READ, print)
+        self.b.sendall(b'hello')
+        self.assertEqual([ready for ready, _ in self.loop.select(0)], [fd])
+        self.a.recv(1)
+        self.assertEqual(self.loop.select(0), [])
+        self.b.sendall(b'!')
+        self.assertEqual([ready for ready, _ in self.loop.select(0)], [fd])
+
+
+if __name__ == '__main__':
+    unittest.main()
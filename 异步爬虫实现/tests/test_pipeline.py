@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+from crawl_engine.backends import get_backend
+from crawl_engine.common import Config, Results
+
+from .server import Server
+
+
+# selectors 后端的管线化模式，出错的 URL 和普通模式一样按 --retries 重试
+
+FILES = {'/{}.png'.format(i): os.urandom(20000 + i) for i in range(8)}
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.out_dir = self.directory.name
+        self.server = Server(FILES).__enter__()
+
+    def tearDown(self):
+        self.server.__exit__()
+        self.directory.cleanup()
+
+    def crawl(self, retries):
+        config = Config(out_dir=self.out_dir, pipeline=8, retries=retries,
+                        backoff=0.01)
+        results = Results()
+        get_backend('selectors').run(
+            [self.server.url(path) for path in FILES], config, results)
+        return results
+
+    def check_files(self):
+        for path, data in FILES.items():
+            with open(os.path.join(self.out_dir, path[1:]), 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    # 第三个响应是 503 ，剩下的 URL 回退为每个连接一个请求
+    def test_error_response_is_retried(self):
+        self.server.errors['/2.png'] = 1
+        results = self.crawl(retries=2)
+        self.assertEqual((results.succeeded, results.failed), (8, 0))
+        self.check_files()
+
+    # 第三个响应中途断开
+    def test_partial_response_is_retried(self):
+        self.server.drops['/2.png'] = 1
+        results = self.crawl(retries=2)
+        self.assertEqual((results.succeeded, results.failed), (8, 0))
+        self.check_files()
+
+    def test_no_retries(self):
+        self.server.errors['/2.png'] = 1
+        results = self.crawl(retries=0)
+        self.assertEqual((results.succeeded, results.failed), (7, 1))
+        self.assertNotIn('2.png', os.listdir(self.out_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
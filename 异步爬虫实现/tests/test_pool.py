@@ -0,0 +1,54 @@
+import socket
+import unittest
+
+from crawl_engine.coroutine import CancelledError, Task
+from crawl_engine.loop import EventLoop
+from crawl_engine.pool import ConnectionPool
+from crawl_engine.tls import TLSContext
+
+
+# 生成器后端的连接池
+
+
+# 解析器的替身，answer 为 True 时立即返回本机地址，否则永远不返回结果
+class StubResolver:
+    def __init__(self, answer=True):
+        self.answer = answer
+
+    def resolve(self, host, port, callback):
+        if self.answer:
+            callback(('127.0.0.1', port), None)
+
+
+class CancelConnectTest(unittest.TestCase):
+    def setUp(self):
+        # 只监听不 accept ，TCP 连接能建立，TLS 握手一直等不到服务器的数据
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.address = ('https', 'localhost', self.listener.getsockname()[1])
+        self.loop = EventLoop()
+
+    def tearDown(self):
+        self.listener.close()
+
+    # 取消正在新建连接的任务后，名额归还、套接字关闭，事件循环里什么都不剩
+    def cancel_during_connect(self, resolver):
+        pool = ConnectionPool(self.loop, resolver, connect_timeout=30,
+                              tls=TLSContext(verify=False))
+        task = Task(pool.acquire(self.address), self.loop)
+        self.loop.call_later(0.05, task.cancel)
+        with self.assertRaises(CancelledError):
+            self.loop.run_until_complete(task)
+        self.assertEqual(pool._count[self.address], 0)
+        self.assertFalse(self.loop._alive())
+
+    def test_cancel_during_resolve(self):
+        self.cancel_during_connect(StubResolver(answer=False))
+
+    def test_cancel_during_handshake(self):
+        self.cancel_during_connect(StubResolver())
+
+
+if __name__ == '__main__':
+    unittest.main()
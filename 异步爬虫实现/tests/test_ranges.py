@@ -0,0 +1,81 @@
+import os
+import random
+import tempfile
+import unittest
+
+from crawl_engine.backends import get_backend
+from crawl_engine.common import Config, Results
+
+from .server import Server
+
+
+# generator 后端的断点续传和分段下载
+# 服务器支持范围请求，超过 range_threshold MB 的文件分段下载
+
+MID = random.Random(1).randbytes(300000)
+BIG = random.Random(2).randbytes(1200000)
+FILES = {'/mid.bin': MID, '/big.bin': BIG}
+
+
+class RangeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.out_dir = self.directory.name
+        self.server = Server(FILES).__enter__()
+
+    def tearDown(self):
+        self.server.__exit__()
+        self.directory.cleanup()
+
+    def crawl(self, paths, **options):
+        options.setdefault('range_threshold', 1)
+        config = Config(out_dir=self.out_dir, backoff=0.01, **options)
+        results = Results()
+        get_backend('generator').run([self.server.url(path) for path in paths],
+                                     config, results)
+        return results
+
+    def check_file(self, path, data):
+        with open(os.path.join(self.out_dir, path[1:]), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    # 返回某个路径的请求里带的范围报头
+    def ranges(self, path):
+        return [(headers.get('Range'), headers.get('If-Range'))
+                for request_path, headers in self.server.requests
+                if request_path == path]
+
+    # 连接中途断开后，重试用 Range 和 If-Range 只请求剩下的部分
+    def test_resume_after_dropped_connection(self):
+        self.server.drops['/mid.bin'] = 1
+        results = self.crawl(['/mid.bin'], retries=1)
+        self.assertEqual((results.succeeded, results.failed), (1, 0))
+        self.check_file('/mid.bin', MID)
+        ranges = self.ranges('/mid.bin')
+        self.assertEqual(len(ranges), 2)
+        self.assertEqual(ranges[0], (None, None))
+        # 第一个响应发送了一半的响应体
+        self.assertEqual(ranges[1][0], 'bytes={}-{}'.format(len(MID) // 2,
+                                                       len(MID) - 1))
+        self.assertIsNotNone(ranges[1][1])
+
+    def test_parallel_segments(self):
+        results = self.crawl(['/big.bin'])
+        self.assertEqual((results.succeeded, results.failed), (1, 0))
+        self.check_file('/big.bin', BIG)
+        ranges = [value for value, _ in self.ranges('/big.bin')
+                  if value is not None]
+        self.assertGreater(len(ranges), 1)
+
+    # 重试次数用完后，为续传保留的不完整文件和预先分配的文件都要删除
+    def test_failed_download_removes_partial_file(self):
+        self.server.drops['/mid.bin'] = 1
+        # 第一个响应只需要第一段，其它各段的响应都中途断开
+        self.server.drops['/big.bin'] = 1 + 4
+        results = self.crawl(['/mid.bin', '/big.bin'], retries=0)
+        self.assertEqual((results.succeeded, results.failed), (0, 2))
+        self.assertEqual(os.listdir(self.out_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import unittest
+import subprocess
+
+from crawl_engine.loop import EventLoop
+from crawl_engine.resolver import BlockingResolver, ThreadedResolver
+
+from . import has_backend
+
+
+# 主机名的一段超过 63 个字符，IDNA 编码失败，getaddrinfo 抛出 UnicodeError
+LONG_HOST = 'a' * 64 + '.com'
+# 本机上没有监听的端口，连接立即被拒绝
+REFUSED_URL = 'http://127.0.0.1:1/refused.png'
+
+
+class ResolverTest(unittest.TestCase):
+    def test_blocking_resolver_raises_oserror(self):
+        resolver = BlockingResolver()
+        with self.assertRaises(OSError):
+            resolver.resolve(LONG_HOST, 80)
+        # 查询失败后其它线程不能一直等待
+        self.assertEqual(resolver._pending, {})
+
+    def test_threaded_resolver_reports_error(self):
+        loop = EventLoop()
+        resolver = ThreadedResolver(loop)
+        calls = []
+        resolver.resolve(LONG_HOST, 80,
+                         lambda address, error: calls.append((address, error)))
+        loop.run()
+        resolver.close()
+        self.assertEqual(len(calls), 1)
+        address, error = calls[0]
+        self.assertIsNone(address)
+        self.assertIsInstance(error, OSError)
+        # 没有查询进行时取消监听，事件循环才能结束
+        self.assertFalse(resolver._registered)
+
+
+# 每个后端爬取一个主机名过长的 URL 和一个连接被拒绝的 URL ，
+# 两个 URL 都报告为失败，爬虫正常结束
+class LongHostCrawlTest(unittest.TestCase):
+    def crawl(self, backend):
+        with tempfile.TemporaryDirectory() as directory:
+            urls = os.path.join(directory, 'urls.txt')
+            with open(urls, 'w') as f:
+                f.write('http://{}/a.png\n{}\n'.format(LONG_HOST, REFUSED_URL))
+            process = subprocess.run(
+                [sys.executable, '-m', 'crawl_engine', '-b', backend,
+                 '-o', os.path.join(directory, 'pic'), '--retries', '0', urls],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=30)
+        output = process.stdout.decode()
+        self.assertEqual(process.returncode, 0, output)
+        self.assertIn('成功 0 个，失败 2 个', output)
+        self.assertIn(LONG_HOST, output)
+
+    def test_backends(self):
+        for backend in ('blocking', 'threads', 'selectors', 'generator',
+                        'greenlet', 'pyuv'):
+            if not has_backend(backend):
+                continue
+            with self.subTest(backend=backend):
+                self.crawl(backend)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import subprocess
+
+from crawl_engine.common import Config
+from crawl_engine.store import BlobStore, open_new, open_store
+
+from . import has_backend
+from .server import Server
+
+
+# 内容寻址存储，先直接测试 BlobStore ，再通过命令行用 --store 爬取
+# a.png 和 b.png 的内容相同，只保存一份
+
+SAME = os.urandom(30000)
+FILES = {'/a.png': SAME, '/b.png': SAME, '/c.png': os.urandom(30000)}
+BACKENDS = ('blocking', 'threads', 'selectors', 'generator', 'greenlet',
+            'pyuv')
+
+
+class BlobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+        self.store = BlobStore(self.root)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def save(self, name, data):
+        path = os.path.join(self.root, name)
+        f = self.store.open(path)
+        f.write(data[:1000])
+        f.write(data[1000:])
+        f.close()
+        return path
+
+    def blobs(self):
+        return [name for _, dirs, names in os.walk(self.store.blob_dir)
+                for name in names]
+
+    def test_duplicate_is_hard_link(self):
+        a = self.save('a.png', SAME)
+        b = self.save('b.png', SAME)
+        c = self.save('c.png', FILES['/c.png'])
+        for path, data in ((a, SAME), (b, SAME), (c, FILES['/c.png'])):
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+        self.assertTrue(os.path.samefile(a, b))
+        self.assertFalse(os.path.samefile(a, c))
+        self.assertEqual(len(self.blobs()), 2)
+        self.assertEqual((self.store.files, self.store.blobs), (3, 2))
+        self.assertEqual(self.store.bytes_written, 2 * 30000)
+        self.assertEqual(self.store.bytes_saved, 30000)
+
+    # 同一文件名再次保存相同的内容，不留下临时文件
+    def test_same_name_saved_again(self):
+        a = self.save('a.png', SAME)
+        self.save('a.png', SAME)
+        self.assertEqual(os.stat(a).st_nlink, 2)
+        self.assertEqual(os.listdir(self.store.temp_dir), [])
+
+    # 文件名改为指向新内容，其它同内容的文件名不受影响
+    def test_replace_keeps_other_links(self):
+        a = self.save('a.png', SAME)
+        b = self.save('b.png', SAME)
+        self.save('a.png', FILES['/c.png'])
+        with open(b, 'rb') as f:
+            self.assertEqual(f.read(), SAME)
+        self.assertFalse(os.path.samefile(a, b))
+
+    def test_abort_removes_temp_file(self):
+        a = self.save('a.png', SAME)
+        f = self.store.open(a)
+        f.write(b'partial')
+        f.abort()
+        self.assertEqual(os.listdir(self.store.temp_dir), [])
+        with open(a, 'rb') as f:
+            self.assertEqual(f.read(), SAME)
+        self.assertEqual(self.store.files, 1)
+
+    # 不使用存储时先删除旧文件，不会改掉硬链接指向的内容
+    def test_open_new_breaks_link(self):
+        a = self.save('a.png', SAME)
+        b = self.save('b.png', SAME)
+        with open_new(a) as f:
+            f.write(b'new')
+        with open(b, 'rb') as f:
+            self.assertEqual(f.read(), SAME)
+
+    # 多个写线程同时保存相同的内容，只算一份新内容
+    # 竞争不一定每次都出现，所以重复多轮，每轮保存一种新内容
+    def test_concurrent_duplicates(self):
+        threads, rounds = 16, 20
+        barrier = threading.Barrier(threads)
+
+        def save(name, data):
+            f = self.store.open(os.path.join(self.root, name))
+            f.write(data)
+            barrier.wait()
+            f.close()
+
+        for i in range(rounds):
+            data = os.urandom(1000)
+            workers = [threading.Thread(target=save,
+                                        args=('{}-{}.png'.format(i, j), data))
+                       for j in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.assertEqual((self.store.files, self.store.blobs),
+                         (threads * rounds, rounds))
+        self.assertEqual(len(self.blobs()), rounds)
+
+    def test_open_store(self):
+        self.assertIsNone(open_store(Config(out_dir=self.root)))
+        store = open_store(Config(out_dir=self.root, store=True))
+        self.assertIsInstance(store, BlobStore)
+        self.assertTrue(os.path.isdir(store.temp_dir))
+
+
+class StoreCrawlTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server(FILES).__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.__exit__()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.urls = os.path.join(self.directory.name, 'urls.txt')
+        with open(self.urls, 'w') as f:
+            for path in FILES:
+                f.write(self.server.url(path) + '\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # 每个后端用单独的目录，存储里原有的内容会算作重复
+    def crawl(self, backend, out_dir):
+        process = subprocess.run(
+            [sys.executable, '-m', 'crawl_engine', '-b', backend,
+             '-o', out_dir, '--retries', '0', '--store', self.urls],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+        output = process.stdout.decode()
+        self.assertEqual(process.returncode, 0, output)
+        return output
+
+    def test_backends(self):
+        for backend in filter(has_backend, BACKENDS):
+            with self.subTest(backend=backend):
+                out_dir = os.path.join(self.directory.name, backend)
+                output = self.crawl(backend, out_dir)
+                self.assertIn('成功 3 个，失败 0 个', output)
+                self.assertIn('保存文件 3 个，不同内容 2 个', output)
+                for path, data in FILES.items():
+                    with open(os.path.join(out_dir, path[1:]), 'rb') as f:
+                        self.assertEqual(f.read(), data)
+                self.assertTrue(os.path.samefile(
+                    os.path.join(out_dir, 'a.png'),
+                    os.path.join(out_dir, 'b.png')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import re
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from . import has_backend
+from .server import Server, make_certificate, server_context
+
+
+# https 的 URL ，服务器使用临时生成的自签名证书
+# 通过命令行运行爬虫，同时检查 --cafile 和 --insecure 参数
+
+FILES = {'/{}.png'.format(i): os.urandom(40000 + i) for i in range(3)}
+BACKENDS = ('blocking', 'threads', 'selectors', 'generator', 'greenlet')
+
+# 同一时刻只有一个连接时，后面的连接才能用上前一个连接的会话
+SERIAL = {
+    'blocking': [],
+    'threads': ['--threads', '1'],
+    'generator': ['--concurrency', '1', '--idle-timeout', '0'],
+    'greenlet': ['--concurrency', '1'],
+}
+
+
+class TLSTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        certificate = make_certificate()
+        if certificate is None:
+            raise unittest.SkipTest('没有 openssl 命令，无法生成测试证书')
+        cls.cert_dir, cls.cert, key = certificate
+        cls.server = Server(FILES, server_context(cls.cert, key)).__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.__exit__()
+        shutil.rmtree(cls.cert_dir, ignore_errors=True)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.out_dir = os.path.join(self.directory.name, 'pic')
+        self.urls = os.path.join(self.directory.name, 'urls.txt')
+        with open(self.urls, 'w') as f:
+            for path in FILES:
+                f.write(self.server.url(path) + '\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # 运行爬虫，返回成功数、失败数和输出
+    def crawl(self, backend, *args):
+        process = subprocess.run(
+            [sys.executable, '-m', 'crawl_engine', '-b', backend,
+             '-o', self.out_dir, '--retries', '0'] + list(args) + [self.urls],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+        output = process.stdout.decode()
+        self.assertEqual(process.returncode, 0, output)
+        succeeded, failed = re.findall(r'成功 (\d+) 个，失败 (\d+) 个',
+                                       output)[-1]
+        return int(succeeded), int(failed), output
+
+    def check_files(self):
+        for path, data in FILES.items():
+            with open(os.path.join(self.out_dir, path[1:]), 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    def test_cafile(self):
+        for backend in filter(has_backend, BACKENDS):
+            with self.subTest(backend=backend):
+                succeeded, failed, _ = self.crawl(backend, '--cafile',
+                                                  self.cert)
+                self.assertEqual((succeeded, failed), (3, 0))
+                self.check_files()
+
+    # 默认使用系统的 CA 证书，自签名证书验证失败，并且不重试
+    def test_untrusted_certificate(self):
+        for backend in filter(has_backend, BACKENDS):
+            with self.subTest(backend=backend):
+                succeeded, failed, output = self.crawl(backend,
+                                                       '--retries', '3')
+                self.assertEqual((succeeded, failed), (0, 3))
+                self.assertIn('CERTIFICATE_VERIFY_FAILED', output)
+                self.assertNotIn('重试', output)
+
+    def test_insecure(self):
+        for backend in filter(has_backend, BACKENDS):
+            with self.subTest(backend=backend):
+                succeeded, failed, _ = self.crawl(backend, '--insecure')
+                self.assertEqual((succeeded, failed), (3, 0))
+                self.check_files()
+
+    def test_session_resumption(self):
+        for backend in filter(has_backend, SERIAL):
+            with self.subTest(backend=backend):
+                _, _, output = self.crawl(backend, '--cafile', self.cert,
+                                          *SERIAL[backend])
+                self.assertIn('TLS 握手 3 次，复用会话 2 次', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
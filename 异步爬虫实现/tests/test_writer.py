@@ -0,0 +1,115 @@
+import os
+import tempfile
+import unittest
+
+from crawl_engine import shard
+from crawl_engine.backends import get_backend
+from crawl_engine.cache import MetaCache
+from crawl_engine.common import Config, Results
+from crawl_engine.frontier import DONE, FAILED, Frontier
+from crawl_engine.writer import DiskWriter
+
+from . import has_backend
+from .server import Server
+
+
+# 写线程写文件失败时，已经报告成功的 URL 改记为失败
+# 保存路径上预先放一个同名目录，写线程打开文件时出错
+
+FILES = {'/ok.png': os.urandom(30000), '/bad.png': os.urandom(30000)}
+
+
+class WriteFailureTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.out_dir = os.path.join(self.directory.name, 'pic')
+        os.makedirs(os.path.join(self.out_dir, 'bad.png'))
+        self.server = Server(FILES).__enter__()
+        self.urls = [self.server.url(path) for path in FILES]
+
+    def tearDown(self):
+        self.server.__exit__()
+        self.directory.cleanup()
+
+    def config(self, **options):
+        return Config(out_dir=self.out_dir, retries=0,
+                      cache=os.path.join(self.directory.name, 'cache.db'),
+                      **options)
+
+    def check_cache(self):
+        cache = MetaCache(self.config().cache)
+        self.assertIsNotNone(cache.get(self.server.url('/ok.png')))
+        self.assertIsNone(cache.get(self.server.url('/bad.png')))
+        cache.close()
+
+    def test_backends(self):
+        for backend in ('selectors', 'generator', 'greenlet', 'pyuv'):
+            if not has_backend(backend):
+                continue
+            with self.subTest(backend=backend):
+                frontier = Frontier(os.path.join(self.directory.name,
+                                                 backend + '.db'))
+                frontier.add(self.urls)
+                results = Results(frontier.finish)
+                get_backend(backend).run(frontier.claim(10), self.config(),
+                                         results)
+                self.assertEqual((results.succeeded, results.failed), (1, 1))
+                counts = frontier.counts()
+                frontier.close()
+                self.assertEqual((counts[DONE], counts[FAILED]), (1, 1))
+                self.check_cache()
+
+    # 子进程改记的结果通过管道发给父进程
+    def test_processes(self):
+        results = Results()
+        shard.run('selectors', self.urls, self.config(processes=2), results)
+        self.assertEqual((results.succeeded, results.failed), (1, 1))
+        self.check_cache()
+
+
+class OpenFailureTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'a.png')
+        with open(self.path, 'wb') as f:
+            f.write(b'old')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # 打开失败时不删除 path 上原有的文件
+    def test_keeps_existing_file(self):
+        def opener(path, mode):
+            raise PermissionError('不能打开 ' + path)
+
+        writer = DiskWriter(1, opener=opener)
+        f = writer.open(self.path, url='http://example.com/a.png')
+        f.write(b'new')
+        f.abort()
+        writer.close()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+
+    # 打开之后写入失败时删除不完整的文件
+    def test_removes_opened_file(self):
+        class BrokenFile:
+            def write(self, data):
+                raise OSError('磁盘已满')
+
+            def close(self):
+                pass
+
+        writer = DiskWriter(1, opener=lambda path, mode: BrokenFile())
+        f = writer.open(self.path, url='http://example.com/a.png')
+        f.write(b'new')
+        f.close()
+        writer.close()
+        self.assertFalse(os.path.exists(self.path))
+        results = Results()
+        results.success('http://example.com/a.png')
+        writer.report(results)
+        self.assertEqual((results.succeeded, results.failed), (0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,38 @@
+import os
+import hashlib
+
+from scrapy.pipelines.files import FSFilesStore
 from scrapy.pipelines.images import ImagesPipeline
 from scrapy import Request
 
+
+# 相同内容的图片只保存一份
+# 图片按内容的 SHA-256 保存在 IMAGES_STORE 下的 .blobs 目录里，
+# 按 imgname 命名的文件是指向它的硬链接
+class BlobFilesStore(FSFilesStore):
+    def persist_file(self, path, buf, info, meta=None, headers=None):
+        data = buf.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        blob = os.path.join(str(self.basedir), '.blobs', digest[:2],
+                            digest[2:4], digest)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            with open(blob + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(blob + '.tmp', blob)
+        target = os.path.join(str(self.basedir), path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            if os.path.samefile(blob, target):
+                return
+            os.remove(target)
+        os.link(blob, target)
+
+
 class ChangeNamePipeline(ImagesPipeline):
+    STORE_SCHEMES = dict(ImagesPipeline.STORE_SCHEMES,
+                         **{'': BlobFilesStore, 'file': BlobFilesStore})
+
     def get_media_requests(self, item, info):
         for i in item['imgurl']:
             yield Request(i, meta={'name': item['imgname'][item['imgurl'].index(i)]})